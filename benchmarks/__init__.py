@@ -0,0 +1,9 @@
+"""بنچمارک‌های NEXA
+
+اجرا از ریشه مخزن؛ هر اسکریپت در یک پوشه موقت کار می‌کند و به nexa.db دست نمی‌زند:
+    python -m benchmarks.suite --scale small --json bench.json
+    python -m benchmarks.suite --scale small --compare bench.json
+    python -m benchmarks.datagen --scale large --out /tmp/nexa-large
+    python -m benchmarks.search_fts --rows 120000
+    python -m benchmarks.id_stress --procs 4 --threads 8 --inserts 500
+"""
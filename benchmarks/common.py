@@ -0,0 +1,97 @@
+"""ابزار مشترک بنچمارک‌ها: بارگذاری لایه داده main.py، صدک‌ها، حافظه و شمارش کوئری"""
+import os
+import math
+import sqlite3
+import resource
+import threading
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PY = os.path.join(ROOT, "main.py")
+
+
+def load_app(path: str = MAIN_PY, src: str | None = None):
+    """لایه داده main.py (تا پیش از بخش Streamlit config) در پوشه جاری؛ src متن نسخه دیگری از فایل است"""
+    if src is None:
+        with open(path, encoding="utf-8") as f:
+            src = f.read()
+    ns = {"__name__": "nexa_bench"}
+    exec(compile(src.split("# Streamlit config", 1)[0], path, "exec"), ns)
+    return ns
+
+
+def percentile(sorted_samples, q: float) -> float:
+    """صدک q (بین ۰ و ۱) با روش nearest-rank"""
+    if not sorted_samples:
+        return float("nan")
+    return sorted_samples[max(0, math.ceil(q * len(sorted_samples)) - 1)]
+
+
+def summarize(samples_ms) -> dict:
+    s = sorted(samples_ms)
+    return {
+        "n": len(s),
+        "p50_ms": round(percentile(s, 0.50), 3),
+        "p95_ms": round(percentile(s, 0.95), 3),
+        "p99_ms": round(percentile(s, 0.99), 3),
+        "max_ms": round(s[-1], 3) if s else None,
+    }
+
+
+def peak_rss_kb() -> int:
+    """بیشینه RSS این process تا این لحظه (لینوکس: کیلوبایت)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class QueryCounter:
+    """شمارش دستورهای SQL همه اتصال‌های SQLite این process.
+
+    install() باید پیش از باز شدن اتصال‌ها صدا زده شود. trace فقط داخل counting()
+    فعال است تا زمان‌سنجی‌ها هزینه callback را نداشته باشند. دستورهای داخل
+    trigger («-- TRIGGER ...») جدا شمرده نمی‌شوند.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._conns = []
+        self._active = False
+
+    def install(self) -> "QueryCounter":
+        real_connect = sqlite3.connect
+
+        def connect(*args, **kwargs):
+            conn = real_connect(*args, **kwargs)
+            with self._lock:
+                self._conns.append(conn)
+                if self._active:
+                    conn.set_trace_callback(self._trace)
+            return conn
+
+        sqlite3.connect = connect
+        return self
+
+    def _trace(self, sql: str):
+        if not sql.startswith("--"):
+            self.count += 1
+
+    def _set(self, cb):
+        with self._lock:
+            self._active = cb is not None
+            for conn in self._conns:
+                try:
+                    conn.set_trace_callback(cb)
+                except sqlite3.ProgrammingError:  # اتصال بسته شده
+                    pass
+
+    @contextmanager
+    def counting(self):
+        """تعداد دستورهای اجراشده داخل بلوک در c["n"]"""
+        c = {"n": 0}
+        self._set(self._trace)
+        start = self.count
+        try:
+            yield c
+        finally:
+            c["n"] = self.count - start
+            self._set(None)
@@ -0,0 +1,344 @@
+"""ساخت داده مصنوعی و قطعی (با seed ثابت) برای nexa.db در اندازه‌های مختلف
+
+اجرا از ریشه مخزن:
+    python -m benchmarks.datagen --scale small --out /tmp/nexa-small
+
+متن‌ها فارسی با توزیع Zipf کلمات است. پیوست‌ها از یک مجموعه فایل با نوع و اندازه
+واقعی‌نما انتخاب می‌شوند (عکس JPEG/PNG واقعی، PDF، ویدیو و صوت)؛ چون blob store
+فایل‌ها را با sha256 یکی می‌کند، حجم دیسک به اندازه همین مجموعه است نه تعداد محتواها.
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+from typing import NamedTuple
+
+from benchmarks.common import load_app
+
+
+class Scale(NamedTuple):
+    users: int
+    referees: int
+    submissions: int
+    likes: int
+    comments: int
+    topics: int
+    research: int
+    documents: int
+    forum_posts: int
+    blobs: int  # تعداد فایل‌های متمایز پیوست
+
+
+SCALES = {
+    "tiny": Scale(200, 24, 1_000, 10_000, 5_000, 40, 40, 20, 300, 24),
+    "small": Scale(2_000, 120, 10_000, 100_000, 50_000, 200, 200, 50, 2_000, 60),
+    "large": Scale(10_000, 600, 50_000, 1_000_000, 1_000_000, 1_000, 1_000, 200, 10_000, 160),
+}
+
+# زمان ثابت تا خروجی به ساعت اجرا وابسته نباشد؛ داده‌ها در یک سال قبل از آن پخش می‌شوند
+BASE_TS = 1_735_000_000.0
+SPAN_S = 365 * 86400
+
+# کلمات با املای مختلف (ی/ک عربی، نیم‌فاصله، ارقام فارسی) تا یکسان‌سازی هم سنجیده شود
+WORDS = [
+    "بتن", "آسفالت", "ایمنی", "کارگاه", "پروژه", "نقشه‌برداری", "مدیریت", "کیفیت", "ماشین‌آلات",
+    "هوش", "مصنوعی", "برنامه‌ریزی", "کنترل", "مالی", "حسابداری", "فتوگرامتری", "معماری", "منظر",
+    "جوشکاری", "پل", "تونل", "راه", "سازه", "زلزله", "مقاومت", "آزمایش", "نمونه", "گزارش",
+    "يكپارچه", "تكنولوژي", "مي‌خواهيم", "۱۴۰۳", "٢٠٢٤", "BIM", "HSSE", "ICT", "QC",
+]
+LETTERS = "ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی"
+FIRST_NAMES = ["علی", "محمد", "حسین", "رضا", "مهدی", "زهرا", "فاطمه", "مریم", "سارا", "نرگس",
+               "امیر", "حمید", "سعید", "لیلا", "الهام", "مجید", "کاوه", "نازنین", "پریسا", "بهرام"]
+LAST_NAMES = ["محمدی", "حسینی", "احمدی", "رضایی", "کریمی", "موسوی", "جعفری", "صادقی", "رحیمی",
+              "باقری", "کاظمی", "نوری", "یوسفی", "قاسمی", "شریفی", "اکبری", "طاهری", "مرادی"]
+
+STATUSES = [("published", 55), ("pending", 15), ("waiting_referee", 10), ("waiting_manager", 5),
+            ("correction_needed", 8), ("rejected", 7)]
+DECISIONS = ["recommend_publish", "correction_needed", "rejected"]
+
+
+class BlobKind(NamedTuple):
+    mime: str
+    ext: str
+    weight: int
+    median_kb: int  # برای عکس‌ها استفاده نمی‌شود؛ اندازه از خود فشرده‌سازی درمی‌آید
+    max_kb: int
+
+
+BLOB_KINDS = [
+    BlobKind("image/jpeg", ".jpg", 40, 0, 0),
+    BlobKind("image/png", ".png", 8, 0, 0),
+    BlobKind("application/pdf", ".pdf", 25, 400, 20_000),
+    BlobKind("video/mp4", ".mp4", 12, 6_000, 60_000),
+    BlobKind("audio/mpeg", ".mp3", 10, 3_000, 15_000),
+    BlobKind("application/vnd.openxmlformats-officedocument.wordprocessingml.document", ".docx", 5, 120, 5_000),
+]
+MAGIC = {"application/pdf": b"%PDF-1.4\n", "video/mp4": b"\x00\x00\x00\x18ftypmp42", "audio/mpeg": b"ID3\x04\x00",
+         "application/vnd.openxmlformats-officedocument.wordprocessingml.document": b"PK\x03\x04"}
+ATTACH_RATIO = 0.85
+
+
+class Text:
+    """واژگان مصنوعی با توزیع Zipf تا بسامد کلمات شبیه متن واقعی باشد"""
+
+    def __init__(self, rng: random.Random, size: int = 20_000):
+        self.rng = rng
+        self.words = list(WORDS) + ["".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 7)))
+                                    for _ in range(size)]
+        self.cum = zipf_cum(len(self.words), 8)
+
+    def sentence(self, n: int) -> str:
+        return " ".join(self.rng.choices(self.words, cum_weights=self.cum, k=n))
+
+
+def zipf_cum(n: int, offset: float = 1.0):
+    cum, total = [], 0.0
+    for rank in range(n):
+        total += 1 / (rank + offset)
+        cum.append(total)
+    return cum
+
+
+def _image_bytes(rng: random.Random, mime: str) -> bytes:
+    from PIL import Image
+
+    # نویز کوچک بزرگ‌نمایی‌شده: فشرده‌پذیری نزدیک به عکس واقعی، نه نویز خالص
+    w = rng.randint(800, 2400) if mime == "image/jpeg" else rng.randint(300, 900)
+    h = w * 3 // 4
+    small = Image.frombytes("RGB", (w // 16, h // 16), rng.randbytes((w // 16) * (h // 16) * 3))
+    img = small.resize((w, h), Image.BICUBIC)
+    out = io.BytesIO()
+    if mime == "image/jpeg":
+        img.save(out, "JPEG", quality=85)
+    else:
+        img.save(out, "PNG")
+    return out.getvalue()
+
+
+def _blob_bytes(rng: random.Random, kind: BlobKind) -> bytes:
+    if kind.mime.startswith("image/"):
+        return _image_bytes(rng, kind.mime)
+    kb = min(kind.max_kb, max(4, int(rng.lognormvariate(0, 0.8) * kind.median_kb)))
+    return MAGIC.get(kind.mime, b"") + rng.randbytes(kb * 1024)
+
+
+def _ulid(app, rng: random.Random, prefix: str, ts: float) -> str:
+    return prefix + app["ulid_at"](int(ts * 1000), rng.getrandbits(80))
+
+
+def _ts(rng: random.Random) -> float:
+    return BASE_TS - rng.random() * SPAN_S
+
+
+def _person(rng: random.Random):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _nid(rng: random.Random) -> str:
+    return f"{rng.randrange(10**10):010d}"
+
+
+def generate(app, scale: Scale, seed: int = 1, log=print) -> dict:
+    """پر کردن پایگاه داده خالی (پس از db_init)؛ تعداد ردیف‌های هر جدول را برمی‌گرداند"""
+    rng = random.Random(seed)
+    text = Text(rng)
+    fields, ctypes = app["FIELDS"], app["CONTENT_TYPES"]
+    db_tx = app["db_tx"]
+    t0 = time.perf_counter()
+
+    def step(name, n):
+        log(f"  {name:<12}{n:>10,}  {time.perf_counter() - t0:7.1f}s")
+
+    # ---- پیوست‌ها ----
+    store = app["blob_store"]()
+    blobs = []
+    kinds_cum = [sum(k.weight for k in BLOB_KINDS[:i + 1]) for i in range(len(BLOB_KINDS))]
+    with db_tx() as conn:
+        for _ in range(scale.blobs):
+            kind = rng.choices(BLOB_KINDS, cum_weights=kinds_cum)[0]
+            staged = store.stage([_blob_bytes(rng, kind)], kind.mime)
+            blobs.append((store.commit(conn, staged), staged.size, kind))
+    step("blobs (KB)", sum(b[1] for b in blobs) // 1024)
+
+    def attachment():
+        if rng.random() >= ATTACH_RATIO:
+            return (None, None, None, None)
+        sha, size, kind = rng.choice(blobs)
+        return (f"{text.sentence(2).replace(' ', '_')}{kind.ext}", kind.mime, sha, size)
+
+    # ---- کاربران و داوران ----
+    users = []
+    for i in range(scale.users):
+        first, last = _person(rng)
+        users.append((f"0912{i:07d}", f"{first} {last}", _nid(rng), "x", _ts(rng)))
+    referees = []
+    for i in range(scale.referees):
+        first, last = _person(rng)
+        referees.append((f"0935{i:07d}", first, last, _nid(rng), fields[i % len(fields)], "x",
+                         0 if rng.random() < 0.1 else 1, _ts(rng)))
+    with db_tx() as conn:
+        conn.executemany("INSERT INTO users(phone,name,nid,password,created_ts) VALUES(?,?,?,?,?)", users)
+        conn.executemany("INSERT INTO referees(phone,first_name,last_name,nid,field,password,is_active,created_ts) "
+                         "VALUES(?,?,?,?,?,?,?,?)", referees)
+    step("users", len(users))
+    step("referees", len(referees))
+    refs_by_field = {}
+    for r in referees:
+        refs_by_field.setdefault(r[4], []).append(r)
+
+    # ---- موضوعات، تحقیقات، اسناد ----
+    with db_tx() as conn:
+        for table, n, body in (("topics", scale.topics, "description"), ("research", scale.research, "summary")):
+            prefix = "top" if table == "topics" else "res"
+            rows = []
+            for _ in range(n):
+                ts = _ts(rng)
+                fname, fmime, sha, size = attachment()
+                rows.append((_ulid(app, rng, prefix, ts), text.sentence(rng.randint(3, 7)), rng.choice(fields),
+                             text.sentence(rng.randint(30, 120)), fname or "", fmime or "", sha, size, ts))
+            conn.executemany(f"INSERT INTO {table}(id,title,field,{body},file_name,file_mime,file_sha256,file_size,"
+                             "created_ts) VALUES(?,?,?,?,?,?,?,?,?)", rows)
+            step(table, n)
+        rows = []
+        for _ in range(scale.documents):
+            ts = _ts(rng)
+            sha, size, kind = rng.choice(blobs)
+            rows.append((_ulid(app, rng, "doc", ts), text.sentence(rng.randint(3, 6)),
+                         f"{text.sentence(2).replace(' ', '_')}{kind.ext}", kind.mime, sha, size, ts))
+        conn.executemany("INSERT INTO documents(id,title,file_name,file_bytes,file_mime,file_sha256,file_size,"
+                         "created_ts) VALUES(?,?,?,X'',?,?,?,?)", rows)
+        step("documents", len(rows))
+
+    # ---- محتواها و ارجاعات ----
+    statuses, status_w = zip(*STATUSES)
+    status_cum = [sum(status_w[:i + 1]) for i in range(len(status_w))]
+    # چند کاربر پرکار و بسیاری کم‌کار
+    sender_cum = zipf_cum(len(users), 4)
+    subs, assigns = [], []
+    published = []
+    for i in range(scale.submissions):
+        ts = _ts(rng)
+        sender = rng.choices(users, cum_weights=sender_cum)[0]
+        field_ = rng.choice(fields)
+        status = rng.choices(statuses, cum_weights=status_cum)[0]
+        sid = _ulid(app, rng, "s", ts)
+        fname, fmime, sha, size = attachment()
+        subs.append((sid, text.sentence(rng.randint(3, 9)), text.sentence(rng.randint(20, 150)),
+                     sender[0], sender[1], sender[2], "", field_, rng.choice(ctypes),
+                     fname, fmime, sha, size, status, rng.randint(0, 5000) if status == "published" else 0,
+                     f"NX-{i:06d}" if status == "published" else "", ts))
+        if status == "published":
+            published.append(sid)
+        if status != "pending" and refs_by_field.get(field_):
+            for ref in rng.sample(refs_by_field[field_], min(len(refs_by_field[field_]), rng.randint(1, 3))):
+                a_ts = ts + rng.uniform(3600, 5 * 86400)
+                done = status != "waiting_referee" or rng.random() < 0.3
+                assigns.append((_ulid(app, rng, "a", a_ts), sid, ref[0], f"{ref[1]} {ref[2]}", field_,
+                                rng.choice(DECISIONS) if done else "waiting_referee",
+                                text.sentence(rng.randint(5, 25)) if done else "",
+                                rng.randint(40, 100) if done else 0, "",
+                                a_ts + rng.uniform(3600, 20 * 86400) if done else None, a_ts))
+    with db_tx() as conn:
+        conn.executemany("""
+        INSERT INTO submissions(id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,
+                                content_type,file_name,file_mime,file_sha256,file_size,status,views,knowledge_code,created_ts)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """, subs)
+        step("submissions", len(subs))
+        # ترتیب زمانی ارجاع‌ها برای triggerهای referee_load (آخرین ارجاع و میانگین تأخیر)
+        assigns.sort(key=lambda a: a[-1])
+        conn.executemany("""
+        INSERT INTO submission_assignments(id,submission_id,referee_phone,referee_name,referee_field,decision,
+                                           feedback,score,suggested_knowledge_code,reviewed_ts,created_ts)
+        VALUES(?,?,?,?,?,'waiting_referee','',0,'',NULL,?)
+        """, [(a[0], a[1], a[2], a[3], a[4], a[10]) for a in assigns])
+        conn.executemany("""
+        UPDATE submission_assignments SET decision=?, feedback=?, score=?, reviewed_ts=? WHERE id=?
+        """, [(a[5], a[6], a[7], a[9], a[0]) for a in assigns if a[9] is not None])
+        step("assignments", len(assigns))
+
+    # ---- لایک‌ها و نظرات (محبوبیت Zipf روی محتواهای منتشرشده) ----
+    pop_cum = zipf_cum(len(published), 20)
+    with db_tx() as conn:
+        target = min(scale.likes, len(published) * len(users))
+        likes = 0
+        # جفت‌های تکراری نادیده گرفته می‌شوند؛ تا رسیدن به تعداد هدف ادامه می‌دهیم
+        while likes < target:
+            conn.executemany(
+                "INSERT INTO submission_likes(submission_id,user_phone,created_ts) VALUES(?,?,?) "
+                "ON CONFLICT(submission_id,user_phone) DO NOTHING",
+                [(rng.choices(published, cum_weights=pop_cum)[0], rng.choice(users)[0], _ts(rng))
+                 for _ in range(min(target - likes, 100_000))])
+            likes = conn.execute("SELECT COUNT(*) FROM submission_likes").fetchone()[0]
+    step("likes", likes)
+
+    with db_tx() as conn:
+        for start in range(0, scale.comments, 100_000):
+            rows = []
+            for _ in range(min(100_000, scale.comments - start)):
+                ts = _ts(rng)
+                u = rng.choice(users)
+                rows.append((_ulid(app, rng, "c", ts), rng.choices(published, cum_weights=pop_cum)[0], u[1],
+                             text.sentence(rng.randint(3, 30)), ts))
+            conn.executemany("INSERT INTO submission_comments(id,submission_id,user_name,text,created_ts) "
+                             "VALUES(?,?,?,?,?)", rows)
+    step("comments", scale.comments)
+
+    # ---- تالار گفتگو ----
+    posts, replies = [], []
+    for _ in range(scale.forum_posts):
+        ts = _ts(rng)
+        u = rng.choice(users)
+        status = rng.choices(["approved", "pending", "rejected"], weights=[70, 20, 10])[0]
+        pid = _ulid(app, rng, "fp", ts)
+        posts.append((pid, u[0], u[1], "user", text.sentence(rng.randint(10, 60)), status, ts))
+        if status == "approved" and referees:
+            for _ in range(rng.choice([0, 0, 1, 1, 2])):
+                r = rng.choice(referees)
+                r_ts = ts + rng.uniform(600, 3 * 86400)
+                replies.append((_ulid(app, rng, "fr", r_ts), pid, r[0], f"{r[1]} {r[2]}",
+                                text.sentence(rng.randint(10, 50)), r_ts))
+    with db_tx() as conn:
+        conn.executemany("INSERT INTO forum_posts(id,sender_phone,sender_name,sender_role,text,status,created_ts) "
+                         "VALUES(?,?,?,?,?,?,?)", posts)
+        conn.executemany("INSERT INTO forum_replies(id,post_id,referee_phone,referee_name,text,created_ts) "
+                         "VALUES(?,?,?,?,?,?)", replies)
+    step("forum", len(posts) + len(replies))
+
+    # بدون ANALYZE: برنامه هم sqlite_stat1 نمی‌سازد و planner باید همان تصمیم‌های محیط واقعی را بگیرد
+    with app["db_conn"]() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    counts = {}
+    with app["db_conn"]() as conn:
+        for table in ("users", "referees", "submissions", "submission_assignments", "submission_likes",
+                      "submission_comments", "topics", "research", "documents", "forum_posts", "forum_replies",
+                      "blobs"):
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    counts["blob_bytes"] = sum(b[1] for b in blobs)
+    counts["seconds"] = round(time.perf_counter() - t0, 2)
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", choices=list(SCALES), default="small")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", required=True, help="پوشه خروجی (nexa.db و blobs/ در آن ساخته می‌شوند)")
+    args = ap.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    os.chdir(args.out)
+    if os.path.exists("nexa.db"):
+        print(f"{args.out}/nexa.db already exists", file=sys.stderr)
+        return 1
+    app = load_app()
+    app["db_init"]()
+    counts = generate(app, SCALES[args.scale], args.seed)
+    print(counts)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
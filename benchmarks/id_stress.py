@@ -0,0 +1,94 @@
+"""تست فشار درج هم‌زمان با make_id (چند process × چند thread)
+
+اجرا از ریشه مخزن:
+    python -m benchmarks.id_stress --procs 4 --threads 8 --inserts 500
+
+هر thread نظر (submission_comments) درج می‌کند. در پایان بررسی می‌شود که هیچ درجی به
+خاطر تکراری بودن کلید شکست نخورده، همه شناسه‌ها یکتا هستند و شناسه‌های هر thread صعودی‌اند.
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+
+from benchmarks.common import load_app
+
+SUB_ID = "s00000000000000000000000000"
+
+
+def worker(workdir: str, proc: int, threads: int, inserts: int, out: "mp.Queue"):
+    os.chdir(workdir)
+    app = load_app()
+    results = []
+
+    def run(t: int):
+        ids, collisions = [], 0
+        for i in range(inserts):
+            cid = app["make_id"]("c")
+            try:
+                app["db_comment_add"](cid, SUB_ID, f"p{proc}t{t}", str(i))
+                ids.append(cid)
+            except sqlite3.IntegrityError:
+                collisions += 1
+        results.append((proc, t, ids, collisions))
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    out.put(results)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--inserts", type=int, default=500)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nexa-idstress-")
+    os.chdir(workdir)
+    app = load_app()
+    app["db_init"]()
+    with app["db_tx"]() as conn:
+        conn.execute("INSERT INTO users(phone,name,nid,password,created_ts) VALUES('09120000000','x','0','x',?)", (time.time(),))
+        conn.execute(
+            "INSERT INTO submissions(id,title,description,sender_phone,sender_name,sender_nid,field,content_type,"
+            "status,created_ts) VALUES(?,'t','d','09120000000','x','0','f','t','published',?)", (SUB_ID, time.time()))
+
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    t0 = time.perf_counter()
+    procs = [ctx.Process(target=worker, args=(workdir, p, args.threads, args.inserts, out)) for p in range(args.procs)]
+    for p in procs:
+        p.start()
+    results = [r for _ in procs for r in out.get()]
+    for p in procs:
+        p.join()
+    took = time.perf_counter() - t0
+
+    expected = args.procs * args.threads * args.inserts
+    all_ids = [cid for (_p, _t, ids, _c) in results for cid in ids]
+    collisions = sum(c for (_p, _t, _ids, c) in results)
+    unordered = sum(1 for (_p, _t, ids, _c) in results if ids != sorted(ids))
+    with app["db_conn"]() as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM submission_comments").fetchone()[0]
+        by_ts = [r[0] for r in conn.execute("SELECT id FROM submission_comments ORDER BY created_ts, id")]
+    # نسبت جفت‌های متوالی (به ترتیب زمان درج) که ترتیب شناسه‌شان هم درست است
+    in_order = sum(1 for a, b in zip(by_ts, by_ts[1:]) if a < b) / max(1, len(by_ts) - 1)
+
+    print(f"inserts={expected} stored={stored} unique={len(set(all_ids))} collisions={collisions} "
+          f"threads_out_of_order={unordered}")
+    print(f"{took:.2f}s ({expected / took:,.0f} inserts/s), id order matches created_ts for {in_order:.2%} of neighbours")
+    ok = stored == expected == len(set(all_ids)) and collisions == 0 and unordered == 0
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
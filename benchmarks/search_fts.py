@@ -0,0 +1,105 @@
+"""بنچمارک جستجوی FTS5 روی ۱۰۰ هزار+ ردیف
+
+اجرا از ریشه مخزن:
+    python -m benchmarks.search_fts --rows 120000
+
+پایگاه داده در یک پوشه موقت ساخته می‌شود و به nexa.db دست نمی‌زند.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from benchmarks.common import load_app
+from benchmarks.datagen import Text
+
+QUERIES = ["بتن", "ایمنی کارگاه", "یکپارچه", "تکنولوژی", "1403", "مدیریت پروژه", "BIM", "زلز", "مقاومت بتن آزمایش"]
+
+
+def populate(app, rows: int, text: Text) -> float:
+    now = time.time()
+    share = {"submissions": 0.6, "topics": 0.15, "research": 0.1, "forum_posts": 0.15}
+    t0 = time.perf_counter()
+    with app["db_tx"]() as conn:
+        conn.execute("INSERT INTO users(phone,name,nid,password,created_ts) VALUES('09120000000','بنچ','0','x',?)", (now,))
+        conn.executemany(
+            "INSERT INTO submissions(id,title,description,sender_phone,sender_name,sender_nid,field,content_type,"
+            "status,created_ts) VALUES(?,?,?,'09120000000','بنچ','0','f','t',?,?)",
+            ((f"s{i}", text.sentence(5), text.sentence(40), "published" if i % 5 else "pending", now - i)
+             for i in range(int(rows * share["submissions"]))),
+        )
+        conn.executemany(
+            "INSERT INTO topics(id,title,field,description,created_ts) VALUES(?,?,'f',?,?)",
+            ((f"t{i}", text.sentence(4), text.sentence(30), now - i) for i in range(int(rows * share["topics"]))),
+        )
+        conn.executemany(
+            "INSERT INTO research(id,title,field,summary,created_ts) VALUES(?,?,'f',?,?)",
+            ((f"r{i}", text.sentence(4), text.sentence(60), now - i) for i in range(int(rows * share["research"]))),
+        )
+        conn.executemany(
+            "INSERT INTO forum_posts(id,sender_phone,sender_name,sender_role,text,status,created_ts) "
+            "VALUES(?,'09120000000','بنچ','user',?,?,?)",
+            ((f"f{i}", text.sentence(25), "approved" if i % 3 else "pending", now - i)
+             for i in range(int(rows * share["forum_posts"]))),
+        )
+    return time.perf_counter() - t0
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return out, statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=120_000)
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nexa-bench-")
+    os.chdir(workdir)
+    app = load_app()
+    app["db_init"]()
+
+    took = populate(app, args.rows, Text(random.Random(args.seed)))
+    with app["db_conn"]() as conn:
+        indexed = conn.execute("SELECT COUNT(*) FROM search_docs").fetchone()[0]
+    print(f"rows={args.rows} indexed={indexed} insert+index={took:.2f}s ({args.rows / took:,.0f} rows/s)")
+
+    # املای عربی و فارسی باید نتیجه یکسان بدهند
+    a, _ = app["db_search"]("يكپارچه تكنولوژي", limit=1000)
+    b, _ = app["db_search"]("یکپارچه تکنولوژی", limit=1000)
+    assert [r[1] for r in a] == [r[1] for r in b], "normalization mismatch"
+
+    with app["db_conn"]() as conn:
+        for row in conn.execute("EXPLAIN QUERY PLAN SELECT d.kind FROM search_fts JOIN search_docs d "
+                                "ON d.doc_id = search_fts.rowid WHERE search_fts MATCH 'x' "
+                                "AND d.kind IN (SELECT value FROM json_each('[]'))"):
+            print("plan:", row[3])
+
+    print(f"{'query':<22}{'hits(p1)':>9}{'fts p50':>10}{'fts p95':>10}{'page5 p50':>11}{'LIKE p50':>10}")
+    for q in QUERIES:
+        (rows, _more), p50, p95 = timed(lambda: app["db_search"](q, limit=20), args.repeat)
+        _, page5, _ = timed(lambda: app["db_search"](q, limit=20, offset=80), args.repeat)
+        like = "%" + q.split()[0] + "%"
+        with app["db_conn"]() as conn:
+            _, like50, _ = timed(lambda: conn.execute(
+                "SELECT id FROM submissions WHERE status='published' AND (title LIKE ? OR description LIKE ?) "
+                "ORDER BY created_ts DESC LIMIT 20",
+                (like, like)).fetchall(), max(3, args.repeat // 5))
+        print(f"{q:<22}{len(rows):>9}{p50:>9.2f}ms{p95:>9.2f}ms{page5:>10.2f}ms{like50:>9.2f}ms")
+
+    print(f"workdir: {workdir}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,417 @@
+"""بنچمارک کامل: داده مصنوعی + زمان همه توابع db_* + زمان صفحات و بخش‌ها با AppTest
+
+اجرا از ریشه مخزن:
+    python -m benchmarks.suite --scale small --json bench.json
+    python -m benchmarks.suite --scale small --compare bench.json
+
+خروجی JSON برای هر تابع و هر صفحه p50/p95/p99، تعداد دستورهای SQL در هر اجرا و
+بیشینه RSS را دارد. با --compare همان کلیدها با اجرای قبلی مقایسه می‌شوند و اگر
+p50 یا p95 بیش از --threshold برابر بدتر شده باشد، خروجی با کد ۱ تمام می‌شود.
+اگر EXPLAIN QUERY PLAN کوئری‌های پرتکرار (db_explain_hot_queries) اسکن کامل جدول
+نشان دهد هم خروجی کد ۱ است (مثلاً ایندکسی حذف شده باشد).
+با --workdir یک پوشه ساخته‌شده با benchmarks.datagen دوباره استفاده می‌شود
+(توابع نوشتن روی همان داده اجرا می‌شوند؛ برای اعداد قابل مقایسه هر بار پوشه تازه بسازید).
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks.common import ROOT, MAIN_PY, load_app, summarize, peak_rss_kb, QueryCounter
+from benchmarks.datagen import SCALES, Text, generate
+
+# فایل‌هایی که صفحات از پوشه جاری می‌خوانند (فونت و لوگو)
+PAGE_ASSETS = ("assets", "BTir.ttf", "BNazanin.ttf", "logo.png")
+# توابع کمکی که کوئری نیستند
+NOT_QUERIES = {"db_pool", "db_conn", "db_tx", "db_writer", "db_write", "db_write_result"}
+SEARCH_TEXT = "مقاومت بتن"
+
+
+def _quiet_streamlit():
+    # بیرون از `streamlit run` هر فراخوانی cache هشدار «missing ScriptRunContext» می‌دهد و
+    # AppTest سطح loggerهای streamlit را دوباره تنظیم می‌کند؛ هشدارها کل خروجی را می‌پوشانند
+    logging.disable(logging.WARNING)
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+# =========================================================
+# نمونه‌ها: شناسه‌های واقعی از داده ساخته‌شده
+# =========================================================
+class Samples:
+    def __init__(self, app):
+        with app["db_conn"]() as conn:
+            q = lambda sql, *p: conn.execute(sql, p).fetchone()
+            self.user_phone, self.user_name, self.user_nid = q("""
+                SELECT u.phone, u.name, u.nid FROM users u JOIN submissions s ON s.sender_phone = u.phone
+                GROUP BY u.phone ORDER BY COUNT(*) DESC LIMIT 1""")
+            self.page_ids = [r[0] for r in conn.execute(
+                "SELECT id FROM submissions WHERE status='published' ORDER BY created_ts DESC, id DESC LIMIT 10")]
+            n_pub = q("SELECT COUNT(*) FROM submissions WHERE status='published'")[0]
+            self.deep_cursor = tuple(q("""SELECT created_ts, id FROM submissions WHERE status='published'
+                                          ORDER BY created_ts DESC, id DESC LIMIT 1 OFFSET ?""", n_pub // 2))
+            self.hot_sub = q("""SELECT submission_id FROM submission_comments
+                                GROUP BY submission_id ORDER BY COUNT(*) DESC LIMIT 1""")[0]
+            self.pending_sub = q("SELECT id FROM submissions WHERE status='pending' LIMIT 1")[0]
+            self.ref_phone, self.ref_nid, self.ref_name, self.ref_field = q("""
+                SELECT r.phone, r.nid, r.first_name || ' ' || r.last_name, r.field
+                FROM referees r JOIN submission_assignments a ON a.referee_phone = r.phone
+                WHERE r.is_active=1 GROUP BY r.phone ORDER BY COUNT(*) DESC LIMIT 1""")
+            self.assign_id = q("SELECT id FROM submission_assignments WHERE referee_phone=? LIMIT 1", self.ref_phone)[0]
+            self.post_ids = [r[0] for r in conn.execute(
+                "SELECT id FROM forum_posts WHERE status='approved' ORDER BY created_ts DESC LIMIT 10")]
+            self.hot_post = q("SELECT post_id FROM forum_replies GROUP BY post_id ORDER BY COUNT(*) DESC LIMIT 1")[0]
+            self.pending_post = q("SELECT id FROM forum_posts WHERE status='pending' LIMIT 1")[0]
+        self.fields = list(app["FIELDS"])
+
+
+# =========================================================
+# حالت‌های هر تابع db_*
+# =========================================================
+def db_cases(app, s: Samples, rng: random.Random):
+    """[(کلید، make)]؛ make(i) کارهای آماده‌سازی را (بیرون از زمان‌سنجی) انجام می‌دهد
+    و تابع بدون آرگومانی برمی‌گرداند که زمان‌سنجی می‌شود. ترتیب: خواندن، نوشتن، حذف."""
+    text = Text(rng, 2_000)
+    new_id = app["make_id"]
+    f0 = s.fields[0]
+    now = time.time
+
+    def call(name, *args):
+        return lambda i: (lambda: app[name](*args))
+
+    def raw(name, *args):
+        # بدون catalog cache (هزینه واقعی کوئری)
+        return lambda i: (lambda: app[name].__wrapped__(*args))
+
+    def fresh_sub(i):
+        sid = new_id("s")
+        with app["db_tx"]() as conn:
+            conn.execute("""INSERT INTO submissions(id,title,description,sender_phone,sender_name,sender_nid,field,
+                            content_type,status,created_ts) VALUES(?,?,?,?,?,?,?,?,'pending',?)""",
+                         (sid, text.sentence(5), text.sentence(40), s.user_phone, s.user_name, s.user_nid, f0,
+                          app["CONTENT_TYPES"][0], now()))
+        return sid
+
+    def fresh_comment(i):
+        cid = new_id("c")
+        app["db_comment_add"](cid, s.hot_sub, s.user_name, text.sentence(8))
+        return cid
+
+    def fresh_referee(i):
+        phone = f"0999{i:07d}"
+        app["db_referee_upsert"](phone, "بنچ", "مارک", "0000000000", f0, "x", True)
+        return phone
+
+    reads = [
+        ("db_schema_version", call("db_schema_version")),
+        ("db_init", call("db_init")),
+        ("db_user_get", call("db_user_get", s.user_phone)),
+        ("db_users_all", call("db_users_all")),
+        ("db_referee_find", call("db_referee_find", s.ref_phone, s.ref_nid, "x")),
+        ("db_referees_by_field", call("db_referees_by_field", f0)),
+        ("db_referees_by_field[uncached]", raw("db_referees_by_field", f0)),
+        ("db_referees_by_fields", call("db_referees_by_fields", s.fields)),
+        ("db_referees_by_fields[uncached]", raw("db_referees_by_fields", s.fields)),
+        ("db_referees_all", call("db_referees_all")),
+        ("db_referee_loads", call("db_referee_loads", s.fields)),
+        ("db_topics_all", call("db_topics_all")),
+        ("db_topics_all[uncached]", raw("db_topics_all")),
+        ("db_research_all", call("db_research_all")),
+        ("db_research_all[uncached]", raw("db_research_all")),
+        ("db_docs_all", call("db_docs_all")),
+        ("db_docs_all[uncached]", raw("db_docs_all")),
+        ("db_submissions_by_sender", call("db_submissions_by_sender", s.user_phone)),
+        ("db_submissions_published", call("db_submissions_published")),
+        ("db_submissions_published[uncached]", raw("db_submissions_published")),
+        ("db_submissions_published_page", call("db_submissions_published_page", 11, None)),
+        ("db_submissions_published_page[uncached]", raw("db_submissions_published_page", 11, None)),
+        ("db_submissions_published_page[deep,uncached]", raw("db_submissions_published_page", 11, s.deep_cursor)),
+        ("db_submissions_pending_or_waiting_manager", call("db_submissions_pending_or_waiting_manager")),
+        ("db_submission_stats", call("db_submission_stats")),
+        ("db_submission_stats[uncached]", raw("db_submission_stats")),
+        ("db_comments_for", call("db_comments_for", s.hot_sub)),
+        ("db_comments_for_many", call("db_comments_for_many", s.page_ids)),
+        ("db_submission_counters", call("db_submission_counters", s.page_ids)),
+        ("db_assignments_for_submission", call("db_assignments_for_submission", s.page_ids[0])),
+        ("db_assignments_for_submissions", call("db_assignments_for_submissions", s.page_ids)),
+        ("db_referee_tasks_page", call("db_referee_tasks_page", s.ref_phone, 11)),
+        ("db_referee_tasks_page[decision]", call("db_referee_tasks_page", s.ref_phone, 11, None, "waiting_referee")),
+        ("db_referee_task", call("db_referee_task", s.assign_id, s.ref_phone)),
+        ("db_forum_posts", call("db_forum_posts", "approved")),
+        ("db_forum_posts[all]", call("db_forum_posts")),
+        ("db_forum_replies", call("db_forum_replies", s.hot_post)),
+        ("db_forum_replies_for_posts", call("db_forum_replies_for_posts", s.post_ids)),
+        ("db_search", call("db_search", SEARCH_TEXT)),
+        ("db_search[kind,page3]", call("db_search", "بتن", ["submission"], 10, 20)),
+        ("db_explain_hot_queries", call("db_explain_hot_queries")),
+        ("db_assert_no_full_scans", call("db_assert_no_full_scans")),
+    ]
+    pdf = lambda kb: b"%PDF-1.4\n" + rng.randbytes(kb * 1024)
+    writes = [
+        ("db_user_upsert", lambda i: (lambda p=f"0998{i:07d}": app["db_user_upsert"](p, "بنچ", "0", "x"))),
+        ("db_users_upsert_many", lambda i: (lambda rows=[(f"0997{i:03d}{j:04d}", "بنچ", "0", "x") for j in range(100)]:
+                                            app["db_users_upsert_many"](rows))),
+        ("db_user_update", call("db_user_update", s.user_phone, s.user_name, s.user_nid, "x")),
+        ("db_referee_upsert", lambda i: (lambda p=f"0996{i:07d}": app["db_referee_upsert"](p, "ب", "م", "0", f0, "x", True))),
+        ("db_referees_upsert_many", lambda i: (lambda rows=[(f"0995{i:03d}{j:04d}", "ب", "م", "0", f0, "x", 1) for j in range(20)]:
+                                               app["db_referees_upsert_many"](rows))),
+        ("db_topic_insert", lambda i: (lambda b=pdf(64): app["db_topic_insert"](
+            new_id("top"), text.sentence(5), f0, text.sentence(60), "guide.pdf", b, "application/pdf"))),
+        ("db_research_insert", lambda i: (lambda b=pdf(64): app["db_research_insert"](
+            new_id("res"), text.sentence(5), f0, text.sentence(80), "paper.pdf", b, "application/pdf"))),
+        ("db_doc_insert", lambda i: (lambda b=pdf(64): app["db_doc_insert"](
+            new_id("doc"), text.sentence(4), "rules.pdf", b, "application/pdf"))),
+        ("db_submission_insert", lambda i: (lambda b=pdf(256): app["db_submission_insert"](
+            new_id("s"), text.sentence(6), text.sentence(80), s.user_phone, s.user_name, s.user_nid, "",
+            f0, app["CONTENT_TYPES"][1], "report.pdf", "application/pdf", b))),
+        ("db_submission_update_content", lambda i: (lambda: app["db_submission_update_content"](
+            s.pending_sub, text.sentence(6), text.sentence(80), f0, app["CONTENT_TYPES"][1], "", "", None))),
+        ("db_submission_set_status", call("db_submission_set_status", s.pending_sub, "pending")),
+        ("db_submission_publish", lambda i: (lambda sid=fresh_sub(i): app["db_submission_publish"](sid, f"BENCH-{i}"))),
+        ("db_submissions_add_views", call("db_submissions_add_views", {sid: 1 for sid in s.page_ids})),
+        ("db_like_toggle", call("db_like_toggle", s.page_ids[0], s.user_phone)),
+        ("db_likes_reconcile", call("db_likes_reconcile")),
+        ("db_comment_add", lambda i: (lambda: app["db_comment_add"](new_id("c"), s.hot_sub, s.user_name, text.sentence(12)))),
+        ("db_assignment_create", lambda i: (lambda: app["db_assignment_create"](
+            new_id("a"), s.pending_sub, s.ref_phone, s.ref_name, s.ref_field))),
+        ("db_assign_many", lambda i: (lambda sid=fresh_sub(i): app["db_assign_many"](
+            [(sid, s.ref_phone, s.ref_name, s.ref_field)]))),
+        ("db_assignment_update", call("db_assignment_update", s.assign_id, "recommend_publish", "خوب", 90, "NX")),
+        ("db_forum_post_add", lambda i: (lambda: app["db_forum_post_add"](
+            new_id("fp"), s.user_phone, s.user_name, "user", text.sentence(30)))),
+        ("db_forum_set_status", call("db_forum_set_status", s.pending_post, "pending")),
+        ("db_forum_reply_add", lambda i: (lambda: app["db_forum_reply_add"](
+            new_id("fr"), s.hot_post, s.ref_phone, s.ref_name, text.sentence(20)))),
+    ]
+    deletes = [
+        ("db_comment_delete", lambda i: (lambda cid=fresh_comment(i): app["db_comment_delete"](cid))),
+        ("db_submission_delete", lambda i: (lambda sid=fresh_sub(i): app["db_submission_delete"](sid))),
+        ("db_referee_delete", lambda i: (lambda p=fresh_referee(i): app["db_referee_delete"](p))),
+    ]
+    return reads + writes + deletes
+
+
+def check_plans(app) -> list:
+    """ردیف‌های plan با اسکن کامل جدول در کوئری‌های پرتکرار؛ [(تابع، جزئیات plan)]"""
+    return [(name, detail) for (name, detail, full) in app["db_explain_hot_queries"]() if full]
+
+
+def run_db(app, counter: QueryCounter, s: Samples, repeat: int, seed: int):
+    results = {}
+    cases = db_cases(app, s, random.Random(seed))
+    for key, make in cases:
+        samples = []
+        try:
+            make(-1)()  # گرم کردن
+            for i in range(repeat):
+                fn = make(i)
+                t0 = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - t0) * 1000)
+            fn = make(repeat)
+            with counter.counting() as c:
+                fn()
+        except Exception as e:
+            results[key] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        results[key] = {**summarize(samples), "queries": c["n"]}
+    covered = {key.split("[", 1)[0] for key, _ in cases}
+    uncovered = sorted(name for name, v in app.items()
+                       if name.startswith("db_") and callable(v) and name not in NOT_QUERIES | covered)
+    return results, uncovered
+
+
+# =========================================================
+# صفحات با AppTest
+# =========================================================
+def page_specs(s: Samples):
+    """(نقش، صفحه، وضعیت session اضافه)؛ بخش‌های صفحه اصلی از خود برنامه خوانده می‌شوند"""
+    user = {"phone": s.user_phone, "name": s.user_name, "nid": s.user_nid}
+    ref = {"phone": s.ref_phone, "name": s.ref_name, "nid": s.ref_nid}
+    mgr = {"phone": "manager", "name": "مدیر", "nid": "0"}
+    return [
+        ("user", "صفحه اصلی", user),
+        ("user", "جستجو", {**user, "search_q": SEARCH_TEXT}),
+        ("user", "تالار گفتگو", user),
+        ("user", "پروفایل", user),
+        ("user", "اسناد", user),
+        ("user", "مشاهده محتوا", {**user, "selected_submission_id": s.hot_sub}),
+        ("manager", "صفحه اصلی", mgr),
+        ("manager", "تالار گفتگو", mgr),
+        ("referee", "صفحه اصلی", {**ref, "selected_submission_id": s.assign_id}),
+        ("referee", "تالار گفتگو", ref),
+    ]
+
+
+def _app_test(role: str, page: str, state: dict, timeout: float):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(MAIN_PY, default_timeout=timeout)
+    at.session_state["logged_in"] = True
+    at.session_state["role"] = role
+    at.session_state["page"] = page
+    at.session_state["selected_submission_id"] = None
+    for k, v in state.items():
+        at.session_state[k] = v
+    return at
+
+
+def run_pages(counter: QueryCounter, s: Samples, repeat: int, timeout: float):
+    results = {}
+
+    def measure(key, at):
+        """اجرای اول (گرم کردن) هم اگر خطا بدهد یا از timeout بگذرد، فقط همان صفحه خطا ثبت می‌شود"""
+        print(f"  {key}", file=sys.stderr, flush=True)
+        samples = []
+        try:
+            at.run()
+            if at.exception:
+                results[key] = {"error": str(at.exception[0].value)}
+                return
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                at.run()
+                samples.append((time.perf_counter() - t0) * 1000)
+            with counter.counting() as c:
+                at.run()
+        except RuntimeError as e:  # AppTest: script run timed out
+            results[key] = {"error": str(e)}
+            return
+        results[key] = {**summarize(samples), "queries": c["n"]}
+
+    for role, page, state in page_specs(s):
+        sections = None
+        if page == "صفحه اصلی":
+            at = _app_test(role, page, state, timeout)
+            try:
+                at.run()
+                sections = next((r.options for r in at.radio if r.key == f"{role}_section"), None)
+            except RuntimeError:
+                pass
+        if not sections:
+            measure(f"{role}/{page}", _app_test(role, page, state, timeout))
+            continue
+        for section in sections:
+            measure(f"{role}/{page}/{section}", _app_test(role, page, {**state, f"{role}_section": section}, timeout))
+    return results
+
+
+# =========================================================
+# مقایسه با اجرای قبلی
+# =========================================================
+def compare(base: dict, cur: dict, threshold: float, min_delta_ms: float) -> int:
+    regressions = 0
+    print(f"\n{'key':<58}{'base p50':>10}{'p50':>10}{'base p95':>10}{'p95':>10}")
+    for group in ("db", "pages"):
+        for key, c in cur.get(group, {}).items():
+            b = base.get(group, {}).get(key)
+            if not b or "error" in b or "error" in c:
+                continue
+            worse = [m for m in ("p50_ms", "p95_ms")
+                     if c[m] > b[m] * threshold and c[m] - b[m] > min_delta_ms]
+            better = [m for m in ("p50_ms", "p95_ms")
+                      if b[m] > c[m] * threshold and b[m] - c[m] > min_delta_ms]
+            if worse or better:
+                mark = "REGRESSION" if worse else "faster"
+                regressions += bool(worse)
+                print(f"{group + '/' + key:<58}{b['p50_ms']:>10.2f}{c['p50_ms']:>10.2f}"
+                      f"{b['p95_ms']:>10.2f}{c['p95_ms']:>10.2f}  {mark}")
+            if c.get("queries", 0) > b.get("queries", 0):
+                print(f"{group + '/' + key:<58}queries {b.get('queries')} -> {c['queries']}")
+    print(f"{regressions} regression(s) (threshold x{threshold}, min {min_delta_ms} ms)")
+    return regressions
+
+
+def _print_table(title: str, rows: dict):
+    print(f"\n{title:<58}{'p50':>9}{'p95':>9}{'p99':>9}{'sql':>6}")
+    for key, r in rows.items():
+        if "error" in r:
+            print(f"{key:<58}  ERROR {r['error']}")
+        else:
+            print(f"{key:<58}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['queries']:>6}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", choices=list(SCALES), default="small")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workdir", help="پوشه داده (اگر nexa.db نداشته باشد ساخته می‌شود)؛ پیش‌فرض پوشه موقت")
+    ap.add_argument("--repeat", type=int, default=30, help="تعداد اجرای هر تابع db_*")
+    ap.add_argument("--page-repeat", type=int, default=5, help="تعداد اجرای هر صفحه")
+    ap.add_argument("--page-timeout", type=float, default=120)
+    ap.add_argument("--skip-pages", action="store_true")
+    ap.add_argument("--json", help="مسیر فایل خروجی JSON")
+    ap.add_argument("--compare", help="JSON اجرای قبلی برای مقایسه")
+    ap.add_argument("--threshold", type=float, default=1.25)
+    ap.add_argument("--min-delta-ms", type=float, default=0.5)
+    args = ap.parse_args()
+    out_path = os.path.abspath(args.json) if args.json else None
+    base_path = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="nexa-suite-"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    for name in PAGE_ASSETS:
+        src = os.path.join(ROOT, name)
+        if os.path.exists(src) and not os.path.lexists(name):
+            os.symlink(src, name)
+
+    _quiet_streamlit()
+    counter = QueryCounter().install()
+    app = load_app()
+    fresh = not os.path.exists("nexa.db")
+    app["db_init"]()
+    report = {"meta": {
+        "scale": args.scale, "seed": args.seed, "repeat": args.repeat, "page_repeat": args.page_repeat,
+        "git": _git_rev(), "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(), "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "workdir": workdir,
+    }}
+    if fresh:
+        print(f"generating scale={args.scale} in {workdir}")
+        report["data"] = generate(app, SCALES[args.scale], args.seed)
+    report["peak_rss_kb"] = {"data": peak_rss_kb()}
+
+    report["full_scans"] = check_plans(app)
+    for name, detail in report["full_scans"]:
+        print(f"FULL SCAN {name}: {detail}", file=sys.stderr)
+
+    samples = Samples(app)
+    report["db"], report["uncovered"] = run_db(app, counter, samples, args.repeat, args.seed)
+    report["peak_rss_kb"]["db"] = peak_rss_kb()
+    _print_table("db", report["db"])
+    if report["uncovered"]:
+        print("\nno benchmark case for: " + ", ".join(report["uncovered"]), file=sys.stderr)
+
+    if not args.skip_pages:
+        report["pages"] = run_pages(counter, samples, args.page_repeat, args.page_timeout)
+        report["peak_rss_kb"]["pages"] = peak_rss_kb()
+        _print_table("pages", report["pages"])
+    print(f"\npeak RSS: {report['peak_rss_kb']} KB")
+
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"wrote {out_path}")
+    failed = bool(report["full_scans"])
+    if base_path:
+        with open(base_path, encoding="utf-8") as f:
+            base = json.load(f)
+        failed = compare(base, report, args.threshold, args.min_delta_ms) or failed
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
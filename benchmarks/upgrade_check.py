@@ -0,0 +1,109 @@
+"""بررسی ارتقای پایگاه داده ساخته‌شده با نسخه‌های قبلی main.py به نسخه فعلی
+
+اجرا از ریشه مخزن:
+    python -m benchmarks.upgrade_check
+    python -m benchmarks.upgrade_check --rev e3d404e --rev HEAD~5
+
+برای هر revision، main.py همان commit (از git) در یک پوشه موقت پایگاه داده می‌سازد و یک
+کاربر، یک محتوای منتشرشده و یک پست تاییدشده تالار با اتصال خودش درج می‌کند. بعد نسخه فعلی
+در process جدا db_init را اجرا می‌کند و بررسی می‌شود که user_version آخرین نسخه است، هیچ
+triggerی تابع ثبت‌نشده nexa_norm را صدا نمی‌زند، جستجو محتوا را پیدا می‌کند و نوشتن از اتصال
+خام sqlite3 خطا نمی‌دهد. اگر یکی از revisionها شکست بخورد، خروجی کد ۱ است.
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import multiprocessing as mp
+
+from benchmarks.common import ROOT, load_app
+
+# triggerهای جستجوی نسخه ۵ (e3d404e) تا ۱۱ (ba3662c) تابع nexa_norm را صدا می‌زدند
+DEFAULT_REVS = ["e3d404e", "ba3662c"]
+SUB_TITLE = "كيك ۱۴۰۳"
+SEARCH_TEXT = "کیک 1403"
+
+
+def _git_main_py(rev: str) -> str:
+    return subprocess.run(["git", "show", f"{rev}:main.py"], cwd=ROOT, capture_output=True,
+                          text=True, check=True, timeout=30).stdout
+
+
+def build_old(workdir: str, rev: str, src: str, out: "mp.Queue"):
+    os.chdir(workdir)
+    app = load_app(f"{rev}:main.py", src)
+    app["db_init"]()
+    now = time.time()
+    with app["db_tx"]() as conn:
+        conn.execute("INSERT INTO users(phone,name,nid,password,created_ts) VALUES('09120000000','x','0012345678','x',?)",
+                     (now,))
+        conn.execute(
+            "INSERT INTO submissions(id,title,description,sender_phone,sender_name,sender_nid,field,content_type,"
+            "status,created_ts) VALUES('s5001',?,'d','09120000000','x','0012345678','f','t','published',?)",
+            (SUB_TITLE, now))
+        conn.execute(
+            "INSERT INTO forum_posts(id,sender_phone,sender_name,sender_role,text,status,created_ts)"
+            " VALUES('f5001','09120000000','x','user','t','approved',?)", (now,))
+        out.put(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def upgrade(workdir: str, out: "mp.Queue"):
+    os.chdir(workdir)
+    errors = []
+    try:
+        app = load_app()
+        app["db_init"]()
+        with app["db_conn"]() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != len(app["DB_MIGRATIONS"]):
+            errors.append(f"user_version={version}")
+        raw = sqlite3.connect("nexa.db")
+        stale = raw.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND sql LIKE '%nexa_norm%'").fetchall()
+        if stale:
+            errors.append(f"triggers still call nexa_norm: {[r[0] for r in stale]}")
+        hits, _more = app["db_search"](SEARCH_TEXT)
+        if not any(kind == "submission" for (kind, *_rest) in hits):
+            errors.append(f"search {SEARCH_TEXT!r} found nothing")
+        raw.execute("UPDATE submissions SET title = title || ' ۲'")
+        raw.execute("UPDATE forum_posts SET text = text || ' ۲'")
+        raw.commit()
+        raw.close()
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+    out.put(errors)
+
+
+def check(rev: str) -> list:
+    workdir = tempfile.mkdtemp(prefix="nexa-upgrade-")
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    # هر نسخه در process خودش (st.cache_resource و ثبت توابع SQLite مشترک نشوند)
+    p = ctx.Process(target=build_old, args=(workdir, rev, _git_main_py(rev), out))
+    p.start()
+    p.join()
+    if p.exitcode != 0:
+        return [f"building the {rev} database failed (exit {p.exitcode})"]
+    from_version = out.get()
+    p = ctx.Process(target=upgrade, args=(workdir, out))
+    p.start()
+    p.join()
+    errors = out.get() if p.exitcode == 0 else [f"upgrade process exited with {p.exitcode}"]
+    print(f"{rev}: schema {from_version} -> current: {'OK' if not errors else 'FAILED'}")
+    for e in errors:
+        print(f"    {e}")
+    return errors
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rev", action="append", help=f"commit سازنده پایگاه داده (پیش‌فرض: {' '.join(DEFAULT_REVS)})")
+    args = ap.parse_args()
+    failed = [rev for rev in (args.rev or DEFAULT_REVS) if check(rev)]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,224 @@
 import os
 import re
+import sys
 import time
+import json
+import uuid
+import queue
+import atexit
 import base64
+import html
+import hashlib
+import hmac
+import logging
+import logging.handlers
 import sqlite3
+import tempfile
+import functools
+import mimetypes
+import threading
+import http.server
+import urllib.parse
 import streamlit as st
-from typing import Optional, Tuple, List
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Optional, Tuple, List, Iterable, NamedTuple, Callable, BinaryIO, Iterator
+
+log = logging.getLogger("nexa")
 
 # =========================================================
 # DB (SQLite)
 # =========================================================
 DB_PATH = "nexa.db"
 
+# تنظیمات اتصال (قابل تغییر با متغیر محیطی)
+DB_POOL_SIZE = int(os.environ.get("NEXA_DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("NEXA_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.environ.get("NEXA_DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.environ.get("NEXA_DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.environ.get("NEXA_DB_STATEMENT_CACHE", "256"))
+DB_POOL_WARM = int(os.environ.get("NEXA_DB_POOL_WARM", "2"))
+
+class DBPool:
+    """pool سراسری اتصال‌های SQLite برای کل پروسه.
+
+    هر thread (هر session در Streamlit) در هر لحظه یک اتصال قرض می‌گیرد؛
+    قرض گرفتن تو در تو در همان thread همان اتصال را برمی‌گرداند.
+    اگر profiler روشن باشد و این thread یک rerun در حال ثبت داشته باشد، یا لاگ کوئری‌های کند
+    روشن باشد، اتصال داخل ProfiledConnection برگردانده می‌شود؛ وگرنه همان اتصال خام.
+    """
+
+    def __init__(self, path: str, size: int, profiler: Optional["QueryProfiler"] = None,
+                 slow_log: Optional["SlowQueryLog"] = None):
+        self.path = path
+        self.size = size
+        self.profiler = profiler
+        self.slow_log = slow_log
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        # isolation_level=None: تراکنش‌ها فقط با db_tx() و به صورت صریح باز می‌شوند
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE};")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                conn = self._open()
+                self._created += 1
+                return conn
+        try:
+            return self._idle.get(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        except queue.Empty:
+            raise sqlite3.OperationalError("connection pool exhausted") from None
+
+    def warm(self, n: int) -> int:
+        """باز کردن از پیش n اتصال تا اولین درخواست‌ها هزینه اتصال و PRAGMAها را ندهند"""
+        opened = 0
+        while opened < n:
+            with self._lock:
+                if self._created >= self.size:
+                    break
+                conn = self._open()
+                self._created += 1
+            self._idle.put(conn)
+            opened += 1
+        return opened
+
+    def in_transaction(self) -> bool:
+        """آیا اتصال قرض‌گرفته این thread تراکنش باز دارد"""
+        held = getattr(self._local, "conn", None)
+        return held is not None and held.in_transaction
+
+    def _hooks(self) -> list:
+        hooks = getattr(self._local, "hooks", None)
+        if hooks is None:
+            hooks = self._local.hooks = []
+        return hooks
+
+    def after_commit(self, fn: Callable[[], object]):
+        """fn بعد از COMMIT تراکنش باز همین thread اجرا می‌شود (با ROLLBACK دور ریخته می‌شود)؛
+        بیرون از تراکنش، همین حالا"""
+        if self.in_transaction():
+            self._hooks().append(fn)
+        else:
+            fn()
+
+    def hooks_mark(self) -> int:
+        return len(self._hooks())
+
+    def drop_hooks(self, mark: int = 0):
+        """کارهای ثبت‌شده بعد از mark (برای ROLLBACK یا ROLLBACK TO)"""
+        del self._hooks()[mark:]
+
+    def run_hooks(self):
+        hooks, self._local.hooks = self._hooks(), []
+        for fn in hooks:
+            try:
+                fn()
+            except Exception:
+                log.exception("after-commit hook failed")
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+        conn = self._acquire()
+        prof = self.profiler
+        rerun = prof.current() if prof is not None and prof.enabled else None
+        slow = self.slow_log
+        handle = ProfiledConnection(conn, rerun, slow) if rerun is not None or slow is not None else conn
+        self._local.conn = handle
+        try:
+            yield handle
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            if slow is not None and handle.events:
+                slow.check(conn, handle.events)
+            self._idle.put(conn)
+
+@st.cache_resource
+def db_pool() -> DBPool:
+    return DBPool(DB_PATH, DB_POOL_SIZE, query_profiler(), slow_query_log())
+
 def db_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA foreign_keys=ON;")
-    return conn
+    """اتصال همین thread از pool (به صورت context manager)"""
+    return db_pool().connection()
+
+@contextmanager
+def db_tx():
+    """یک تراکنش نوشتن روی یک اتصال؛ فراخوانی تو در تو به همان تراکنش می‌پیوندد.
+    کارهای db_pool().after_commit بعد از COMMIT اجرا می‌شوند."""
+    pool = db_pool()
+    with pool.connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            pool.drop_hooks()
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        pool.run_hooks()
+
+def db_schema_version() -> int:
+    with db_conn() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
 
 def db_init():
-    conn = db_conn()
-    cur = conn.cursor()
+    """ساخت جدول‌های پایه و اجرای migrationهای اعمال‌نشده (نسخه در PRAGMA user_version)"""
+    if db_schema_version() < len(DB_MIGRATIONS):
+        _db_migrate()
+    blob_migrate_inline()
+
+def _db_migrate():
+    # نسخه دوباره داخل تراکنش خوانده می‌شود؛ پروسه دیگری ممکن است زودتر migrate کرده باشد
+    with db_tx() as conn:
+        cur = conn.cursor()
+        _db_create_tables(cur)
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if 5 <= version < 12:
+            # triggerهای جستجوی نسخه ۵ تابع nexa_norm را صدا می‌زنند که دیگر ثبت نمی‌شود؛ باید قبل از
+            # migrationهایی که ردیف‌ها را تغییر می‌دهند (مثل ۶) عوض شوند، نه در نوبت خود migration ۱۲
+            _db_search_triggers_sql_norm(cur)
+        for v, migrate in enumerate(DB_MIGRATIONS[version:], start=version + 1):
+            migrate(cur)
+            cur.execute(f"PRAGMA user_version={v}")
+
+def _db_add_column(cur: sqlite3.Cursor, table: str, column: str, decl: str):
+    cols = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _db_create_tables(cur: sqlite3.Cursor):
 
     cur.execute("""
     CREATE TABLE IF NOT EXISTS users(
@@ -165,8 +364,1570 @@ def db_init():
     );
     """)
 
-    conn.commit()
-    conn.close()
+# =========================================================
+# Query profiler (ثبت هر کوئری در هر rerun؛ خاموش = اتصال خام، بدون هزینه)
+# =========================================================
+PROFILE_DEFAULT_ON = os.environ.get("NEXA_PROFILE", "0") == "1"
+# تعداد آخرین rerunهایی که با جزئیات کوئری‌ها نگه داشته می‌شوند
+PROFILE_HISTORY = int(os.environ.get("NEXA_PROFILE_HISTORY", "50"))
+# سقف کوئری‌های ذخیره‌شده از هر rerun (آمار تجمعی همه را حساب می‌کند)
+PROFILE_MAX_EVENTS = 500
+
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+def sql_normalize(sql: str) -> str:
+    """یک شکل برای کوئری‌های هم‌ساختار: فاصله‌ها یکی، literalها ? و لیست‌های (?,?,…) یکسان"""
+    sql = _SQL_LITERAL_RE.sub("?", " ".join(sql.split()))
+    return _SQL_IN_LIST_RE.sub("(?,…)", sql)
+
+def _params_shape(params) -> str:
+    """نوع پارامترها بدون مقدارشان، مثلاً (str,float) یا (str×20)"""
+    if not params:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ",".join(f"{k}:{type(v).__name__}" for k, v in params.items()) + "}"
+    runs: List[list] = []
+    for p in params:
+        t = type(p).__name__
+        if runs and runs[-1][0] == t:
+            runs[-1][1] += 1
+        else:
+            runs.append([t, 1])
+    return "(" + ",".join(t if n == 1 else f"{t}×{n}" for t, n in runs) + ")"
+
+def _row_bytes(row) -> int:
+    n = 0
+    for v in row:
+        if isinstance(v, str):
+            n += len(v.encode("utf-8"))
+        elif isinstance(v, (bytes, memoryview)):
+            n += len(v)
+        elif v is not None:
+            n += 8
+    return n
+
+# قاب‌های بین تابع db_* و صدازننده واقعی آن (catalog cache، context managerها)
+_PLUMBING_FRAMES = {"<lambda>", "get_or_load", "wrapper", "__enter__", "__exit__", "helper", "connection",
+                    "db_conn", "db_tx", "db_write", "submit", "_run_now"}
+
+def _call_site(frame) -> Tuple[str, str]:
+    """(نزدیک‌ترین تابع db_* در پشته، «db_x:خط ← صدازننده:خط»)؛ کوئری‌های کمکی مثل
+    _db_children به تابع db_* صدازننده نسبت داده می‌شوند"""
+    f, caller, site = frame, None, []
+    for _ in range(16):
+        if f is None:
+            break
+        name = f.f_code.co_name
+        if caller is None:
+            if name.startswith("db_") and name not in _PLUMBING_FRAMES:
+                caller = name
+                site.append(f"{name}:{f.f_lineno}")
+        elif name not in _PLUMBING_FRAMES:
+            site.append(f"{name}:{f.f_lineno}")
+            break
+        f = f.f_back
+    if caller is None:
+        caller = frame.f_code.co_name
+        site = [f"{caller}:{frame.f_lineno}"]
+    return caller, " ← ".join(site)
+
+class QueryEvent:
+    """یک دستور اجراشده. قاب صدازننده و پارامترها فقط تا resolve() نگه داشته می‌شوند تا
+    محاسبه محل فراخوانی و شکل پارامترها فقط برای کوئری‌هایی انجام شود که لازم است."""
+    __slots__ = ("frame", "params", "caller", "site", "sql", "shape", "seconds", "rows", "bytes")
+
+    def __init__(self, frame, sql: str, params, seconds: float):
+        self.frame = frame
+        self.params = params
+        self.caller = self.site = self.shape = ""
+        self.sql = sql
+        self.seconds = seconds  # execute + همه fetchها
+        self.rows = 0
+        self.bytes = 0
+
+    def resolve(self) -> "QueryEvent":
+        if self.frame is not None:
+            self.caller, self.site = _call_site(self.frame)
+            p = self.params
+            if isinstance(p, list):  # executemany
+                self.shape = f"{len(p)}×{_params_shape(p[0]) if p else '()'}"
+            else:
+                self.shape = _params_shape(p)
+            self.frame = self.params = None
+        return self
+
+class RerunProfile:
+    """کوئری‌های یک اجرای اسکریپت (یا یک fragment) در یک session"""
+
+    def __init__(self, page: str, section: str = "", fragment: bool = False):
+        self.page = page
+        self.section = section
+        self.fragment = fragment
+        self.wall = time.time()
+        self.started = self.last = time.perf_counter()
+        self.events: List[QueryEvent] = []
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        # False: اجرا با st.stop()/st.rerun() قطع شد؛ زمان تا آخرین کوئری حساب شده
+        self.complete = True
+
+class ProfiledCursor:
+    __slots__ = ("_cur", "_ev", "_count_bytes")
+
+    def __init__(self, cur: sqlite3.Cursor, ev: QueryEvent, count_bytes: bool):
+        self._cur = cur
+        self._ev = ev
+        self._count_bytes = count_bytes
+
+    def _took(self, t0: float, rows) -> None:
+        ev = self._ev
+        ev.seconds += time.perf_counter() - t0
+        ev.rows += len(rows)
+        if self._count_bytes:
+            ev.bytes += sum(_row_bytes(r) for r in rows)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = self._cur.fetchone()
+        ev = self._ev
+        ev.seconds += time.perf_counter() - t0
+        if row is not None:
+            ev.rows += 1
+            if self._count_bytes:
+                ev.bytes += _row_bytes(row)
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        t0 = time.perf_counter()
+        rows = self._cur.fetchmany(self._cur.arraysize if size is None else size)
+        self._took(t0, rows)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = self._cur.fetchall()
+        self._took(t0, rows)
+        return rows
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+class ProfiledConnection:
+    """اتصال pool با ثبت زمان، شکل پارامترها، تعداد ردیف و حجم داده هر دستور.
+
+    رویدادها به rerun جاری (اگر profiler روشن است) و به events همین قرض (اگر لاگ کوئری‌های
+    کند روشن است) اضافه می‌شوند؛ DBPool هنگام پس دادن اتصال، events را به SlowQueryLog می‌دهد.
+    """
+    __slots__ = ("_conn", "_rerun", "_slow", "events")
+
+    def __init__(self, conn: sqlite3.Connection, rerun: Optional[RerunProfile], slow: Optional["SlowQueryLog"]):
+        self._conn = conn
+        self._rerun = rerun
+        self._slow = slow
+        self.events: List[QueryEvent] = []
+
+    def _add(self, sql: str, params, seconds: float) -> QueryEvent:
+        ev = QueryEvent(sys._getframe(2), sql, params, seconds)
+        if self._rerun is not None:
+            self._rerun.events.append(ev)
+            self._rerun.last = time.perf_counter()
+        if self._slow is not None:
+            if len(self.events) >= SLOW_QUERY_BATCH:
+                # قرض طولانی (مثلاً import گروهی): رویدادهای قدیمی‌تر تمام شده‌اند
+                self._slow.check(self._conn, self.events)
+                self.events = []
+            self.events.append(ev)
+        return ev
+
+    def execute(self, sql: str, params=()):
+        t0 = time.perf_counter()
+        cur = self._conn.execute(sql, params)
+        return ProfiledCursor(cur, self._add(sql, params, time.perf_counter() - t0), self._rerun is not None)
+
+    def executemany(self, sql: str, seq):
+        seq = seq if isinstance(seq, list) else list(seq)
+        t0 = time.perf_counter()
+        cur = self._conn.executemany(sql, seq)
+        return ProfiledCursor(cur, self._add(sql, seq, time.perf_counter() - t0), self._rerun is not None)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        self._conn.commit()
+        self._add("COMMIT", (), time.perf_counter() - t0)
+
+    def rollback(self):
+        t0 = time.perf_counter()
+        self._conn.rollback()
+        self._add("ROLLBACK", (), time.perf_counter() - t0)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+class PageProfile(NamedTuple):
+    page: str
+    section: str
+    fragment: bool
+    reruns: int
+    mean_ms: float
+    max_ms: float
+    mean_queries: float
+    mean_db_ms: float
+
+class QueryProfile(NamedTuple):
+    caller: str
+    sql: str
+    shape: str
+    calls: int
+    total_ms: float
+    mean_ms: float
+    max_ms: float
+    rows: int
+    bytes: int
+
+class QueryProfiler:
+    """ثبت کوئری‌ها به تفکیک rerun و تجمیع به تفکیک صفحه و کوئری (مشترک بین sessionها).
+
+    هر thread اسکریپت (session) در هر لحظه حداکثر یک rerun باز دارد. begin() یک rerun
+    باز قبلی را (که با st.stop یا st.rerun قطع شده) ناقص می‌بندد.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._history: deque = deque(maxlen=PROFILE_HISTORY)
+        self._pages: dict = {}    # (page, section, fragment) -> [reruns, total_s, max_s, queries, db_s]
+        self._queries: dict = {}  # (caller, normalized sql) -> [calls, total_s, max_s, rows, bytes, shape]
+
+    def current(self) -> Optional[RerunProfile]:
+        return getattr(self._local, "rerun", None)
+
+    def begin(self, page: str, section: str = "", fragment: bool = False) -> Optional[RerunProfile]:
+        prev = self.current()
+        if prev is not None:
+            self.finish(prev, complete=False)
+        if not self.enabled:
+            return None
+        self._local.rerun = RerunProfile(page, section, fragment)
+        return self._local.rerun
+
+    def annotate(self, section: str):
+        rerun = self.current()
+        if rerun is not None:
+            rerun.section = section
+
+    def finish(self, rerun: Optional[RerunProfile], complete: bool = True):
+        if rerun is None:
+            return
+        if self.current() is rerun:
+            self._local.rerun = None
+        rerun.complete = complete
+        rerun.seconds = (time.perf_counter() if complete else rerun.last) - rerun.started
+        rerun.queries = len(rerun.events)
+        rerun.db_seconds = sum(ev.seconds for ev in rerun.events)
+        for ev in rerun.events:
+            ev.resolve()
+        with self._lock:
+            p = self._pages.setdefault((rerun.page, rerun.section, rerun.fragment), [0, 0.0, 0.0, 0, 0.0])
+            p[0] += 1
+            p[1] += rerun.seconds
+            p[2] = max(p[2], rerun.seconds)
+            p[3] += rerun.queries
+            p[4] += rerun.db_seconds
+            for ev in rerun.events:
+                q = self._queries.setdefault((ev.caller, sql_normalize(ev.sql)), [0, 0.0, 0.0, 0, 0, ev.shape])
+                q[0] += 1
+                q[1] += ev.seconds
+                q[2] = max(q[2], ev.seconds)
+                q[3] += ev.rows
+                q[4] += ev.bytes
+            del rerun.events[PROFILE_MAX_EVENTS:]
+            self._history.append(rerun)
+
+    def reset(self):
+        with self._lock:
+            self._history.clear()
+            self._pages.clear()
+            self._queries.clear()
+
+    def recent(self) -> List[RerunProfile]:
+        """آخرین rerunها، جدیدترین اول"""
+        with self._lock:
+            return list(reversed(self._history))
+
+    def pages(self) -> List[PageProfile]:
+        with self._lock:
+            return [PageProfile(page, section, fragment, n, total / n * 1000, mx * 1000, queries / n, db / n * 1000)
+                    for (page, section, fragment), (n, total, mx, queries, db) in sorted(self._pages.items())]
+
+    def top_queries(self, limit: int = 25) -> List[QueryProfile]:
+        """پرهزینه‌ترین کوئری‌ها بر اساس مجموع زمان"""
+        with self._lock:
+            items = sorted(self._queries.items(), key=lambda kv: -kv[1][1])[:limit]
+            return [QueryProfile(caller, sql, shape, n, total * 1000, total / n * 1000, mx * 1000, rows, nbytes)
+                    for (caller, sql), (n, total, mx, rows, nbytes, shape) in items]
+
+@st.cache_resource
+def query_profiler() -> QueryProfiler:
+    return QueryProfiler(PROFILE_DEFAULT_ON)
+
+# =========================================================
+# Slow query log (JSONL چرخشی + EXPLAIN QUERY PLAN)
+# =========================================================
+# 0 = خاموش (اتصال‌ها بدون لایه اضافه، مگر profiler روشن باشد)
+SLOW_QUERY_MS = float(os.environ.get("NEXA_SLOW_QUERY_MS", "250"))
+SLOW_QUERY_LOG_PATH = os.environ.get("NEXA_SLOW_QUERY_LOG", os.path.join("logs", "slow_queries.jsonl"))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("NEXA_SLOW_QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("NEXA_SLOW_QUERY_LOG_BACKUPS", "5"))
+# تکرارهای یک کوئری (با SQL یکسان‌شده) در این بازه یک سطر می‌شوند
+SLOW_QUERY_FLUSH_S = float(os.environ.get("NEXA_SLOW_QUERY_FLUSH_S", "60"))
+# در قرض‌های طولانی، رویدادها در دسته‌های این اندازه بررسی می‌شوند
+SLOW_QUERY_BATCH = 256
+SLOW_QUERY_MAX_SITES = 5
+
+class SlowQueryLog:
+    """کوئری‌های کندتر از آستانه، به تفکیک SQL یکسان‌شده در حافظه جمع و هر SLOW_QUERY_FLUSH_S
+    یک سطر JSON برای هر کدام در فایل چرخشی نوشته می‌شوند.
+
+    EXPLAIN QUERY PLAN برای اولین مورد هر کوئری در هر بازه، روی همان اتصال و با همان پارامترها
+    گرفته می‌شود (پیش از برگشت اتصال به pool).
+    """
+
+    def __init__(self, path: str, threshold_ms: float):
+        self.path = path
+        self.threshold_s = threshold_ms / 1000
+        self._lock = threading.Lock()
+        self._pending: dict = {}  # normalized sql -> entry
+        self._recent: deque = deque(maxlen=50)  # آخرین سطرهای نوشته‌شده (برای تب عیب‌یابی)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._out = logging.getLogger("nexa.slow_queries")
+        self._out.propagate = False
+        self._out.setLevel(logging.INFO)
+        if not self._out.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._out.addHandler(handler)
+
+    def check(self, conn: sqlite3.Connection, events: List[QueryEvent]):
+        for ev in events:
+            if ev.seconds >= self.threshold_s:
+                try:
+                    self.record(conn, ev)
+                except Exception:
+                    log.exception("slow query log failed")
+
+    @staticmethod
+    def _explain(conn: sqlite3.Connection, ev: QueryEvent) -> List[str]:
+        if ev.sql in ("COMMIT", "ROLLBACK"):
+            return []
+        params = ev.params[0] if isinstance(ev.params, list) else ev.params
+        try:
+            return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + ev.sql, params or ())]
+        except sqlite3.Error as e:
+            return [f"EXPLAIN failed: {e}"]
+
+    def record(self, conn: sqlite3.Connection, ev: QueryEvent):
+        key = sql_normalize(ev.sql)
+        with self._lock:
+            known = key in self._pending
+        plan = None if known else self._explain(conn, ev)
+        ev.resolve()
+        ms = ev.seconds * 1000
+        now = time.time()
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {
+                    "sql": key, "sample": " ".join(ev.sql.split())[:2000], "params": ev.shape,
+                    "first_ts": now, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows_max": 0,
+                    "sites": {}, "plan": plan or [],
+                }
+                log.warning("slow query %.0f ms at %s: %s", ms, ev.site, entry["sample"][:200])
+            entry["last_ts"] = now
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["rows_max"] = max(entry["rows_max"], ev.rows)
+            sites = entry["sites"]
+            if ev.site in sites or len(sites) < SLOW_QUERY_MAX_SITES:
+                sites[ev.site] = sites.get(ev.site, 0) + 1
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        for entry in batch.values():
+            entry["mean_ms"] = entry["total_ms"] / entry["count"]
+            entry["full_scan"] = any(_is_full_scan(d) for d in entry["plan"])
+            entry["threshold_ms"] = self.threshold_s * 1000
+            for k in ("total_ms", "max_ms", "mean_ms"):
+                entry[k] = round(entry[k], 2)
+            self._out.info(json.dumps(entry, ensure_ascii=False))
+            self._recent.append(entry)
+        return len(batch)
+
+    def recent(self) -> List[dict]:
+        """آخرین سطرهای نوشته‌شده و موارد هنوز ننوشته، جدیدترین اول"""
+        with self._lock:
+            pending = [dict(e, pending=True) for e in self._pending.values()]
+            return pending + list(reversed(self._recent))
+
+@st.cache_resource
+def slow_query_log() -> Optional[SlowQueryLog]:
+    if SLOW_QUERY_MS <= 0:
+        return None
+    slow = SlowQueryLog(SLOW_QUERY_LOG_PATH, SLOW_QUERY_MS)
+    PeriodicJob("nexa-slow-query-flush", SLOW_QUERY_FLUSH_S, slow.flush).start()
+    atexit.register(slow.flush)
+    return slow
+
+# =========================================================
+# DB writer (یک thread نوشتن برای کل پروسه + group commit)
+# =========================================================
+# 0 = بدون thread نوشتن؛ هر helper مثل قبل تراکنش خودش را روی اتصال همان thread باز می‌کند
+DB_WRITER = os.environ.get("NEXA_DB_WRITER", "1") == "1"
+DB_WRITE_BATCH_MAX = int(os.environ.get("NEXA_DB_WRITE_BATCH_MAX", "64"))
+# صبر بعد از اولین نوشتن برای جمع شدن بقیه؛ 0 = فقط همان‌هایی که تا این لحظه در صف‌اند
+DB_WRITE_GROUP_WAIT_MS = float(os.environ.get("NEXA_DB_WRITE_GROUP_WAIT_MS", "0"))
+# بیشترین انتظار فراخوان برای ماندگار شدن یک نوشتن
+DB_WRITE_TIMEOUT_S = float(os.environ.get("NEXA_DB_WRITE_TIMEOUT_S", "30"))
+DB_WRITER_LATENCY_SAMPLES = 1024
+
+class WriterStats(NamedTuple):
+    depth: int
+    max_depth: int
+    ops: int
+    failed: int
+    batches: int
+    mean_batch: float
+    max_batch: int
+    commit_p50_ms: float
+    commit_p95_ms: float
+    wait_p50_ms: float  # از ورود به صف تا commit
+    wait_p95_ms: float
+
+def _pct(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+class DBWriter:
+    """همه نوشتن‌های sessionها از یک صف و روی یک اتصال انجام می‌شوند.
+
+    thread نوشتن هر بار تا DB_WRITE_BATCH_MAX عملیات را از صف برمی‌دارد و همه را در یک
+    تراکنش (BEGIN IMMEDIATE ... COMMIT) اجرا می‌کند؛ پس قفل نوشتن SQLite فقط دست همین thread
+    است و به جای یک fsync برای هر نوشتن، یک fsync برای هر دسته پرداخت می‌شود.
+    هر عملیات داخل SAVEPOINT خودش اجرا می‌شود تا خطای یکی فقط همان را برگرداند.
+    Future هر عملیات بعد از COMMIT (یعنی پس از ماندگار شدن) کامل می‌شود.
+    """
+
+    def __init__(self, pool: DBPool, batch_max: int, group_wait_ms: float):
+        self.pool = pool
+        self.batch_max = max(1, batch_max)
+        self.group_wait_s = group_wait_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="nexa-db-writer", daemon=True)
+        self._stopped = False
+        # بررسی _stopped و گذاشتن در صف با هم؛ بعد از نشانه توقف (None) چیزی وارد صف نمی‌شود
+        self._submit_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._ops = 0
+        self._failed = 0
+        self._batches = 0
+        self._max_batch = 0
+        self._max_depth = 0
+        self._commit_s: deque = deque(maxlen=DB_WRITER_LATENCY_SAMPLES)
+        self._wait_s: deque = deque(maxlen=DB_WRITER_LATENCY_SAMPLES)
+
+    def start(self) -> "DBWriter":
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        """نوشتن‌های داخل صف انجام می‌شوند؛ بعد از آن submit همه چیز را در thread فراخوان اجرا می‌کند"""
+        with self._submit_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def on_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn: Callable, args: tuple, kwargs: dict) -> Future:
+        if self._stopped or not self._thread.is_alive() or self.on_writer_thread() or self.pool.in_transaction():
+            # تو در تو (داخل یک عملیات یا تراکنش باز همین thread) یا بعد از stop: اجرای مستقیم
+            return _run_now(fn, args, kwargs)
+        fut: Future = Future()
+        with self._submit_lock:
+            if self._stopped:
+                return _run_now(fn, args, kwargs)
+            self._queue.put((fn, args, kwargs, fut, time.perf_counter()))
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return fut
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            # خروج عادی یا غیرعادی thread: چیزی در صف نماند که Futureاش هیچ‌وقت کامل نشود
+            with self._submit_lock:
+                self._stopped = True
+            self._fail_pending(RuntimeError("db writer stopped"))
+
+    def _fail_pending(self, exc: Exception):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[3].set_running_or_notify_cancel():
+                item[3].set_exception(exc)
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.perf_counter() + self.group_wait_s
+            while len(batch) < self.batch_max:
+                wait = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._commit(batch)
+            except Exception:
+                log.exception("db writer batch failed")
+            if stop:
+                return
+
+    def _commit(self, batch: list):
+        done, failed = [], 0
+        pool = self.pool
+        try:
+            with pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, args, kwargs, fut, _t in batch:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    mark = pool.hooks_mark()
+                    conn.execute("SAVEPOINT nexa_write")
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception as e:
+                        pool.drop_hooks(mark)
+                        if not conn.in_transaction:
+                            fut.set_exception(e)
+                            raise
+                        conn.execute("ROLLBACK TO nexa_write")
+                        conn.execute("RELEASE nexa_write")
+                        fut.set_exception(e)
+                        failed += 1
+                    else:
+                        conn.execute("RELEASE nexa_write")
+                        done.append((fut, result))
+                t0 = time.perf_counter()
+                conn.commit()
+                commit_s = time.perf_counter() - t0
+                # باطل‌سازی catalog و کارهای فایل (blob store) عملیات موفق، پیش از کامل شدن Futureها
+                pool.run_hooks()
+        except BaseException as e:
+            pool.drop_hooks()
+            # هیچ‌کدام از عملیات این دسته ماندگار نشده است
+            for _fn, _args, _kwargs, fut, _t in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            with self._lock:
+                self._failed += sum(1 for item in batch if not item[3].cancelled())
+                self._batches += 1
+            raise
+        now = time.perf_counter()
+        ran = [item for item in batch if not item[3].cancelled()]  # لغوشده‌ها (timeout فراخوان) اجرا نشده‌اند
+        with self._lock:
+            self._ops += len(done)
+            self._failed += failed
+            if ran:
+                self._batches += 1
+                self._max_batch = max(self._max_batch, len(ran))
+                self._commit_s.append(commit_s)
+                self._wait_s.extend(now - t for (_fn, _args, _kwargs, _fut, t) in ran)
+        for fut, result in done:
+            fut.set_result(result)
+
+    def stats(self) -> WriterStats:
+        with self._lock:
+            commit = sorted(self._commit_s)
+            wait = sorted(self._wait_s)
+            return WriterStats(
+                self._queue.qsize(), self._max_depth, self._ops, self._failed, self._batches,
+                (self._ops + self._failed) / self._batches if self._batches else 0.0, self._max_batch,
+                _pct(commit, 0.50) * 1000, _pct(commit, 0.95) * 1000,
+                _pct(wait, 0.50) * 1000, _pct(wait, 0.95) * 1000,
+            )
+
+def _run_now(fn: Callable, args: tuple, kwargs: dict) -> Future:
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+@st.cache_resource
+def db_writer() -> Optional[DBWriter]:
+    if not DB_WRITER:
+        return None
+    writer = DBWriter(db_pool(), DB_WRITE_BATCH_MAX, DB_WRITE_GROUP_WAIT_MS).start()
+    atexit.register(writer.stop)
+    return writer
+
+def db_write(fn: Callable, *args, **kwargs) -> Future:
+    """اجرای fn در تراکنش گروهی thread نوشتن؛ fn با db_tx() به همان تراکنش می‌پیوندد.
+    نتیجه (یا خطا) بعد از COMMIT در Future قرار می‌گیرد."""
+    writer = db_writer()
+    if writer is None:
+        return _run_now(fn, args, kwargs)
+    return writer.submit(fn, args, kwargs)
+
+class WriteCancelled(TimeoutError):
+    """عملیات تا پایان مهلت در صف ماند و لغو شد؛ هیچ‌وقت اجرا نمی‌شود و تکرارش امن است"""
+
+class WriteOutcomeUnknown(TimeoutError):
+    """اجرای عملیات شروع شده و تا پایان مهلت تمام نشده؛ ممکن است هنوز commit یا rollback شود.
+    future نتیجه نهایی را دارد (پاک‌سازی فراخوان با future.add_done_callback)."""
+
+    def __init__(self, future: Future):
+        super().__init__("db write still running after timeout; outcome unknown")
+        self.future = future
+
+def db_write_result(fut: Future):
+    """انتظار تا ماندگار شدن، حداکثر DB_WRITE_TIMEOUT_S
+
+    بعد از مهلت: عملیاتی که هنوز در صف است لغو می‌شود (WriteCancelled)؛ عملیاتی که اجرایش شروع
+    شده لغو نمی‌شود (WriteOutcomeUnknown). هر دو TimeoutError هستند.
+    """
+    try:
+        return fut.result(DB_WRITE_TIMEOUT_S)
+    except TimeoutError:
+        # done یعنی TimeoutError از خود عملیات بوده یا همین حالا تمام شده است
+        if not fut.done() and fut.cancel():
+            raise WriteCancelled("db write still queued after timeout; cancelled, never ran") from None
+        if fut.done():
+            return fut.result()
+        raise WriteOutcomeUnknown(fut) from None
+
+def write_op(fn):
+    """helper نوشتن از طریق صف: فراخوانی عادی تا ماندگار شدن صبر می‌کند، fn.submit(...) فقط Future می‌دهد"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return db_write_result(db_write(fn, *args, **kwargs))
+    wrapper.submit = functools.partial(db_write, fn)
+    return wrapper
+
+# =========================================================
+# Blob store (پیوست‌ها روی دیسک، آدرس‌دهی با SHA-256)
+# =========================================================
+BLOB_DIR = "blobs"
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# جدول‌هایی که پیوست دارند؛ ستون file_bytes فقط برای داده‌های قدیمی باقی مانده است
+BLOB_TABLES = ("submissions", "topics", "research", "documents")
+
+class StagedBlob(NamedTuple):
+    sha256: str
+    size: int
+    mime: str
+    tmp_path: str
+
+class BlobStore:
+    """هر فایل یک بار با نام SHA-256 در پوشه‌های دو سطحی ذخیره می‌شود.
+
+    شمارش ارجاع در جدول blobs با trigger نگه داشته می‌شود و gc() فایل‌های
+    بدون ارجاع را پاک می‌کند. تغییر فایل‌ها فقط بعد از COMMIT انجام می‌شود
+    (db_pool().after_commit)، پس ROLLBACK نه فایل بی‌ردیف می‌گذارد نه ردیف بی‌فایل.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        # جابه‌جایی فایل جدید و حذف فایل بی‌ارجاع بعد از COMMIT با هم تداخل نکنند
+        self._files_lock = threading.Lock()
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def derived_path(self, sha256: str, variant: str) -> str:
+        """نسخه‌های مشتق (thumbnail و ...) کنار فایل اصلی، با همان کلید sha256"""
+        return os.path.join(self.root, "derived", variant, sha256[:2], f"{sha256}.webp")
+
+    def stage(self, chunks: Iterable[bytes], mime: str) -> StagedBlob:
+        """نوشتن در فایل موقت و محاسبه hash و اندازه در حین نوشتن"""
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return StagedBlob(h.hexdigest(), size, mime or "", tmp_path)
+
+    def commit(self, conn: sqlite3.Connection, staged: StagedBlob) -> str:
+        """داخل تراکنش نوشتن؛ ردیف blobs همین حالا و فایل بعد از COMMIT به جای خود می‌رود"""
+        conn.execute("""
+        INSERT INTO blobs(sha256,size,mime,refcount,created_ts)
+        VALUES(?,?,?,0,?)
+        ON CONFLICT(sha256) DO NOTHING
+        """, (staged.sha256, staged.size, staged.mime, time.time()))
+        db_pool().after_commit(lambda: self._promote(staged))
+        return staged.sha256
+
+    def _promote(self, staged: StagedBlob):
+        dst = self.path(staged.sha256)
+        with self._files_lock:
+            if os.path.exists(dst):
+                os.remove(staged.tmp_path)
+            else:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(staged.tmp_path, dst)
+
+    def discard(self, staged: Optional[StagedBlob]):
+        if staged and os.path.exists(staged.tmp_path):
+            os.remove(staged.tmp_path)
+
+    def read(self, sha256: str) -> Optional[bytes]:
+        try:
+            with open(self.path(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def iter_chunks(self, sha256: str, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = BLOB_CHUNK_SIZE) -> Iterator[bytes]:
+        """خواندن بازه [start, end) به صورت تکه‌ای؛ حافظه هر انتقال حداکثر یک تکه است"""
+        with open(self.path(sha256), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else max(0, end - start)
+            while remaining is None or remaining > 0:
+                n = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = f.read(n)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def gc(self, conn: sqlite3.Connection) -> List[str]:
+        """حذف ردیف‌های بدون ارجاع (داخل تراکنش نوشتن)؛ فایل‌هایشان بعد از COMMIT پاک می‌شوند"""
+        removed = [sha256 for (sha256,) in conn.execute("DELETE FROM blobs WHERE refcount <= 0 RETURNING sha256")]
+        if removed:
+            db_pool().after_commit(lambda: self._remove_files(removed))
+        return removed
+
+    def _remove_files(self, hashes: List[str]):
+        with self._files_lock, db_conn() as conn:
+            for sha256 in hashes:
+                # همان محتوا ممکن است بعد از COMMIT این gc دوباره آپلود شده باشد
+                if conn.execute("SELECT 1 FROM blobs WHERE sha256=?", (sha256,)).fetchone():
+                    continue
+                for path in [self.path(sha256)] + [self.derived_path(sha256, v) for v in IMAGE_VARIANTS]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+@st.cache_resource
+def blob_store() -> BlobStore:
+    return BlobStore(BLOB_DIR)
+
+BlobSource = bytes | BinaryIO
+
+def _file_chunks(f: BinaryIO, chunk_size: int = BLOB_CHUNK_SIZE) -> Iterator[bytes]:
+    f.seek(0)
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def blob_stage(data: BlobSource | None, mime: str) -> Optional[StagedBlob]:
+    """data می‌تواند bytes یا فایل باز (مثل UploadedFile) باشد؛ فایل تکه‌تکه خوانده می‌شود"""
+    if data is None:
+        return None
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        if not data:
+            return None
+        return blob_store().stage([bytes(data)], mime)
+    staged = blob_store().stage(_file_chunks(data), mime)
+    if staged.size == 0:
+        blob_store().discard(staged)
+        return None
+    return staged
+
+def blob_put(conn: sqlite3.Connection, staged: Optional[StagedBlob]) -> Tuple[Optional[str], Optional[int]]:
+    if staged is None:
+        return (None, None)
+    sha256 = blob_store().commit(conn, staged)
+    if staged.mime.lower().startswith("image/"):
+        # بعد از جابه‌جایی فایل (کارهای after_commit به ترتیب ثبت اجرا می‌شوند)
+        db_pool().after_commit(lambda: image_derivatives().submit(sha256))
+    return (sha256, staged.size)
+
+def blob_write(staged: Optional[StagedBlob], write: Callable):
+    """اجرای write (که پیوست staged را با blob_put ثبت می‌کند) از صف نوشتن؛ فایل موقت فقط وقتی
+    پاک می‌شود که نتیجه قطعی باشد
+
+    اگر مهلت تمام شود ولی اجرای write شروع شده باشد (WriteOutcomeUnknown)، ممکن است هنوز
+    COMMIT شود و _promote فایل موقت را لازم دارد؛ پس پاک‌سازی به پایان همان عملیات سپرده می‌شود.
+    """
+    try:
+        result = db_write_result(db_write(write))
+    except WriteOutcomeUnknown as e:
+        e.future.add_done_callback(lambda _fut: blob_store().discard(staged))
+        raise
+    except BaseException:
+        blob_store().discard(staged)
+        raise
+    # بعد از COMMIT، _promote فایل را جابه‌جا کرده یا حذف کرده است
+    blob_store().discard(staged)
+    return result
+
+def blob_read(sha256: str | None) -> Optional[bytes]:
+    return blob_store().read(sha256) if sha256 else None
+
+def blob_path(sha256: str | None) -> Optional[str]:
+    """مسیر فایل روی دیسک، اگر وجود داشته باشد"""
+    if not sha256:
+        return None
+    path = blob_store().path(sha256)
+    return path if os.path.exists(path) else None
+
+def guess_mime(file_name: str) -> str:
+    return mimetypes.guess_type(file_name or "")[0] or ""
+
+def _db_blob_schema(cur: sqlite3.Cursor):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS blobs(
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mime TEXT NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_ts REAL NOT NULL
+    );
+    """)
+
+    for table in BLOB_TABLES:
+        _db_add_column(cur, table, "file_sha256", "TEXT")
+        _db_add_column(cur, table, "file_size", "INTEGER")
+        _db_add_column(cur, table, "file_mime", "TEXT")
+
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_blob_ins AFTER INSERT ON {table}
+        WHEN NEW.file_sha256 IS NOT NULL
+        BEGIN
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.file_sha256;
+        END;
+        """)
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_blob_del AFTER DELETE ON {table}
+        WHEN OLD.file_sha256 IS NOT NULL
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.file_sha256;
+        END;
+        """)
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_blob_upd AFTER UPDATE OF file_sha256 ON {table}
+        WHEN OLD.file_sha256 IS NOT NEW.file_sha256
+        BEGIN
+            UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = OLD.file_sha256;
+            UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = NEW.file_sha256;
+        END;
+        """)
+
+def _db_hot_indexes(cur: sqlite3.Cursor):
+    # ویترین و میز ارجاع: WHERE status=? ORDER BY created_ts
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_status_created ON submissions(status, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_sender_created ON submissions(sender_phone, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assignments_submission_created ON submission_assignments(submission_id, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assignments_referee_created ON submission_assignments(referee_phone, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_submission_created ON submission_comments(submission_id, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_forum_posts_status_created ON forum_posts(status, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_forum_posts_created ON forum_posts(created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_forum_replies_post_created ON forum_replies(post_id, created_ts)")
+    # covering: db_referees_by_field بدون مراجعه به جدول جواب داده می‌شود
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_referees_field_active
+    ON referees(field, is_active, last_name, first_name, phone, nid)
+    """)
+    # blob_store().gc فقط ردیف‌های بدون ارجاع را می‌خواند
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_blobs_orphans ON blobs(refcount) WHERE refcount <= 0")
+
+def _db_showcase_keyset_index(cur: sqlite3.Cursor):
+    # id باید در index باشد تا (created_ts, id) < (?, ?) بدون مرتب‌سازی جواب بدهد
+    cur.execute("DROP INDEX IF EXISTS idx_submissions_status_created")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_submissions_status_created_id ON submissions(status, created_ts, id)")
+
+def _db_like_counter_triggers(cur: sqlite3.Cursor):
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_submission_likes_ins AFTER INSERT ON submission_likes
+    BEGIN
+        UPDATE submissions SET likes = likes + 1 WHERE id = NEW.submission_id;
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_submission_likes_del AFTER DELETE ON submission_likes
+    BEGIN
+        UPDATE submissions SET likes = likes - 1 WHERE id = OLD.submission_id;
+    END;
+    """)
+    # شروع از مقدار درست
+    cur.execute("""
+    UPDATE submissions
+    SET likes = (SELECT COUNT(*) FROM submission_likes l WHERE l.submission_id = submissions.id)
+    """)
+
+# ---- Full-text search (FTS5) ----
+_FA_TRANSLATE = str.maketrans({
+    "\u064a": "\u06cc", "\u0649": "\u06cc",   # ي ى -> ی
+    "\u0643": "\u06a9",                     # ك -> ک
+    "\u0629": "\u0647", "\u06c0": "\u0647",   # ة ۀ -> ه
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0671": "\u0627",  # أ إ ٱ -> ا
+    "\u0624": "\u0648",                     # ؤ -> و
+    "\u200c": " ",                           # نیم‌فاصله
+    "\u200d": None, "\u0640": None,          # ZWJ و کشیده
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    **{chr(c): None for c in range(0x064B, 0x0660)},  # اعراب
+    "\u0670": None,
+})
+
+def fa_normalize(text: Optional[str]) -> Optional[str]:
+    """یکسان‌سازی متن فارسی برای ایندکس و کوئری جستجو (ی/ک عربی، نیم‌فاصله، ارقام، اعراب)"""
+    if text is None:
+        return None
+    return str(text).translate(_FA_TRANSLATE)
+
+# parser نسخه‌های قدیمی SQLite حدود ۳۰ replace تو در تو را قبول نمی‌کند
+_SQL_NORM_CHUNK = 16
+
+def _sql_fa_normalize(expr: str) -> str:
+    """همان fa_normalize به صورت عبارت SQL؛ triggerها به تابع پایتونی وابسته نیستند و نوشتن از
+    هر اتصالی (sqlite3 CLI، اسکریپت‌های پشتیبان و ...) کار می‌کند.
+
+    replaceها در چند زیرکوئری پشت سر هم‌اند تا عمق تو در تو کم بماند؛ مقصد هیچ نگاشتی خودش
+    مبدأ نیست، پس اجرای پشت سر هم با translate یکی است. expr نباید ستون جدول بیرونی باشد
+    (زیرکوئری FROM به آن دسترسی ندارد)؛ NEW.x در trigger یا پارامتر «?» مناسب است.
+    """
+    items = list(_FA_TRANSLATE.items())
+    query = None
+    for i in range(0, len(items), _SQL_NORM_CHUNK):
+        v = expr if query is None else "v"
+        for src, dst in items[i:i + _SQL_NORM_CHUNK]:
+            to = f"char({ord(dst)})" if dst else "''"
+            v = f"replace({v}, char({src}), {to})"
+        query = f"SELECT {v} AS v" if query is None else f"SELECT {v} AS v FROM ({query})"
+    return f"({query})"
+
+# (kind، جدول، ستون عنوان، ستون متن، شرط نمایش در نتایج)
+SEARCH_SOURCES = [
+    ("submission", "submissions", "title", "description", "NEW.status = 'published'"),
+    ("topic", "topics", "title", "description", "1"),
+    ("research", "research", "title", "summary", "1"),
+    ("forum", "forum_posts", "sender_name", "text", "NEW.status = 'approved'"),
+]
+
+def _db_search_index(cur: sqlite3.Cursor):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS search_docs(
+        doc_id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        ref_id TEXT NOT NULL,
+        UNIQUE(kind, ref_id)
+    );
+    """)
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        title, body, tokenize = 'unicode61 remove_diacritics 2'
+    );
+    """)
+    _db_search_triggers(cur, backfill=True)
+
+def _db_search_triggers(cur: sqlite3.Cursor, backfill: bool):
+    for kind, table, title_col, body_col, visible in SEARCH_SOURCES:
+        # ردیف فقط وقتی در ایندکس است که قابل نمایش باشد (منتشرشده / تاییدشده)
+        remove = f"""
+        DELETE FROM search_fts WHERE rowid = (SELECT doc_id FROM search_docs WHERE kind = '{kind}' AND ref_id = OLD.id);
+        DELETE FROM search_docs WHERE kind = '{kind}' AND ref_id = OLD.id;
+        """
+        add = f"""
+        INSERT INTO search_docs(kind, ref_id) SELECT '{kind}', NEW.id WHERE {visible};
+        INSERT INTO search_fts(rowid, title, body)
+        SELECT doc_id, {_sql_fa_normalize(f"NEW.{title_col}")}, {_sql_fa_normalize(f"NEW.{body_col}")}
+        FROM search_docs WHERE kind = '{kind}' AND ref_id = NEW.id;
+        """
+        status_col = ", status" if "status" in visible else ""
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_search_ins AFTER INSERT ON {table} BEGIN {add} END;")
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_search_del AFTER DELETE ON {table} BEGIN {remove} END;")
+        # فقط تغییر ستون‌های ایندکس‌شده (نه likes/views) ایندکس را به‌روز می‌کند
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_search_upd
+        AFTER UPDATE OF id, {title_col}, {body_col}{status_col} ON {table}
+        BEGIN {remove} {add} END;
+        """)
+
+    if backfill:
+        for kind, table, title_col, body_col, visible in SEARCH_SOURCES:
+            cur.execute(f"""
+            INSERT OR IGNORE INTO search_docs(kind, ref_id)
+            SELECT '{kind}', id FROM {table} WHERE {visible.replace("NEW.", "")}
+            """)
+            rows = cur.execute(f"""
+            SELECT d.doc_id, t.{title_col}, t.{body_col}
+            FROM search_docs d JOIN {table} t ON t.id = d.ref_id
+            WHERE d.kind = '{kind}'
+            """).fetchall()
+            cur.executemany("INSERT INTO search_fts(rowid, title, body) VALUES(?,?,?)",
+                            [(doc_id, fa_normalize(title), fa_normalize(body)) for (doc_id, title, body) in rows])
+
+def _db_search_triggers_sql_norm(cur: sqlite3.Cursor):
+    # triggerهای نسخه ۵ تابع nexa_norm (فقط ثبت‌شده در DBPool) را صدا می‌زدند
+    for _kind, table, *_rest in SEARCH_SOURCES:
+        for op in ("ins", "del", "upd"):
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_{table}_search_{op}")
+    _db_search_triggers(cur, backfill=False)
+
+# ---- IDs ----
+# (جدول، [(جدول ارجاع‌دهنده، ستون)])
+ID_TABLES = [
+    ("topics", [("submissions", "suggested_topic_id")]),
+    ("research", []),
+    ("documents", []),
+    ("submissions", [("submission_assignments", "submission_id"), ("submission_likes", "submission_id"),
+                     ("submission_comments", "submission_id")]),
+    ("submission_assignments", []),
+    ("submission_comments", []),
+    ("forum_posts", [("forum_replies", "post_id")]),
+    ("forum_replies", []),
+]
+_ULID_ID_RE = re.compile(r"^[a-z]*[0-9A-HJKMNP-TV-Z]{26}$")
+
+def _db_ulid_ids(cur: sqlite3.Cursor):
+    """تبدیل شناسه‌های قدیمی (s5001، ...) به ULID ساخته‌شده از created_ts همان ردیف
+
+    بخش تصادفی از hash شناسه قدیمی می‌آید تا نتیجه قطعی باشد. بررسی foreign key تا
+    پایان تراکنش به تعویق می‌افتد و ارجاع‌ها در همان تراکنش به‌روز می‌شوند.
+    """
+    cur.execute("PRAGMA defer_foreign_keys=ON")
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS _id_map(old TEXT PRIMARY KEY, new TEXT NOT NULL)")
+    for table, refs in ID_TABLES:
+        cur.execute("DELETE FROM _id_map")
+        mapping = []
+        for (old, created_ts) in cur.execute(f"SELECT id, created_ts FROM {table}").fetchall():
+            if _ULID_ID_RE.match(old):
+                continue
+            prefix = re.match(r"[a-z]*", old).group(0)
+            rand = int.from_bytes(hashlib.sha256(f"{table}:{old}".encode("utf-8")).digest()[:10], "big")
+            mapping.append((old, prefix + ulid_at(int(created_ts * 1000), rand)))
+        if not mapping:
+            continue
+        cur.executemany("INSERT INTO _id_map(old, new) VALUES(?,?)", mapping)
+        cur.execute(f"UPDATE {table} SET id = (SELECT new FROM _id_map WHERE old = {table}.id) "
+                    f"WHERE id IN (SELECT old FROM _id_map)")
+        for ref_table, col in refs:
+            cur.execute(f"UPDATE {ref_table} SET {col} = (SELECT new FROM _id_map WHERE old = {ref_table}.{col}) "
+                        f"WHERE {col} IN (SELECT old FROM _id_map)")
+    cur.execute("DROP TABLE _id_map")
+
+# ---- Submission stats (rollup) ----
+def _db_submission_stats(cur: sqlite3.Cursor):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS submission_stats(
+        field TEXT NOT NULL,
+        status TEXT NOT NULL,
+        content_type TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY(field, status, content_type)
+    ) WITHOUT ROWID;
+    """)
+    inc = """
+    INSERT INTO submission_stats(field, status, content_type, n)
+    VALUES(NEW.field, NEW.status, NEW.content_type, 1)
+    ON CONFLICT(field, status, content_type) DO UPDATE SET n = n + 1;
+    """
+    # ردیف‌های صفر حذف می‌شوند تا اندازه جدول به ترکیب‌های موجود محدود بماند
+    dec = """
+    UPDATE submission_stats SET n = n - 1
+    WHERE field = OLD.field AND status = OLD.status AND content_type = OLD.content_type;
+    DELETE FROM submission_stats
+    WHERE field = OLD.field AND status = OLD.status AND content_type = OLD.content_type AND n <= 0;
+    """
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_submissions_stats_ins AFTER INSERT ON submissions BEGIN {inc} END;")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_submissions_stats_del AFTER DELETE ON submissions BEGIN {dec} END;")
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_submissions_stats_upd
+    AFTER UPDATE OF field, status, content_type ON submissions
+    WHEN OLD.field IS NOT NEW.field OR OLD.status IS NOT NEW.status OR OLD.content_type IS NOT NEW.content_type
+    BEGIN {dec} {inc} END;
+    """)
+    cur.execute("DELETE FROM submission_stats")
+    cur.execute("""
+    INSERT INTO submission_stats(field, status, content_type, n)
+    SELECT field, status, content_type, COUNT(*) FROM submissions GROUP BY field, status, content_type
+    """)
+
+# ---- Referee load (برای ارجاع خودکار) ----
+REFEREE_LATENCY_ALPHA = 0.3   # وزن آخرین داوری در میانگین متحرک نمایی زمان پاسخ
+
+def _db_referee_load(cur: sqlite3.Cursor):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS referee_load(
+        referee_phone TEXT PRIMARY KEY,
+        open_count INTEGER NOT NULL DEFAULT 0,
+        reviews INTEGER NOT NULL DEFAULT 0,
+        latency_ewma_s REAL,
+        last_assigned_ts REAL
+    );
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_assignments_load_ins AFTER INSERT ON submission_assignments
+    BEGIN
+        INSERT INTO referee_load(referee_phone, open_count, last_assigned_ts)
+        VALUES(NEW.referee_phone, NEW.reviewed_ts IS NULL, NEW.created_ts)
+        ON CONFLICT(referee_phone) DO UPDATE SET
+            open_count = open_count + (NEW.reviewed_ts IS NULL),
+            last_assigned_ts = MAX(COALESCE(last_assigned_ts, 0), NEW.created_ts);
+    END;
+    """)
+    # فقط اولین ثبت نتیجه (reviewed_ts از NULL به مقدار) شمرده می‌شود، نه ویرایش‌های بعدی
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_assignments_load_review AFTER UPDATE OF reviewed_ts ON submission_assignments
+    WHEN OLD.reviewed_ts IS NULL AND NEW.reviewed_ts IS NOT NULL
+    BEGIN
+        UPDATE referee_load SET
+            open_count = MAX(open_count - 1, 0),
+            reviews = reviews + 1,
+            latency_ewma_s = CASE
+                WHEN latency_ewma_s IS NULL THEN NEW.reviewed_ts - NEW.created_ts
+                ELSE {REFEREE_LATENCY_ALPHA} * (NEW.reviewed_ts - NEW.created_ts)
+                     + {1 - REFEREE_LATENCY_ALPHA} * latency_ewma_s
+            END
+        WHERE referee_phone = NEW.referee_phone;
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_assignments_load_del AFTER DELETE ON submission_assignments
+    WHEN OLD.reviewed_ts IS NULL
+    BEGIN
+        UPDATE referee_load SET open_count = MAX(open_count - 1, 0) WHERE referee_phone = OLD.referee_phone;
+    END;
+    """)
+    cur.execute("DELETE FROM referee_load")
+    cur.execute("""
+    INSERT INTO referee_load(referee_phone, open_count, reviews, latency_ewma_s, last_assigned_ts)
+    SELECT referee_phone,
+           SUM(reviewed_ts IS NULL),
+           COUNT(reviewed_ts),
+           AVG(reviewed_ts - created_ts),
+           MAX(created_ts)
+    FROM submission_assignments
+    GROUP BY referee_phone
+    """)
+
+def _db_referee_tasks_keyset_index(cur: sqlite3.Cursor):
+    # فهرست ارجاعات داور: WHERE referee_phone=? ORDER BY created_ts DESC, id DESC
+    cur.execute("DROP INDEX IF EXISTS idx_assignments_referee_created")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_assignments_referee_created_id
+    ON submission_assignments(referee_phone, created_ts, id)
+    """)
+
+def _db_app_meta(cur: sqlite3.Cursor):
+    # پرچم کارهای یک‌باره‌ای که بیرون از migrationها و در چند تراکنش انجام می‌شوند
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS app_meta(
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """)
+
+def _db_assignments_open_unique(cur: sqlite3.Cursor):
+    # هر داور برای هر محتوا حداکثر یک ارجاع باز؛ ارجاع دوباره بعد از داوری (مثلاً پس از اصلاح) مجاز است.
+    # تکراری‌های قبلی (کلیک هم‌زمان دو مدیر) حذف می‌شوند و trigger بار داور را اصلاح می‌کند.
+    cur.execute("""
+    DELETE FROM submission_assignments WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY submission_id, referee_phone ORDER BY created_ts, id) AS n
+            FROM submission_assignments WHERE reviewed_ts IS NULL
+        ) WHERE n > 1
+    )
+    """)
+    cur.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_assignments_open_unique
+    ON submission_assignments(submission_id, referee_phone) WHERE reviewed_ts IS NULL
+    """)
+
+# هر تابع یک نسخه از schema است؛ فقط به انتهای این لیست اضافه کنید
+DB_MIGRATIONS = [
+    _db_blob_schema,               # 1
+    _db_hot_indexes,               # 2
+    _db_showcase_keyset_index,     # 3
+    _db_like_counter_triggers,     # 4
+    _db_search_index,              # 5
+    _db_ulid_ids,                  # 6
+    _db_submission_stats,          # 7
+    _db_referee_load,              # 8
+    _db_referee_tasks_keyset_index,  # 9
+    _db_app_meta,                  # 10
+    _db_assignments_open_unique,   # 11
+    _db_search_triggers_sql_norm,  # 12
+]
+
+def _sqlite_blob_chunks(conn: sqlite3.Connection, table: str, rowid: int):
+    with conn.blobopen(table, "file_bytes", rowid, readonly=True) as blob:
+        while True:
+            chunk = blob.read(BLOB_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+BLOB_MIGRATED_KEY = "blob_inline_migrated"
+
+def blob_migrate_inline() -> int:
+    """انتقال BLOBهای قدیمی از nexa.db به blob store، ردیف به ردیف و به صورت تکه‌تکه
+
+    جدول‌ها یک بار با rowid پیمایش می‌شوند؛ بعد از پایان کار پرچم app_meta ثبت می‌شود و
+    شروع‌های بعدی پروسه هیچ کوئری روی جدول‌ها نمی‌زنند (برنامه دیگر file_bytes نمی‌نویسد).
+    """
+    with db_conn() as conn:
+        if conn.execute("SELECT 1 FROM app_meta WHERE key=?", (BLOB_MIGRATED_KEY,)).fetchone():
+            return 0
+    store = blob_store()
+    moved = 0
+    for table in BLOB_TABLES:
+        last = 0
+        while True:
+            with db_conn() as conn:
+                row = conn.execute(f"""
+                SELECT rowid, file_name, file_mime FROM {table}
+                WHERE rowid > ? AND file_sha256 IS NULL AND length(file_bytes) > 0
+                ORDER BY rowid
+                LIMIT 1
+                """, (last,)).fetchone()
+                if not row:
+                    break
+                rowid, fname, fmime = row
+                last = rowid
+                staged = store.stage(_sqlite_blob_chunks(conn, table, rowid), fmime or guess_mime(fname))
+            try:
+                with db_tx() as conn:
+                    store.commit(conn, staged)
+                    # documents.file_bytes ستون NOT NULL است
+                    conn.execute(f"""
+                    UPDATE {table}
+                    SET file_sha256=?, file_size=?, file_mime=?, file_bytes=?
+                    WHERE rowid=?
+                    """, (staged.sha256, staged.size, staged.mime, b"" if table == "documents" else None, rowid))
+            finally:
+                store.discard(staged)
+            moved += 1
+    with db_tx() as conn:
+        conn.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?, ?)", (BLOB_MIGRATED_KEY, str(time.time())))
+    return moved
+
+# =========================================================
+# Image derivatives (thumbnail / medium)
+# =========================================================
+class ImageVariant(NamedTuple):
+    max_side: int
+    quality: int
+
+IMAGE_VARIANTS = {
+    "thumb": ImageVariant(480, 70),
+    "medium": ImageVariant(1280, 82),
+}
+IMAGE_DERIVE_WORKERS = int(os.environ.get("NEXA_IMAGE_DERIVE_WORKERS", "2"))
+IMAGE_DERIVE_WAIT_S = float(os.environ.get("NEXA_IMAGE_DERIVE_WAIT_S", "2.0"))
+
+def _derive_image(src: str, dst: str, variant: ImageVariant):
+    """کوچک‌سازی، حذف EXIF (بعد از اعمال چرخش) و فشرده‌سازی مجدد به WebP"""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        img.draft("RGB", (variant.max_side, variant.max_side))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        img.thumbnail((variant.max_side, variant.max_side), Image.Resampling.LANCZOS)
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, format="WEBP", quality=variant.quality, method=4)
+            os.replace(tmp_path, dst)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+class ImageDerivatives:
+    """ساخت نسخه‌های کوچک تصویر روی یک pool محدود؛ هر sha256 فقط یک بار در صف است"""
+
+    def __init__(self, store: BlobStore, workers: int):
+        from concurrent.futures import ThreadPoolExecutor
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="nexa-derive")
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._failed = set()
+
+    def _run(self, sha256: str):
+        src = self.store.path(sha256)
+        for name, variant in IMAGE_VARIANTS.items():
+            dst = self.store.derived_path(sha256, name)
+            if not os.path.exists(dst):
+                _derive_image(src, dst, variant)
+
+    def _done(self, sha256: str, future):
+        with self._lock:
+            self._futures.pop(sha256, None)
+            if future.exception() is not None:
+                self._failed.add(sha256)
+        if future.exception() is not None:
+            log.warning("image derivative failed for %s: %s", sha256, future.exception())
+
+    def submit(self, sha256: str):
+        with self._lock:
+            future = self._futures.get(sha256)
+            if future is None:
+                future = self._executor.submit(self._run, sha256)
+                self._futures[sha256] = future
+                future.add_done_callback(functools.partial(self._done, sha256))
+        return future
+
+    def path(self, sha256: str, variant: str, wait_s: float = 0.0) -> Optional[str]:
+        """مسیر نسخه مشتق؛ اگر هنوز ساخته نشده در صف قرار می‌گیرد و حداکثر wait_s صبر می‌شود"""
+        dst = self.store.derived_path(sha256, variant)
+        if os.path.exists(dst):
+            return dst
+        if sha256 in self._failed or not os.path.exists(self.store.path(sha256)):
+            return None
+        future = self.submit(sha256)
+        try:
+            future.result(timeout=wait_s)
+        except Exception:
+            return None
+        return dst if os.path.exists(dst) else None
+
+@st.cache_resource
+def image_derivatives() -> ImageDerivatives:
+    return ImageDerivatives(blob_store(), IMAGE_DERIVE_WORKERS)
+
+# =========================================================
+# Media server (HTTP Range + signed URLs)
+# =========================================================
+# پیش‌فرض فقط loopback؛ برای دسترسی مستقیم کاربران از شبکه NEXA_MEDIA_HOST=0.0.0.0 (آگاهانه)
+# یا بهتر، انتشار از طریق reverse proxy و NEXA_MEDIA_PUBLIC_URL
+MEDIA_HOST = os.environ.get("NEXA_MEDIA_HOST", "127.0.0.1")
+MEDIA_PORT = int(os.environ.get("NEXA_MEDIA_PORT", "8502"))
+# آدرس عمومی (مثلاً پشت reverse proxy)؛ اگر خالی باشد از Host درخواست ساخته می‌شود
+MEDIA_PUBLIC_URL = os.environ.get("NEXA_MEDIA_PUBLIC_URL", "").rstrip("/")
+MEDIA_URL_TTL_S = int(os.environ.get("NEXA_MEDIA_URL_TTL_S", "900"))
+# اگر خالی باشد، کلید یک بار ساخته و در app_meta همان DB نگه داشته می‌شود
+MEDIA_SECRET = os.environ.get("NEXA_MEDIA_SECRET", "")
+MEDIA_SECRET_KEY = "media_secret"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+@st.cache_resource
+def media_secret() -> bytes:
+    """کلید امضای آدرس‌ها؛ بین restartها و همه پروسه‌هایی که از یک nexa.db استفاده می‌کنند مشترک است"""
+    if MEDIA_SECRET:
+        return MEDIA_SECRET.encode("utf-8")
+    with db_tx() as conn:
+        conn.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES(?, ?)", (MEDIA_SECRET_KEY, os.urandom(32).hex()))
+        return bytes.fromhex(conn.execute("SELECT value FROM app_meta WHERE key=?", (MEDIA_SECRET_KEY,)).fetchone()[0])
+
+def media_sign(sha256: str, exp: int, download: int, name: str) -> str:
+    msg = f"{sha256}\n{exp}\n{download}\n{name}".encode("utf-8")
+    return hmac.new(media_secret(), msg, hashlib.sha256).hexdigest()[:32]
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """فقط یک بازه پشتیبانی می‌شود؛ خروجی [start, end) یا None برای بازه نامعتبر"""
+    m = _RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        n = int(m.group(2))
+        if n == 0:
+            return None
+        return (max(0, size - n), size)
+    start = int(m.group(1))
+    end = int(m.group(2)) + 1 if m.group(2) else size
+    if start >= size or end <= start:
+        return None
+    return (start, min(end, size))
+
+class MediaRequestHandler(http.server.BaseHTTPRequestHandler):
+    """GET/HEAD /media/<sha256>?exp=..&dl=..&name=..&sig=.."""
+
+    server_version = "NexaMedia/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        log.debug("media: " + format, *args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _error(self, code: int, headers: Optional[dict] = None):
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _serve(self, send_body: bool):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "media" or not re.fullmatch(r"[0-9a-f]{64}", parts[1]):
+            return self._error(404)
+        sha256 = parts[1]
+        q = urllib.parse.parse_qs(url.query)
+        try:
+            exp = int(q["exp"][0])
+            download = int(q.get("dl", ["0"])[0])
+            name = q.get("name", [""])[0]
+            sig = q["sig"][0]
+        except (KeyError, ValueError):
+            return self._error(403)
+        if exp < time.time() or not hmac.compare_digest(sig, media_sign(sha256, exp, download, name)):
+            return self._error(403)
+
+        with db_conn() as conn:
+            row = conn.execute("SELECT size, mime FROM blobs WHERE sha256=?", (sha256,)).fetchone()
+        path = blob_store().path(sha256)
+        if not row or not os.path.exists(path):
+            return self._error(404)
+        size = os.path.getsize(path)
+        mime = row[1] or guess_mime(name) or "application/octet-stream"
+
+        # فایل‌ها با sha256 آدرس‌دهی می‌شوند، پس ETag قوی و ثابت است
+        etag = f'"{sha256}"'
+        headers = {
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"private, max-age={max(0, exp - int(time.time()))}",
+        }
+        if download:
+            quoted = urllib.parse.quote(name or sha256)
+            headers["Content-Disposition"] = f"attachment; filename=\"file\"; filename*=UTF-8''{quoted}"
+
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return self._error(304, headers)
+
+        start, end, status = 0, size, 200
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            rng = _parse_range(range_header, size)
+            if rng is None:
+                return self._error(416, {"Content-Range": f"bytes */{size}"})
+            (start, end), status = rng, 206
+
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(end - start))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        self.end_headers()
+        if not send_body:
+            return
+        try:
+            for chunk in blob_store().iter_chunks(sha256, start, end):
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # کاربر پخش را متوقف یا seek کرده است
+
+class MediaServer:
+    def __init__(self, host: str, port: int):
+        self.httpd = http.server.ThreadingHTTPServer((host, port), MediaRequestHandler)
+        self.httpd.daemon_threads = True
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="nexa-media", daemon=True)
+        self._thread.start()
+        atexit.register(self.httpd.shutdown)
+
+@st.cache_resource
+def media_server() -> Optional[MediaServer]:
+    media_secret()
+    try:
+        return MediaServer(MEDIA_HOST, MEDIA_PORT)
+    except OSError as e:
+        log.warning("media server disabled (%s:%s): %s", MEDIA_HOST, MEDIA_PORT, e)
+        return None
+
+_LOOPBACK_HOSTS = {"localhost", "127.0.0.1", "::1", "[::1]"}
+
+def _media_base_url(server: MediaServer) -> Optional[str]:
+    """آدرس media server از دید مرورگر؛ None یعنی دسترسی مستقیم ممکن نیست (مسیر دانلود Streamlit)
+
+    بدون NEXA_MEDIA_PUBLIC_URL فقط وقتی آدرس ساخته می‌شود که صفحه مستقیم (بدون proxy) و با
+    http باز شده باشد؛ پشت proxy پورت media معلوم نیست منتشر شده باشد و صفحه https با لینک
+    http مسدود می‌شود (mixed content).
+    """
+    if MEDIA_PUBLIC_URL:
+        return MEDIA_PUBLIC_URL
+    try:
+        headers = st.context.headers
+        host = headers.get("Host") or "localhost"
+        proxied = any(headers.get(h) for h in ("X-Forwarded-Proto", "X-Forwarded-Host", "X-Forwarded-For", "Forwarded"))
+    except Exception:
+        host, proxied = "localhost", False
+    if proxied or st.get_option("server.sslCertFile"):
+        return None
+    host = re.sub(r":\d+$", "", host)
+    if host not in _LOOPBACK_HOSTS and server.host in _LOOPBACK_HOSTS:
+        return None  # کاربر از شبکه، سرور فقط روی loopback
+    return f"http://{host}:{server.port}"
+
+def media_url(sha256: str, name: str = "", download: bool = False) -> Optional[str]:
+    """آدرس امضاشده کوتاه‌مدت؛ انقضا روی بازه‌های TTL گرد می‌شود تا آدرس بین rerunها ثابت بماند"""
+    server = media_server()
+    if server is None:
+        return None
+    base = _media_base_url(server)
+    if base is None:
+        return None
+    exp = (int(time.time()) // MEDIA_URL_TTL_S + 2) * MEDIA_URL_TTL_S
+    dl = 1 if download else 0
+    query = urllib.parse.urlencode({"exp": exp, "dl": dl, "name": name, "sig": media_sign(sha256, exp, dl, name)})
+    return f"{base}/media/{sha256}?{query}"
 
 # =========================================================
 # Utils
@@ -194,9 +1955,50 @@ def status_fa(s: str) -> str:
         "guest": "مهمان",
     }.get(s, s)
 
+# ---- IDs (ULID: ۴۸ بیت زمان میلی‌ثانیه + ۸۰ بیت تصادفی، Crockford base32) ----
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ULID_RAND_MAX = (1 << 80) - 1
+
+def _b32(n: int, length: int) -> str:
+    out = []
+    for _ in range(length):
+        out.append(_CROCKFORD[n & 31])
+        n >>= 5
+    return "".join(reversed(out))
+
+def ulid_at(ts_ms: int, rand: int) -> str:
+    return _b32(ts_ms, 10) + _b32(rand, 16)
+
+class IdGenerator:
+    """شناسه‌های یکتا و مرتب بر اساس زمان؛ در یک process اکیداً صعودی
+
+    اگر چند شناسه در یک میلی‌ثانیه (یا با عقب رفتن ساعت) ساخته شوند، بخش تصادفی
+    یکی زیاد می‌شود. بین processها ۸۰ بیت تصادفی احتمال برخورد را ناچیز می‌کند.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_rand = 0
+
+    def new(self) -> str:
+        with self._lock:
+            ms = int(time.time() * 1000)
+            if ms > self._last_ms:
+                rand = int.from_bytes(os.urandom(10), "big")
+            else:
+                ms, rand = self._last_ms, self._last_rand + 1
+                if rand > _ULID_RAND_MAX:
+                    ms, rand = ms + 1, int.from_bytes(os.urandom(10), "big")
+            self._last_ms, self._last_rand = ms, rand
+        return ulid_at(ms, rand)
+
+@st.cache_resource
+def id_generator() -> IdGenerator:
+    return IdGenerator()
+
 def make_id(prefix: str) -> str:
-    st.session_state._id_counter += 1
-    return f"{prefix}{st.session_state._id_counter}"
+    return f"{prefix}{id_generator().new()}"
 
 def pick_existing(paths: List[str]) -> str:
     for p in paths:
@@ -207,426 +2009,1290 @@ def pick_existing(paths: List[str]) -> str:
 def is_admin() -> bool:
     return st.session_state.role == "manager"
 
-def render_media(file_bytes: bytes | None, mime: str, file_name: str = ""):
-    """نمایش پیوست در Streamlit بر اساس mime"""
-    if not file_bytes or not mime:
+def render_media(file_sha256: str | None, mime: str, file_name: str = "", variant: str = "thumb"):
+    """نمایش پیوست در Streamlit بر اساس mime
+
+    تصاویر با نسخه کوچک (variant) نمایش داده می‌شوند؛ در صفحه جزئیات (medium)
+    فایل اصلی فقط با دکمه دانلود در دسترس است.
+    """
+    if not file_sha256 or not mime:
         st.info("پیوست ندارد.")
         return
 
+    # به جای bytes مسیر فایل داده می‌شود تا اسکریپت محتوا را در حافظه نگه ندارد
+    file_path = blob_path(file_sha256)
+    if not file_path:
+        st.warning("فایل پیوست پیدا نشد.")
+        return
+
     m = str(mime).lower()
 
     if m.startswith("image/"):
-        st.image(file_bytes, use_container_width=True)
+        st.image(image_derivatives().path(file_sha256, variant, IMAGE_DERIVE_WAIT_S) or file_path, use_container_width=True)
+        if variant != "thumb":
+            blob_download_button("⬇️ دانلود تصویر اصلی", file_sha256, file_name or "image", key=f"dl_orig_{file_sha256}", mime=m)
     elif m.startswith("video/"):
-        st.video(file_bytes)
+        st.video(media_url(file_sha256, file_name) or file_path, format=m)
     elif m.startswith("audio/"):
-        st.audio(file_bytes)
+        st.audio(media_url(file_sha256, file_name) or file_path, format=m)
     elif m in ("application/pdf",) or (file_name and file_name.lower().endswith(".pdf")):
-        st.download_button("📄 دانلود PDF", data=file_bytes, file_name=file_name or "document.pdf")
+        blob_download_button("📄 دانلود PDF", file_sha256, file_name or "document.pdf", mime=m)
     else:
-        st.download_button("⬇️ دانلود فایل", data=file_bytes, file_name=file_name or "file")
+        blob_download_button("⬇️ دانلود فایل", file_sha256, file_name or "file", mime=m)
+
+def blob_download_button(label: str, file_sha256: str, file_name: str, key: Optional[str] = None, mime: Optional[str] = None):
+    """لینک دانلود از media server؛ اگر در دسترس نباشد، دکمه دانلود با داده تأخیری"""
+    url = media_url(file_sha256, file_name, download=True)
+    if url:
+        st.link_button(label, url, key=key)
+        return
+    # streamlit فایل باز را می‌خواند ولی نمی‌بندد؛ پس بایت‌ها (فایل داخل with خوانده می‌شود)
+    st.download_button(label, data=lambda: blob_read(file_sha256) or b"",
+                       file_name=file_name, mime=mime or guess_mime(file_name) or None, key=key)
 
 
+# =========================================================
+# Catalog cache (مشترک بین sessionها، باطل‌سازی با شمارنده نسل)
+# =========================================================
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get("NEXA_CATALOG_CACHE_MAX_ENTRIES", "256"))
+
+class CatalogCache:
+    """cache خواندنی برای کوئری‌هایی که کم تغییر می‌کنند.
+
+    هر جدول یک شمارنده نسل دارد که helperهای نوشتن بعد از commit آن را بالا
+    می‌برند؛ کلید هر نتیجه شامل نسل جدول‌های وابسته است، پس نتیجه قدیمی دیگر
+    خوانده نمی‌شود و با LRU بیرون می‌رود.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._generations: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump(self, *tables: str):
+        with self._lock:
+            for t in tables:
+                self._generations[t] = self._generations.get(t, 0) + 1
+
+    def get_or_load(self, name: str, params: tuple, tables: Tuple[str, ...], loader: Callable[[], object]):
+        with self._lock:
+            key = (name, params, tuple(self._generations.get(t, 0) for t in tables))
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+                "generations": dict(self._generations),
+            }
+
+@st.cache_resource
+def catalog_cache() -> CatalogCache:
+    return CatalogCache(CATALOG_CACHE_MAX_ENTRIES)
+
+def catalog_bump(*tables: str):
+    """بعد از commit؛ داخل تراکنش باز (مثل دسته thread نوشتن) تا COMMIT عقب می‌افتد"""
+    db_pool().after_commit(lambda: catalog_cache().bump(*tables))
+
+def cached_query(*tables: str):
+    """نتیجه را تا تغییر یکی از tables نگه می‌دارد؛ نتیجه بین sessionها مشترک است و نباید تغییر داده شود"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            params = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+            return catalog_cache().get_or_load(fn.__name__, params, tables, lambda: fn(*args))
+        return wrapper
+    return deco
+
 # =========================================================
 # DB CRUD
 # =========================================================
 def db_user_get(phone: str):
-    conn = db_conn()
-    row = conn.execute("SELECT phone,name,nid,password FROM users WHERE phone=?", (phone,)).fetchone()
-    conn.close()
-    return row
+    with db_conn() as conn:
+        return conn.execute("SELECT phone,name,nid,password FROM users WHERE phone=?", (phone,)).fetchone()
 
+@write_op
 def db_user_upsert(phone: str, name: str, nid: str, password: str):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO users(phone,name,nid,password,created_ts)
-    VALUES(?,?,?,?,?)
-    ON CONFLICT(phone) DO UPDATE SET name=excluded.name, nid=excluded.nid, password=excluded.password
-    """, (phone, name, nid, password, time.time()))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        INSERT INTO users(phone,name,nid,password,created_ts)
+        VALUES(?,?,?,?,?)
+        ON CONFLICT(phone) DO UPDATE SET name=excluded.name, nid=excluded.nid, password=excluded.password
+        """, (phone, name, nid, password, time.time()))
+
+@write_op
+def db_users_upsert_many(rows: List[Tuple[str, str, str, str]]):
+    """rows: (phone, name, nid, password)؛ همه در یک تراکنش"""
+    now = time.time()
+    with db_tx() as conn:
+        conn.executemany("""
+        INSERT INTO users(phone,name,nid,password,created_ts)
+        VALUES(?,?,?,?,?)
+        ON CONFLICT(phone) DO UPDATE SET name=excluded.name, nid=excluded.nid, password=excluded.password
+        """, [(*r, now) for r in rows])
 
 def db_users_all():
-    conn = db_conn()
-    rows = conn.execute(
-        "SELECT phone,name,nid,password,created_ts FROM users ORDER BY created_ts DESC"
-    ).fetchall()
-    conn.close()
-    return rows
+    with db_conn() as conn:
+        return conn.execute(
+            "SELECT phone,name,nid,password,created_ts FROM users ORDER BY created_ts DESC"
+        ).fetchall()
 
+@write_op
 def db_user_update(phone: str, name: str, nid: str, password: str):
-    conn = db_conn()
-    conn.execute(
-        "UPDATE users SET name=?, nid=?, password=? WHERE phone=?",
-        (name, nid, password, phone),
-    )
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute(
+            "UPDATE users SET name=?, nid=?, password=? WHERE phone=?",
+            (name, nid, password, phone),
+        )
 
+@write_op
 def db_referee_upsert(phone: str, first: str, last: str, nid: str, field_: str, password: str, active: bool):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO referees(phone,first_name,last_name,nid,field,password,is_active,created_ts)
-    VALUES(?,?,?,?,?,?,?,?)
-    ON CONFLICT(phone) DO UPDATE SET first_name=excluded.first_name, last_name=excluded.last_name,
-    nid=excluded.nid, field=excluded.field, password=excluded.password, is_active=excluded.is_active
-    """, (phone, first, last, nid, field_, password, 1 if active else 0, time.time()))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        INSERT INTO referees(phone,first_name,last_name,nid,field,password,is_active,created_ts)
+        VALUES(?,?,?,?,?,?,?,?)
+        ON CONFLICT(phone) DO UPDATE SET first_name=excluded.first_name, last_name=excluded.last_name,
+        nid=excluded.nid, field=excluded.field, password=excluded.password, is_active=excluded.is_active
+        """, (phone, first, last, nid, field_, password, 1 if active else 0, time.time()))
+    catalog_bump("referees")
+
+@write_op
+def db_referees_upsert_many(rows: List[Tuple[str, str, str, str, str, str, int]]):
+    """rows: (phone, first, last, nid, field, password, is_active)؛ همه در یک تراکنش"""
+    now = time.time()
+    with db_tx() as conn:
+        conn.executemany("""
+        INSERT INTO referees(phone,first_name,last_name,nid,field,password,is_active,created_ts)
+        VALUES(?,?,?,?,?,?,?,?)
+        ON CONFLICT(phone) DO UPDATE SET first_name=excluded.first_name, last_name=excluded.last_name,
+        nid=excluded.nid, field=excluded.field, password=excluded.password, is_active=excluded.is_active
+        """, [(*r, now) for r in rows])
+    catalog_bump("referees")
 
 def db_referee_find(phone: str, nid: str, password: str):
-    conn = db_conn()
-    row = conn.execute("""
-    SELECT first_name,last_name,phone,nid,field,password,is_active
-    FROM referees
-    WHERE phone=? AND nid=? AND password=? AND is_active=1
-    """, (phone, nid, password)).fetchone()
-    conn.close()
-    return row
-
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT first_name,last_name,phone,nid,field,password,is_active
+        FROM referees
+        WHERE phone=? AND nid=? AND password=? AND is_active=1
+        """, (phone, nid, password)).fetchone()
+
+@cached_query("referees")
 def db_referees_by_field(field_: str):
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT first_name,last_name,phone,nid,field
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT first_name,last_name,phone,nid,field
+        FROM referees
+        WHERE field=? AND is_active=1
+        ORDER BY last_name, first_name
+        """, (field_,)).fetchall()
+
+@cached_query("referees")
+def db_referees_by_fields(fields: List[str]) -> dict:
+    """داوران فعال چند حوزه در یک کوئری؛ {field: [ردیف مثل db_referees_by_field]}"""
+    return _db_children("""
+    SELECT field, first_name,last_name,phone,nid,field
     FROM referees
-    WHERE field=? AND is_active=1
-    ORDER BY last_name, first_name
-    """, (field_,)).fetchall()
-    conn.close()
-    return rows
+    WHERE field IN (SELECT value FROM json_each(?)) AND is_active=1
+    ORDER BY field, last_name, first_name
+    """, fields)
 
 def db_referees_all():
-    conn = db_conn()
-    rows = conn.execute(
-        "SELECT first_name,last_name,phone,nid,field,password,is_active,created_ts FROM referees ORDER BY created_ts DESC"
-    ).fetchall()
-    conn.close()
-    return rows
+    with db_conn() as conn:
+        return conn.execute(
+            "SELECT first_name,last_name,phone,nid,field,password,is_active,created_ts FROM referees ORDER BY created_ts DESC"
+        ).fetchall()
 
+@write_op
 def db_referee_delete(phone: str):
-    conn = db_conn()
-    conn.execute("DELETE FROM referees WHERE phone=?", (phone,))
-    conn.commit()
-    conn.close()
-
-def db_topic_insert(id_: str, title: str, field_: str, description: str, file_name: str, file_bytes: bytes | None):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO topics(id,title,field,description,file_name,file_bytes,created_ts)
-    VALUES(?,?,?,?,?,?,?)
-    """, (id_, title, field_, description, file_name, file_bytes, time.time()))
-    conn.commit()
-    conn.close()
-
+    with db_tx() as conn:
+        conn.execute("DELETE FROM referees WHERE phone=?", (phone,))
+    catalog_bump("referees")
+
+def db_topic_insert(id_: str, title: str, field_: str, description: str, file_name: str, file_data: BlobSource | None,
+                    file_mime: str = ""):
+    staged = blob_stage(file_data, file_mime or guess_mime(file_name))
+    def write():
+        with db_tx() as conn:
+            sha, size = blob_put(conn, staged)
+            conn.execute("""
+            INSERT INTO topics(id,title,field,description,file_name,file_mime,file_sha256,file_size,created_ts)
+            VALUES(?,?,?,?,?,?,?,?,?)
+            """, (id_, title, field_, description, file_name, staged.mime if staged else "", sha, size, time.time()))
+        catalog_bump("topics")
+    blob_write(staged, write)
+
+@cached_query("topics")
 def db_topics_all():
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,title,field,description,file_name,file_bytes,created_ts
-    FROM topics ORDER BY created_ts DESC
-    """).fetchall()
-    conn.close()
-    return rows
-
-def db_research_insert(id_: str, title: str, field_: str, summary: str, file_name: str, file_bytes: bytes | None):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO research(id,title,field,summary,file_name,file_bytes,created_ts)
-    VALUES(?,?,?,?,?,?,?)
-    """, (id_, title, field_, summary, file_name, file_bytes, time.time()))
-    conn.commit()
-    conn.close()
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,title,field,description,file_name,file_sha256,created_ts
+        FROM topics ORDER BY created_ts DESC
+        """).fetchall()
 
+def db_research_insert(id_: str, title: str, field_: str, summary: str, file_name: str, file_data: BlobSource | None,
+                       file_mime: str = ""):
+    staged = blob_stage(file_data, file_mime or guess_mime(file_name))
+    def write():
+        with db_tx() as conn:
+            sha, size = blob_put(conn, staged)
+            conn.execute("""
+            INSERT INTO research(id,title,field,summary,file_name,file_mime,file_sha256,file_size,created_ts)
+            VALUES(?,?,?,?,?,?,?,?,?)
+            """, (id_, title, field_, summary, file_name, staged.mime if staged else "", sha, size, time.time()))
+        catalog_bump("research")
+    blob_write(staged, write)
+
+@cached_query("research")
 def db_research_all():
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,title,field,summary,file_name,file_bytes,created_ts
-    FROM research ORDER BY created_ts DESC
-    """).fetchall()
-    conn.close()
-    return rows
-
-def db_doc_insert(id_: str, title: str, file_name: str, file_bytes: bytes):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO documents(id,title,file_name,file_bytes,created_ts)
-    VALUES(?,?,?,?,?)
-    """, (id_, title, file_name, file_bytes, time.time()))
-    conn.commit()
-    conn.close()
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,title,field,summary,file_name,file_sha256,created_ts
+        FROM research ORDER BY created_ts DESC
+        """).fetchall()
 
+def db_doc_insert(id_: str, title: str, file_name: str, file_data: BlobSource, file_mime: str = ""):
+    staged = blob_stage(file_data, file_mime or guess_mime(file_name))
+    def write():
+        with db_tx() as conn:
+            sha, size = blob_put(conn, staged)
+            conn.execute("""
+            INSERT INTO documents(id,title,file_name,file_bytes,file_mime,file_sha256,file_size,created_ts)
+            VALUES(?,?,?,X'',?,?,?,?)
+            """, (id_, title, file_name, staged.mime if staged else "", sha, size, time.time()))
+        catalog_bump("documents")
+    blob_write(staged, write)
+
+@cached_query("documents")
 def db_docs_all():
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,title,file_name,file_bytes,created_ts
-    FROM documents ORDER BY created_ts DESC
-    """).fetchall()
-    conn.close()
-    return rows
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,title,file_name,file_sha256,created_ts
+        FROM documents ORDER BY created_ts DESC
+        """).fetchall()
 
 def db_submission_insert(
     id_: str, title: str, description: str, sender_phone: str, sender_name: str, sender_nid: str,
-    suggested_topic_id: str, field_: str, content_type: str, file_name: str, file_mime: str, file_bytes: bytes | None
+    suggested_topic_id: str, field_: str, content_type: str, file_name: str, file_mime: str, file_data: BlobSource | None
 ):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO submissions(
-        id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
-        file_name,file_mime,file_bytes,status,likes,views,knowledge_code,created_ts
-    )
-    VALUES(?,?,?,?,?,?,?,?,?,?,?,?, 'pending',0,0,'', ?)
-    """, (id_, title, description, sender_phone, sender_name, sender_nid, suggested_topic_id,
-          field_, content_type, file_name, file_mime, file_bytes, time.time()))
-    conn.commit()
-    conn.close()
+    staged = blob_stage(file_data, file_mime)
+    def write():
+        with db_tx() as conn:
+            sha, size = blob_put(conn, staged)
+            conn.execute("""
+            INSERT INTO submissions(
+                id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
+                file_name,file_mime,file_sha256,file_size,status,likes,views,knowledge_code,created_ts
+            )
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?, 'pending',0,0,'', ?)
+            """, (id_, title, description, sender_phone, sender_name, sender_nid, suggested_topic_id,
+                  field_, content_type, file_name, file_mime, sha, size, time.time()))
+        catalog_bump("submissions")
+    blob_write(staged, write)
 
 def db_submission_update_content(sub_id: str, title: str, description: str, field_: str, content_type: str,
-                                file_name: str, file_mime: str, file_bytes: bytes | None):
-    conn = db_conn()
-    conn.execute("""
-    UPDATE submissions
-    SET title=?, description=?, field=?, content_type=?, file_name=?, file_mime=?, file_bytes=?, status='pending', knowledge_code=''
-    WHERE id=?
-    """, (title, description, field_, content_type, file_name, file_mime, file_bytes, sub_id))
-    conn.commit()
-    conn.close()
+                                file_name: str, file_mime: str, file_data: BlobSource | None):
+    """file_data=None یعنی پیوست قبلی حفظ شود"""
+    staged = blob_stage(file_data, file_mime)
+    def write():
+        with db_tx() as conn:
+            conn.execute("""
+            UPDATE submissions
+            SET title=?, description=?, field=?, content_type=?, status='pending', knowledge_code=''
+            WHERE id=?
+            """, (title, description, field_, content_type, sub_id))
+            if staged:
+                sha, size = blob_put(conn, staged)
+                conn.execute("""
+                UPDATE submissions SET file_name=?, file_mime=?, file_sha256=?, file_size=?, file_bytes=NULL
+                WHERE id=?
+                """, (file_name, file_mime, sha, size, sub_id))
+                blob_store().gc(conn)
+        catalog_bump("submissions")
+    blob_write(staged, write)
 
 def db_submissions_by_sender(phone: str):
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
-           file_name,file_mime,file_bytes,status,likes,views,knowledge_code,created_ts
-    FROM submissions
-    WHERE sender_phone=?
-    ORDER BY created_ts DESC
-    """, (phone,)).fetchall()
-    conn.close()
-    return rows
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
+               file_name,file_mime,file_sha256,status,likes,views,knowledge_code,created_ts
+        FROM submissions
+        WHERE sender_phone=?
+        ORDER BY created_ts DESC
+        """, (phone,)).fetchall()
 
+# likes/views نتایج cache‌شده ویترین ممکن است قدیمی باشند: لایک و بازدید نسل submissions را بالا
+# نمی‌برند (وگرنه هر لایک همه صفحه‌های cache‌شده را باطل می‌کرد)؛ نمایش با db_submission_counters
+@cached_query("submissions")
 def db_submissions_published():
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
-           file_name,file_mime,file_bytes,status,likes,views,knowledge_code,created_ts
-    FROM submissions
-    WHERE status='published'
-    ORDER BY created_ts DESC
-    """).fetchall()
-    conn.close()
-    return rows
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
+               file_name,file_mime,file_sha256,status,likes,views,knowledge_code,created_ts
+        FROM submissions
+        WHERE status='published'
+        ORDER BY created_ts DESC
+        """).fetchall()
+
+@cached_query("submissions")
+def db_submissions_published_page(limit: int, before: Optional[Tuple[float, str]] = None):
+    """یک صفحه از ویترین با pagination از نوع keyset روی (created_ts, id)؛
+    before کلید آخرین ردیف صفحه قبل است"""
+    with db_conn() as conn:
+        if before is None:
+            return conn.execute("""
+            SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
+                   file_name,file_mime,file_sha256,status,likes,views,knowledge_code,created_ts
+            FROM submissions
+            WHERE status='published'
+            ORDER BY created_ts DESC, id DESC
+            LIMIT ?
+            """, (limit,)).fetchall()
+        return conn.execute("""
+        SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
+               file_name,file_mime,file_sha256,status,likes,views,knowledge_code,created_ts
+        FROM submissions
+        WHERE status='published' AND (created_ts, id) < (?, ?)
+        ORDER BY created_ts DESC, id DESC
+        LIMIT ?
+        """, (before[0], before[1], limit)).fetchall()
 
 def db_submissions_pending_or_waiting_manager():
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
-           file_name,file_mime,file_bytes,status,likes,views,knowledge_code,created_ts
-    FROM submissions
-    WHERE status IN ('pending','waiting_manager','waiting_referee','correction_needed')
-    ORDER BY created_ts DESC
-    """).fetchall()
-    conn.close()
-    return rows
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,title,description,sender_phone,sender_name,sender_nid,suggested_topic_id,field,content_type,
+               file_name,file_mime,file_sha256,status,likes,views,knowledge_code,created_ts
+        FROM submissions
+        WHERE status IN ('pending','waiting_manager','waiting_referee','correction_needed')
+        ORDER BY created_ts DESC
+        """).fetchall()
 
+def db_submission_counters(sub_ids: List[str]) -> dict:
+    """likes/views تازه چند محتوا (بدون cache)؛ {submission_id: (likes, views)}"""
+    if not sub_ids:
+        return {}
+    with db_conn() as conn:
+        return {
+            sid: (likes, views)
+            for (sid, likes, views) in conn.execute(
+                "SELECT id, likes, views FROM submissions WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(sub_ids)),),
+            )
+        }
+
+@cached_query("submissions")
+def db_submission_stats():
+    """شمارش محتواها به تفکیک (حوزه، وضعیت، نوع) از جدول rollup؛ هزینه مستقل از تعداد محتواها"""
+    with db_conn() as conn:
+        return conn.execute("SELECT field, status, content_type, n FROM submission_stats").fetchall()
+
+@write_op
 def db_submission_set_status(sub_id: str, status: str):
-    conn = db_conn()
-    conn.execute("UPDATE submissions SET status=? WHERE id=?", (status, sub_id))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("UPDATE submissions SET status=? WHERE id=?", (status, sub_id))
+    catalog_bump("submissions")
 
+@write_op
 def db_submission_publish(sub_id: str, knowledge_code: str):
-    conn = db_conn()
-    conn.execute("UPDATE submissions SET status='published', knowledge_code=? WHERE id=?", (knowledge_code, sub_id))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("UPDATE submissions SET status='published', knowledge_code=? WHERE id=?", (knowledge_code, sub_id))
+    catalog_bump("submissions")
 
+@write_op
 def db_submission_delete(sub_id: str):
-    conn = db_conn()
-    conn.execute("DELETE FROM submissions WHERE id=?", (sub_id,))
-    conn.commit()
-    conn.close()
-
-def db_submission_inc_view(sub_id: str):
-    conn = db_conn()
-    conn.execute("UPDATE submissions SET views = views + 1 WHERE id=?", (sub_id,))
-    conn.commit()
-    conn.close()
-
+    with db_tx() as conn:
+        conn.execute("DELETE FROM submissions WHERE id=?", (sub_id,))
+        blob_store().gc(conn)
+    catalog_bump("submissions")
+
+@write_op
+def db_submissions_add_views(deltas: dict):
+    """افزودن چند بازدید به چند محتوا در یک تراکنش؛ {submission_id: تعداد}"""
+    with db_tx() as conn:
+        conn.executemany(
+            "UPDATE submissions SET views = views + ? WHERE id=?",
+            [(n, sid) for sid, n in deltas.items()],
+        )
+
+@write_op
 def db_like_toggle(sub_id: str, user_phone: str) -> Tuple[bool, int]:
-    conn = db_conn()
-    cur = conn.cursor()
-    existing = cur.execute("SELECT 1 FROM submission_likes WHERE submission_id=? AND user_phone=?", (sub_id, user_phone)).fetchone()
-    if existing:
-        cur.execute("DELETE FROM submission_likes WHERE submission_id=? AND user_phone=?", (sub_id, user_phone))
-    else:
-        cur.execute("INSERT INTO submission_likes(submission_id,user_phone,created_ts) VALUES(?,?,?)", (sub_id, user_phone, time.time()))
-    cnt = cur.execute("SELECT COUNT(*) FROM submission_likes WHERE submission_id=?", (sub_id,)).fetchone()[0]
-    cur.execute("UPDATE submissions SET likes=? WHERE id=?", (cnt, sub_id))
-    conn.commit()
-    conn.close()
-    return (not bool(existing), cnt)
-
+    """لایک یا برداشتن لایک؛ submissions.likes با trigger یکی کم/زیاد می‌شود"""
+    with db_tx() as conn:
+        removed = conn.execute(
+            "DELETE FROM submission_likes WHERE submission_id=? AND user_phone=? RETURNING 1",
+            (sub_id, user_phone),
+        ).fetchall()
+        if not removed:
+            conn.execute("""
+            INSERT INTO submission_likes(submission_id,user_phone,created_ts) VALUES(?,?,?)
+            ON CONFLICT(submission_id,user_phone) DO NOTHING
+            """, (sub_id, user_phone, time.time()))
+        row = conn.execute("SELECT likes FROM submissions WHERE id=?", (sub_id,)).fetchone()
+    return (not removed, row[0] if row else 0)
+
+@write_op
+def db_likes_reconcile() -> int:
+    """اصلاح اختلاف submissions.likes با تعداد واقعی submission_likes؛ تعداد ردیف‌های اصلاح‌شده"""
+    with db_tx() as conn:
+        fixed = conn.execute("""
+        UPDATE submissions
+        SET likes = (SELECT COUNT(*) FROM submission_likes l WHERE l.submission_id = submissions.id)
+        WHERE likes != (SELECT COUNT(*) FROM submission_likes l WHERE l.submission_id = submissions.id)
+        """).rowcount
+    return fixed
+
+@write_op
 def db_comment_add(comment_id: str, sub_id: str, user_name: str, text: str):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO submission_comments(id,submission_id,user_name,text,created_ts)
-    VALUES(?,?,?,?,?)
-    """, (comment_id, sub_id, user_name, text, time.time()))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        INSERT INTO submission_comments(id,submission_id,user_name,text,created_ts)
+        VALUES(?,?,?,?,?)
+        """, (comment_id, sub_id, user_name, text, time.time()))
 
 def db_comments_for(sub_id: str):
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,user_name,text,created_ts
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,user_name,text,created_ts
+        FROM submission_comments
+        WHERE submission_id=?
+        ORDER BY created_ts ASC
+        """, (sub_id,)).fetchall()
+
+def db_comments_for_many(sub_ids: List[str]) -> dict:
+    """نظرات یک صفحه از محتواها در یک کوئری؛ {submission_id: [ردیف مثل db_comments_for]}"""
+    return _db_children("""
+    SELECT submission_id, id,user_name,text,created_ts
     FROM submission_comments
-    WHERE submission_id=?
-    ORDER BY created_ts ASC
-    """, (sub_id,)).fetchall()
-    conn.close()
-    return rows
+    WHERE submission_id IN (SELECT value FROM json_each(?))
+    ORDER BY submission_id, created_ts ASC
+    """, sub_ids)
 
+@write_op
 def db_comment_delete(comment_id: str):
-    conn = db_conn()
-    conn.execute("DELETE FROM submission_comments WHERE id=?", (comment_id,))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("DELETE FROM submission_comments WHERE id=?", (comment_id,))
 
 # ---- Assignments / Reviews ----
+@write_op
 def db_assignment_create(assign_id: str, sub_id: str, ref_phone: str, ref_name: str, ref_field: str):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO submission_assignments(id,submission_id,referee_phone,referee_name,referee_field,decision,feedback,score,suggested_knowledge_code,reviewed_ts,created_ts)
-    VALUES(?,?,?,?,?,'waiting_referee','',0,'',NULL,?)
-    """, (assign_id, sub_id, ref_phone, ref_name, ref_field, time.time()))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        INSERT INTO submission_assignments(id,submission_id,referee_phone,referee_name,referee_field,decision,feedback,score,suggested_knowledge_code,reviewed_ts,created_ts)
+        VALUES(?,?,?,?,?,'waiting_referee','',0,'',NULL,?)
+        ON CONFLICT DO NOTHING
+        """, (assign_id, sub_id, ref_phone, ref_name, ref_field, time.time()))
+
+@write_op
+def db_assign_many(assignments: List[Tuple[str, str, str, str]],
+                   from_status: Tuple[str, ...] = ("pending", "waiting_referee")) -> int:
+    """ارجاع گروهی در یک تراکنش: (submission_id, referee_phone, referee_name, referee_field)
+
+    برنامه ارجاع از روی داده‌ای ساخته می‌شود که قبل از تراکنش خوانده شده؛ پس داخل تراکنش فقط
+    محتواهایی ارجاع می‌شوند که هنوز یکی از from_status را دارند و ارجاع باز تکراری (همان داور،
+    همان محتوا) نادیده گرفته می‌شود. خروجی: تعداد ارجاع‌های ثبت‌شده.
+    """
+    if not assignments:
+        return 0
+    now = time.time()
+    with db_tx() as conn:
+        open_ids = {
+            sid for sid in dict.fromkeys(a[0] for a in assignments)
+            if conn.execute(
+                "UPDATE submissions SET status='waiting_referee' WHERE id=? AND status IN (SELECT value FROM json_each(?))",
+                (sid, json.dumps(from_status)),
+            ).rowcount
+        }
+        inserted = conn.executemany("""
+        INSERT INTO submission_assignments(id,submission_id,referee_phone,referee_name,referee_field,decision,feedback,score,suggested_knowledge_code,reviewed_ts,created_ts)
+        VALUES(?,?,?,?,?,'waiting_referee','',0,'',NULL,?)
+        ON CONFLICT DO NOTHING
+        """, [(make_id("a"), sid, phone, name, field_, now)
+              for (sid, phone, name, field_) in assignments if sid in open_ids]).rowcount
+    if open_ids:
+        catalog_bump("submissions")
+    return inserted
+
+def db_referee_loads(fields: List[str]) -> dict:
+    """داوران فعال چند حوزه با بار فعلی؛ {field: [(phone, first, last, field, open, reviews, latency_s, last_assigned_ts)]}"""
+    return _db_children("""
+    SELECT r.field, r.phone, r.first_name, r.last_name, r.field,
+           COALESCE(l.open_count, 0), COALESCE(l.reviews, 0), l.latency_ewma_s, COALESCE(l.last_assigned_ts, 0)
+    FROM referees r
+    LEFT JOIN referee_load l ON l.referee_phone = r.phone
+    WHERE r.field IN (SELECT value FROM json_each(?)) AND r.is_active=1
+    """, fields)
 
 def db_assignments_for_submission(sub_id: str):
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,submission_id,referee_phone,referee_name,referee_field,decision,feedback,score,suggested_knowledge_code,reviewed_ts,created_ts
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,submission_id,referee_phone,referee_name,referee_field,decision,feedback,score,suggested_knowledge_code,reviewed_ts,created_ts
+        FROM submission_assignments
+        WHERE submission_id=?
+        ORDER BY created_ts ASC
+        """, (sub_id,)).fetchall()
+
+def db_assignments_for_submissions(sub_ids: List[str]) -> dict:
+    """ارجاعات چند محتوا در یک کوئری؛ {submission_id: [ردیف مثل db_assignments_for_submission]}"""
+    return _db_children("""
+    SELECT submission_id, id,submission_id,referee_phone,referee_name,referee_field,decision,feedback,score,suggested_knowledge_code,reviewed_ts,created_ts
     FROM submission_assignments
-    WHERE submission_id=?
-    ORDER BY created_ts ASC
-    """, (sub_id,)).fetchall()
-    conn.close()
-    return rows
-
-def db_assignments_for_referee(ref_phone: str):
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT a.id, a.submission_id, a.referee_phone, a.referee_name, a.referee_field, a.decision, a.feedback, a.score, a.suggested_knowledge_code, a.reviewed_ts, a.created_ts,
-           s.title, s.description, s.sender_name, s.sender_phone, s.field, s.content_type, s.file_name, s.file_mime, s.file_bytes, s.status, s.knowledge_code
-    FROM submission_assignments a
-    JOIN submissions s ON s.id = a.submission_id
-    WHERE a.referee_phone=?
-    ORDER BY a.created_ts DESC
-    """, (ref_phone,)).fetchall()
-    conn.close()
-    return rows
-
+    WHERE submission_id IN (SELECT value FROM json_each(?))
+    ORDER BY submission_id, created_ts ASC
+    """, sub_ids)
+
+def db_referee_tasks_page(ref_phone: str, limit: int, before: Optional[Tuple[float, str]] = None,
+                          decision: Optional[str] = None):
+    """فهرست سبک ارجاعات داور (فقط عنوان و وضعیت)؛ keyset روی (created_ts, id) مثل ویترین
+
+    ردیف: (a.id, a.submission_id, a.decision, a.created_ts, s.title, s.field)
+    """
+    where, params = ["a.referee_phone=?"], [ref_phone]
+    if decision:
+        where.append("a.decision=?")
+        params.append(decision)
+    if before is not None:
+        where.append("(a.created_ts, a.id) < (?, ?)")
+        params.extend(before)
+    with db_conn() as conn:
+        return conn.execute(f"""
+        SELECT a.id, a.submission_id, a.decision, a.created_ts, s.title, s.field
+        FROM submission_assignments a
+        JOIN submissions s ON s.id = a.submission_id
+        WHERE {" AND ".join(where)}
+        ORDER BY a.created_ts DESC, a.id DESC
+        LIMIT ?
+        """, (*params, limit)).fetchall()
+
+def db_referee_task(assign_id: str, ref_phone: str):
+    """جزئیات یک ارجاع (فقط اگر متعلق به همین داور باشد)؛ پیوست فقط با sha256 برگردانده می‌شود"""
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT a.id, a.submission_id, a.referee_phone, a.referee_name, a.referee_field, a.decision, a.feedback, a.score, a.suggested_knowledge_code, a.reviewed_ts, a.created_ts,
+               s.title, s.description, s.sender_name, s.sender_phone, s.field, s.content_type, s.file_name, s.file_mime, s.file_sha256, s.status, s.knowledge_code
+        FROM submission_assignments a
+        JOIN submissions s ON s.id = a.submission_id
+        WHERE a.id=? AND a.referee_phone=?
+        """, (assign_id, ref_phone)).fetchone()
+
+@write_op
 def db_assignment_update(assign_id: str, decision: str, feedback: str, score: int, sugg_code: str):
-    conn = db_conn()
-    conn.execute("""
-    UPDATE submission_assignments
-    SET decision=?, feedback=?, score=?, suggested_knowledge_code=?, reviewed_ts=?
-    WHERE id=?
-    """, (decision, feedback, score, sugg_code, time.time(), assign_id))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        UPDATE submission_assignments
+        SET decision=?, feedback=?, score=?, suggested_knowledge_code=?, reviewed_ts=?
+        WHERE id=?
+        """, (decision, feedback, score, sugg_code, time.time(), assign_id))
 
 # ---- Forum ----
+@write_op
 def db_forum_post_add(id_: str, sender_phone: str, sender_name: str, sender_role: str, text: str):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO forum_posts(id,sender_phone,sender_name,sender_role,text,status,created_ts)
-    VALUES(?,?,?,?,?,'pending',?)
-    """, (id_, sender_phone, sender_name, sender_role, text, time.time()))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        INSERT INTO forum_posts(id,sender_phone,sender_name,sender_role,text,status,created_ts)
+        VALUES(?,?,?,?,?,'pending',?)
+        """, (id_, sender_phone, sender_name, sender_role, text, time.time()))
 
 def db_forum_posts(status: Optional[str] = None):
-    conn = db_conn()
-    if status:
-        rows = conn.execute("""
-        SELECT id,sender_phone,sender_name,sender_role,text,status,created_ts
-        FROM forum_posts
-        WHERE status=?
-        ORDER BY created_ts DESC
-        """, (status,)).fetchall()
-    else:
-        rows = conn.execute("""
-        SELECT id,sender_phone,sender_name,sender_role,text,status,created_ts
-        FROM forum_posts
-        ORDER BY created_ts DESC
-        """).fetchall()
-    conn.close()
-    return rows
-
+    with db_conn() as conn:
+        if status:
+            rows = conn.execute("""
+            SELECT id,sender_phone,sender_name,sender_role,text,status,created_ts
+            FROM forum_posts
+            WHERE status=?
+            ORDER BY created_ts DESC
+            """, (status,)).fetchall()
+        else:
+            rows = conn.execute("""
+            SELECT id,sender_phone,sender_name,sender_role,text,status,created_ts
+            FROM forum_posts
+            ORDER BY created_ts DESC
+            """).fetchall()
+        return rows
+
+@write_op
 def db_forum_set_status(post_id: str, status: str):
-    conn = db_conn()
-    conn.execute("UPDATE forum_posts SET status=? WHERE id=?", (status, post_id))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("UPDATE forum_posts SET status=? WHERE id=?", (status, post_id))
 
+@write_op
 def db_forum_reply_add(id_: str, post_id: str, ref_phone: str, ref_name: str, text: str):
-    conn = db_conn()
-    conn.execute("""
-    INSERT INTO forum_replies(id,post_id,referee_phone,referee_name,text,created_ts)
-    VALUES(?,?,?,?,?,?)
-    """, (id_, post_id, ref_phone, ref_name, text, time.time()))
-    conn.commit()
-    conn.close()
+    with db_tx() as conn:
+        conn.execute("""
+        INSERT INTO forum_replies(id,post_id,referee_phone,referee_name,text,created_ts)
+        VALUES(?,?,?,?,?,?)
+        """, (id_, post_id, ref_phone, ref_name, text, time.time()))
 
 def db_forum_replies(post_id: str):
-    conn = db_conn()
-    rows = conn.execute("""
-    SELECT id,referee_phone,referee_name,text,created_ts
+    with db_conn() as conn:
+        return conn.execute("""
+        SELECT id,referee_phone,referee_name,text,created_ts
+        FROM forum_replies
+        WHERE post_id=?
+        ORDER BY created_ts ASC
+        """, (post_id,)).fetchall()
+
+def db_forum_replies_for_posts(post_ids: List[str]) -> dict:
+    """پاسخ‌های چند پیام در یک کوئری؛ {post_id: [ردیف مثل db_forum_replies]}"""
+    return _db_children("""
+    SELECT post_id, id,referee_phone,referee_name,text,created_ts
     FROM forum_replies
-    WHERE post_id=?
-    ORDER BY created_ts ASC
-    """, (post_id,)).fetchall()
-    conn.close()
-    return rows
+    WHERE post_id IN (SELECT value FROM json_each(?))
+    ORDER BY post_id, created_ts ASC
+    """, post_ids)
+
+# ---- Batched loaders ----
+def _db_children(sql: str, parent_ids: List[str]) -> dict:
+    """یک کوئری برای همه والدها (شناسه‌ها به صورت آرایه JSON)؛ ستون اول کلید والد است"""
+    out = {pid: [] for pid in parent_ids}
+    if not out:
+        return out
+    with db_conn() as conn:
+        for row in conn.execute(sql, (json.dumps(list(out)),)):
+            out[row[0]].append(row[1:])
+    return out
+
+# ---- Search ----
+SEARCH_KINDS = {"submission": "ویترین دانش", "topic": "پیشنهاد موضوعات", "research": "تحقیقات", "forum": "تالار گفتگو"}
+SEARCH_MARK = ("\x02", "\x03")
+
+def fts_query(text: str) -> str:
+    """عبارت کاربر -> کوئری FTS5: همه کلمات (با تطبیق پیشوند)، بدون عملگرهای FTS"""
+    tokens = re.findall(r"\w+", fa_normalize(text or ""))[:8]
+    return " ".join(f'"{t}"*' for t in tokens)
+
+def db_search(text: str, kinds: Optional[List[str]] = None, limit: int = 10, offset: int = 0):
+    """رتبه‌بندی BM25 (وزن عنوان بیشتر از متن)؛ (ردیف‌ها، صفحه بعد دارد؟)
+
+    ردیف: (kind, ref_id, rank, snippet عنوان, snippet متن)؛ بخش‌های منطبق بین SEARCH_MARK هستند.
+    """
+    q = fts_query(text)
+    if not q:
+        return [], False
+    kinds = list(kinds or SEARCH_KINDS)
+    with db_conn() as conn:
+        rows = conn.execute("""
+        SELECT d.kind, d.ref_id, bm25(search_fts, 4.0, 1.0) AS rank,
+               snippet(search_fts, 0, ?, ?, '…', 12),
+               snippet(search_fts, 1, ?, ?, '…', 24)
+        FROM search_fts
+        JOIN search_docs d ON d.doc_id = search_fts.rowid
+        WHERE search_fts MATCH ?
+          AND d.kind IN (SELECT value FROM json_each(?))
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+        """, (*SEARCH_MARK, *SEARCH_MARK, q, json.dumps(kinds), limit + 1, offset)).fetchall()
+    return rows[:limit], len(rows) > limit
+
+# ---- Query plans ----
+def _is_full_scan(detail: str) -> bool:
+    # پیمایش json_each (لیست شناسه‌های ورودی) full scan جدول نیست
+    return detail.startswith("SCAN ") and not detail.startswith("SCAN CONSTANT") and "VIRTUAL TABLE" not in detail
+
+def db_explain_hot_queries() -> List[Tuple[str, str, bool]]:
+    """اجرای کوئری‌های پرتکرار و برگرداندن EXPLAIN QUERY PLAN آنها: (تابع، جزئیات، full scan؟)"""
+    calls = [
+        (db_submissions_published, ()),
+        (db_submissions_published_page, (10, (time.time(), ""))),
+        (db_submissions_by_sender, ("",)),
+        (db_submissions_pending_or_waiting_manager, ()),
+        (db_assignments_for_submission, ("",)),
+        (db_referee_tasks_page, ("", 20)),
+        (db_referee_tasks_page, ("", 20, (time.time(), ""), "waiting_referee")),
+        (db_referee_task, ("", "")),
+        (db_comments_for, ("",)),
+        (db_forum_posts, ("approved",)),
+        (db_forum_replies, ("",)),
+        (db_referees_by_field, ("",)),
+        (db_comments_for_many, (["a", "b"],)),
+        (db_submission_counters, (["a", "b"],)),
+        (db_assignments_for_submissions, (["a", "b"],)),
+        (db_forum_replies_for_posts, (["a", "b"],)),
+        (db_referees_by_fields, (["a", "b"],)),
+        (db_search, ("بتن",)),
+    ]
+    report = []
+    with db_conn() as conn:
+        for fn, args in calls:
+            name = fn.__name__
+            traced: List[str] = []
+            conn.set_trace_callback(traced.append)
+            try:
+                getattr(fn, "__wrapped__", fn)(*args)  # بدون catalog cache
+            finally:
+                conn.set_trace_callback(None)
+            # دستورهای داخلی trigger و FTS5 با «-- » trace می‌شوند و قابل EXPLAIN نیستند؛ FTS5 در اولین
+            # استفاده هر اتصال تنظیماتش را بدون «-- » می‌خواند (با پیشوند 'main'. که کد برنامه ندارد)
+            for sql in (s for s in traced if not s.startswith("--") and "'main'." not in s):
+                for (_id, _parent, _unused, detail) in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall():
+                    report.append((name, detail, _is_full_scan(detail)))
+    return report
+
+def db_assert_no_full_scans():
+    offenders = [f"{name}: {detail}" for (name, detail, full) in db_explain_hot_queries() if full]
+    assert not offenders, "full table scan in hot queries:\n" + "\n".join(offenders)
+
+# =========================================================
+# Referee scheduler (ارجاع خودکار بر اساس بار و سرعت داور)
+# =========================================================
+SCHED_REFEREES_PER_ITEM = int(os.environ.get("NEXA_SCHED_REFEREES_PER_ITEM", "2"))
+# هر SCHED_LATENCY_PER_TASK_S ثانیه میانگین زمان پاسخ، هم‌وزن یک ارجاع باز حساب می‌شود
+SCHED_LATENCY_PER_TASK_S = float(os.environ.get("NEXA_SCHED_LATENCY_PER_TASK_S", str(3 * 86400)))
+# برای داور بدون سابقه
+SCHED_DEFAULT_LATENCY_S = float(os.environ.get("NEXA_SCHED_DEFAULT_LATENCY_S", str(2 * 86400)))
+
+class RefereeLoad(NamedTuple):
+    phone: str
+    first_name: str
+    last_name: str
+    field: str
+    open_count: int
+    reviews: int
+    latency_s: Optional[float]
+    last_assigned_ts: float
+
+    @property
+    def name(self) -> str:
+        return f"{self.first_name} {self.last_name}"
+
+    @property
+    def score(self) -> float:
+        latency = self.latency_s if self.latency_s is not None else SCHED_DEFAULT_LATENCY_S
+        return self.open_count + latency / SCHED_LATENCY_PER_TASK_S
+
+    def label(self) -> str:
+        lat = f"{self.latency_s / 86400:.1f} روز" if self.latency_s is not None else "بدون سابقه"
+        return f"{self.name} ({self.field}) | باز: {self.open_count} | پاسخ: {lat}"
+
+def referee_loads(fields: List[str]) -> dict:
+    return {f: [RefereeLoad(*r) for r in rows] for f, rows in db_referee_loads(fields).items()}
+
+def propose_referees(loads: List[RefereeLoad], n: int, exclude: Iterable[str] = ()) -> List[RefereeLoad]:
+    """n داور با کمترین بار و سریع‌ترین پاسخ؛ در تساوی، کسی که دیرتر ارجاع گرفته"""
+    exclude = set(exclude)
+    ranked = sorted((r for r in loads if r.phone not in exclude), key=lambda r: (r.score, r.last_assigned_ts, r.phone))
+    return ranked[:n]
+
+def plan_auto_assign(items: List[Tuple[str, str]], n: int, assigned: dict) -> Tuple[List[Tuple[str, str, str, str]], List[str]]:
+    """برنامه ارجاع برای چند محتوا: items=[(submission_id, field)], assigned={sid: [phone, ...]}
+
+    بار داورها بعد از هر انتخاب در حافظه به‌روز می‌شود تا صف به طور متوازن پخش شود.
+    خروجی: (ردیف‌های db_assign_many، محتواهایی که داور آزاد نداشتند)
+    """
+    loads = referee_loads(sorted({f for (_sid, f) in items}))
+    plan, skipped = [], []
+    now = time.time()
+    for sid, field_ in items:
+        picked = propose_referees(loads.get(field_, []), n, assigned.get(sid, ()))
+        if not picked:
+            skipped.append(sid)
+            continue
+        for r in picked:
+            plan.append((sid, r.phone, r.name, r.field))
+        chosen = {r.phone for r in picked}
+        loads[field_] = [r._replace(open_count=r.open_count + 1, last_assigned_ts=now) if r.phone in chosen else r
+                         for r in loads[field_]]
+    return plan, skipped
+
+def auto_assign_pending(n: int = SCHED_REFEREES_PER_ITEM) -> Tuple[int, List[str]]:
+    """ارجاع خودکار همه محتواهای «در انتظار بررسی» در یک تراکنش؛ (تعداد ارجاع، محتواهای بدون داور)"""
+    pending = [(r[0], r[7]) for r in db_submissions_pending_or_waiting_manager() if r[12] == "pending"]
+    assigned = {sid: [a[2] for a in rows] for sid, rows in db_assignments_for_submissions([p[0] for p in pending]).items()}
+    plan, skipped = plan_auto_assign(pending, n, assigned)
+    # محتوایی که در این فاصله مدیر دیگری ارجاع داده دیگر pending نیست و رد می‌شود
+    return db_assign_many(plan, ("pending",)), skipped
+
+# =========================================================
+# Background jobs + buffered view counter
+# =========================================================
+class PeriodicJob:
+    """اجرای یک تابع در thread پس‌زمینه با فاصله ثابت"""
+
+    def __init__(self, name: str, interval_s: float, fn: Callable[[], object]):
+        self.name = name
+        self.interval_s = interval_s
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.fn()
+            except Exception:
+                log.exception("periodic job %s failed", self.name)
+
+    def start(self) -> "PeriodicJob":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+VIEW_FLUSH_INTERVAL_S = float(os.environ.get("NEXA_VIEW_FLUSH_INTERVAL_S", "10"))
+VIEW_FLUSH_MAX_PENDING = int(os.environ.get("NEXA_VIEW_FLUSH_MAX_PENDING", "500"))
+VIEW_DEDUPE_WINDOW_S = float(os.environ.get("NEXA_VIEW_DEDUPE_WINDOW_S", str(30 * 60)))
+
+class ViewCounter:
+    """بازدیدها در حافظه جمع می‌شوند و با فاصله زمانی یا رسیدن به سقف، یکجا نوشته می‌شوند.
+
+    هر session یک محتوا را در هر VIEW_DEDUPE_WINDOW_S فقط یک بار می‌شمارد.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: dict = {}
+        self._inflight: dict = {}
+        self._seen: dict = {}
+        self._last_flush = time.time()
+
+    def record(self, session_key: str, sub_id: str):
+        now = time.time()
+        with self._lock:
+            seen_ts = self._seen.get((session_key, sub_id))
+            if seen_ts is not None and now - seen_ts < VIEW_DEDUPE_WINDOW_S:
+                return
+            self._seen[(session_key, sub_id)] = now
+            self._pending[sub_id] = self._pending.get(sub_id, 0) + 1
+            due = (len(self._pending) >= VIEW_FLUSH_MAX_PENDING
+                   or now - self._last_flush >= VIEW_FLUSH_INTERVAL_S)
+        if due:
+            self.flush()
+
+    def pending(self, sub_id: str) -> int:
+        """بازدیدهای ثبت‌شده‌ای که هنوز در DB نیستند"""
+        with self._lock:
+            return self._pending.get(sub_id, 0) + self._inflight.get(sub_id, 0)
+
+    def flush(self) -> int:
+        with self._lock:
+            if self._inflight or not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            self._last_flush = now = time.time()
+            self._seen = {k: ts for k, ts in self._seen.items() if now - ts < VIEW_DEDUPE_WINDOW_S}
+        try:
+            db_submissions_add_views(batch)
+        except Exception:
+            with self._lock:
+                for sid, n in batch.items():
+                    self._pending[sid] = self._pending.get(sid, 0) + n
+            raise
+        finally:
+            with self._lock:
+                self._inflight = {}
+        return len(batch)
+
+@st.cache_resource
+def view_counter() -> ViewCounter:
+    counter = ViewCounter()
+    PeriodicJob("nexa-view-flush", VIEW_FLUSH_INTERVAL_S, counter.flush).start()
+    atexit.register(counter.flush)
+    return counter
+
+def record_view(sub_id: str):
+    view_counter().record(st.session_state._view_session, sub_id)
+
+LIKES_RECONCILE_INTERVAL_S = float(os.environ.get("NEXA_LIKES_RECONCILE_INTERVAL_S", "3600"))
+
+@st.cache_resource
+def likes_reconciler() -> PeriodicJob:
+    return PeriodicJob("nexa-likes-reconcile", LIKES_RECONCILE_INTERVAL_S, db_likes_reconcile).start()
+
+# =========================================================
+# Excel exports (openpyxl write-only)
+# =========================================================
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FETCH_SIZE = 1000
+
+class ExportSpec(NamedTuple):
+    label: str
+    headers: List[str]
+    sql: str
+    ts_columns: Tuple[int, ...] = ()
+
+EXPORTS = {
+    "users": ExportSpec(
+        "کاربران",
+        ["phone", "name", "nid", "password", "created_ts"],
+        "SELECT phone,name,nid,password,created_ts FROM users ORDER BY created_ts DESC",
+        (4,),
+    ),
+    "referees": ExportSpec(
+        "داوران",
+        ["first_name", "last_name", "phone", "nid", "field", "password", "is_active", "created_ts"],
+        "SELECT first_name,last_name,phone,nid,field,password,is_active,created_ts FROM referees ORDER BY created_ts DESC",
+        (7,),
+    ),
+    "submissions": ExportSpec(
+        "محتواها",
+        ["id", "title", "sender_name", "sender_phone", "field", "content_type", "status",
+         "likes", "views", "knowledge_code", "file_name", "file_size", "created_ts"],
+        """
+        SELECT id,title,sender_name,sender_phone,field,content_type,status,
+               likes,views,knowledge_code,file_name,file_size,created_ts
+        FROM submissions ORDER BY created_ts DESC
+        """,
+        (12,),
+    ),
+    "assignments": ExportSpec(
+        "ارجاع‌ها",
+        ["id", "submission_id", "submission_title", "referee_phone", "referee_name", "referee_field",
+         "decision", "score", "suggested_knowledge_code", "feedback", "created_ts", "reviewed_ts"],
+        """
+        SELECT a.id,a.submission_id,s.title,a.referee_phone,a.referee_name,a.referee_field,
+               a.decision,a.score,a.suggested_knowledge_code,a.feedback,a.created_ts,a.reviewed_ts
+        FROM submission_assignments a
+        LEFT JOIN submissions s ON s.id = a.submission_id
+        ORDER BY a.created_ts DESC
+        """,
+        (10, 11),
+    ),
+    "review_scores": ExportSpec(
+        "امتیازهای داوری",
+        ["submission_id", "title", "field", "status", "assigned", "reviewed",
+         "avg_score", "min_score", "max_score", "recommend_publish", "correction_needed", "rejected"],
+        """
+        SELECT s.id, s.title, s.field, s.status,
+               COUNT(*),
+               COUNT(a.reviewed_ts),
+               ROUND(AVG(CASE WHEN a.reviewed_ts IS NOT NULL THEN a.score END), 2),
+               MIN(CASE WHEN a.reviewed_ts IS NOT NULL THEN a.score END),
+               MAX(CASE WHEN a.reviewed_ts IS NOT NULL THEN a.score END),
+               SUM(a.decision = 'recommend_publish'),
+               SUM(a.decision = 'correction_needed'),
+               SUM(a.decision = 'rejected')
+        FROM submission_assignments a
+        JOIN submissions s ON s.id = a.submission_id
+        GROUP BY s.id
+        ORDER BY s.created_ts DESC
+        """,
+    ),
+}
+
+def export_xlsx(name: str) -> str:
+    """ساخت فایل اکسل در یک فایل موقت؛ ردیف‌ها از cursor به صورت دسته‌ای خوانده و مستقیم نوشته می‌شوند"""
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    spec = EXPORTS[name]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(name)
+    ws.append(spec.headers)
+
+    with db_conn() as conn:
+        cur = conn.execute(spec.sql)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                ws.append([
+                    (ts_str(v) if v is not None else None) if i in spec.ts_columns
+                    else ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str)
+                    else v
+                    for i, v in enumerate(row)
+                ])
+
+    fd, path = tempfile.mkstemp(prefix=f"nexa-{name}-", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb.save(path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def export_read(name: str) -> bytes:
+    """محتوای فایل اکسل برای دانلود؛ فایل موقت بسته و حذف می‌شود
+
+    streamlit داده دانلود را به هر حال کامل در حافظه نگه می‌دارد و handle باز را نمی‌بندد.
+    """
+    path = export_xlsx(name)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def export_button(label: str, name: str, key: Optional[str] = None):
+    """دکمه دانلود اکسل؛ فایل فقط هنگام کلیک ساخته می‌شود، نه در هر rerun"""
+    st.download_button(label, data=functools.partial(export_read, name), file_name=f"{name}.xlsx",
+                       mime=XLSX_MIME, key=key or f"export_{name}")
+
+# =========================================================
+# Excel import (openpyxl read-only)
+# =========================================================
+IMPORT_BATCH_SIZE = 500
+_ASCII_DIGITS = str.maketrans({**{chr(0x06F0 + i): str(i) for i in range(10)},
+                               **{chr(0x0660 + i): str(i) for i in range(10)}})
+
+class ImportSpec(NamedTuple):
+    label: str
+    columns: List[str]                   # ترتیب ستون‌ها در ردیف نهایی
+    required: Tuple[str, ...]
+    aliases: dict                        # عنوان فارسی ستون -> نام ستون
+    upsert: Callable
+
+IMPORTS = {
+    "users": ImportSpec(
+        "کاربران",
+        ["phone", "name", "nid", "password"],
+        ("phone", "name", "nid", "password"),
+        {"شماره همراه": "phone", "نام": "name", "کد ملی": "nid", "رمز عبور": "password"},
+        db_users_upsert_many,
+    ),
+    "referees": ImportSpec(
+        "داوران",
+        ["phone", "first_name", "last_name", "nid", "field", "password", "is_active"],
+        ("phone", "first_name", "last_name", "nid", "field", "password"),
+        {"شماره همراه": "phone", "نام": "first_name", "نام خانوادگی": "last_name", "کد ملی": "nid",
+         "حوزه": "field", "رمز عبور": "password", "فعال": "is_active"},
+        db_referees_upsert_many,
+    ),
+}
+
+class ImportReport(NamedTuple):
+    rows_read: int
+    imported: int
+    errors: List[Tuple[int, str]]        # (شماره سطر در اکسل، پیام)
+    seconds: float
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.rows_read / self.seconds if self.seconds > 0 else 0.0
+
+def _cell_str(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
+def _import_phone(v) -> str:
+    p = normalize_phone(_cell_str(v).translate(_ASCII_DIGITS))
+    # اکسل صفر ابتدای شماره‌هایی را که عدد ذخیره شده‌اند حذف می‌کند
+    if re.fullmatch(r"9\d{9}", p):
+        p = "0" + p
+    return p
+
+def _import_field(v) -> Optional[str]:
+    f = _cell_str(v)
+    if f in FIELDS:
+        return f
+    # شماره حوزه (مثلاً 6 یا ۶) یا نام بدون شماره
+    num = f.translate(_ASCII_DIGITS).rstrip(".")
+    for field_ in FIELDS:
+        idx, _, name = field_.partition(". ")
+        if num == idx.translate(_ASCII_DIGITS) or f == name:
+            return field_
+    return None
+
+def _import_active(v) -> Optional[int]:
+    a = _cell_str(v).lower()
+    if a in ("", "1", "true", "yes", "بله", "فعال"):
+        return 1
+    if a in ("0", "false", "no", "خیر", "غیرفعال"):
+        return 0
+    return None
+
+def _import_row(kind: str, rec: dict) -> Tuple[Optional[tuple], Optional[str]]:
+    """اعتبارسنجی و یکسان‌سازی یک ردیف؛ (ردیف آماده درج، پیام خطا)"""
+    spec = IMPORTS[kind]
+    missing = [c for c in spec.required if not _cell_str(rec.get(c))]
+    if missing:
+        return None, "ستون‌های خالی: " + ", ".join(missing)
+
+    out = {c: _cell_str(rec.get(c)) for c in spec.columns}
+    out["phone"] = _import_phone(rec.get("phone"))
+    if not re.fullmatch(r"0\d{10}", out["phone"]):
+        return None, f"شماره همراه نامعتبر: {out['phone']}"
+    nid = normalize_nid(out["nid"].translate(_ASCII_DIGITS))
+    # Excel صفرهای ابتدای کد ملی عددی را حذف می‌کند؛ فقط همین حالت (۸ یا ۹ رقم) تکمیل می‌شود
+    if re.fullmatch(r"\d{8,9}", nid):
+        nid = nid.zfill(10)
+    if not re.fullmatch(r"\d{10}", nid):
+        return None, f"کد ملی نامعتبر: {nid}"
+    out["nid"] = nid
+
+    if kind == "referees":
+        out["field"] = _import_field(rec.get("field"))
+        if out["field"] is None:
+            return None, f"حوزه نامعتبر: {_cell_str(rec.get('field'))}"
+        out["is_active"] = _import_active(rec.get("is_active"))
+        if out["is_active"] is None:
+            return None, f"مقدار فعال نامعتبر: {_cell_str(rec.get('is_active'))}"
+    return tuple(out[c] for c in spec.columns), None
+
+def import_xlsx(kind: str, f: BinaryIO) -> ImportReport:
+    """خواندن جریانی فایل (read-only) و درج دسته‌ای؛ سطر اول باید عنوان ستون‌ها باشد"""
+    from openpyxl import load_workbook
+
+    spec = IMPORTS[kind]
+    t0 = time.perf_counter()
+    errors: List[Tuple[int, str]] = []
+    rows_read = imported = 0
+    seen = {}
+    batch = []
+
+    def flush():
+        nonlocal imported
+        if batch:
+            spec.upsert(batch)
+            imported += len(batch)
+            batch.clear()
+
+    wb = load_workbook(f, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return ImportReport(0, 0, [(1, "فایل خالی است")], time.perf_counter() - t0)
+        names = [spec.aliases.get(_cell_str(h), _cell_str(h).lower()) for h in header]
+        absent = [c for c in spec.required if c not in names]
+        if absent:
+            return ImportReport(0, 0, [(1, "ستون‌های لازم در سطر عنوان نیست: " + ", ".join(absent))],
+                                time.perf_counter() - t0)
+
+        for row_num, values in enumerate(rows, start=2):
+            if not any(_cell_str(v) for v in values):
+                continue
+            rows_read += 1
+            row, err = _import_row(kind, dict(zip(names, values)))
+            if err is None and row[0] in seen:
+                err = f"شماره همراه تکراری (سطر {seen[row[0]]})"
+            if err is not None:
+                errors.append((row_num, err))
+                continue
+            seen[row[0]] = row_num
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+    finally:
+        wb.close()
+    return ImportReport(rows_read, imported, errors, time.perf_counter() - t0)
 
 # =========================================================
 # Theme + Fonts (BTir.ttf / BNazanin.ttf)
 # =========================================================
-def inject_theme():
-    btitr_path = pick_existing(["assets/fonts/BTir.ttf", "BTir.ttf"])
-    bnazanin_path = pick_existing(["assets/fonts/BNazanin.ttf", "BNazanin.ttf"])
+THEME_STATIC_DIR = os.path.join("static", "theme")
+THEME_STATIC_URL = "app/static/theme"
+
+class ThemeAssets(NamedTuple):
+    css: str
+    logo_html: str
+
+def _asset_fingerprint(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+def _static_serving_enabled() -> bool:
+    try:
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+def _publish_asset(path: str, static: bool) -> str:
+    """آدرس فایل برای مرورگر: نام hash دار در static/ یا در صورت نبود static serving، data URI"""
+    with open(path, "rb") as f:
+        data = f.read()
+    mime = guess_mime(path) or ("font/ttf" if path.lower().endswith(".ttf") else "application/octet-stream")
+    if not static:
+        return f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    stem, ext = os.path.splitext(os.path.basename(path))
+    name = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+    dst = os.path.join(THEME_STATIC_DIR, name)
+    if not os.path.exists(dst):
+        os.makedirs(THEME_STATIC_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=THEME_STATIC_DIR)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, dst)
+    return f"{THEME_STATIC_URL}/{name}"
+
+def _prune_static_assets(keep: Iterable[str]):
+    keep = {u.rsplit("/", 1)[-1] for u in keep}
+    if not os.path.isdir(THEME_STATIC_DIR):
+        return
+    for name in os.listdir(THEME_STATIC_DIR):
+        if name not in keep:
+            try:
+                os.remove(os.path.join(THEME_STATIC_DIR, name))
+            except OSError:
+                pass
+
+@st.cache_resource(max_entries=4)
+def _build_theme_assets(fingerprints: Tuple[Optional[Tuple[str, int, int]], ...], static: bool) -> ThemeAssets:
+    """یک بار در هر process و برای هر نسخه (mtime/اندازه) فایل‌ها ساخته می‌شود"""
+    btitr_fp, bnazanin_fp, logo_fp = fingerprints
+    urls = {}
 
     btitr_css = ""
     bnazanin_css = ""
 
-    if btitr_path:
-        with open(btitr_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
+    if btitr_fp:
+        urls["btitr"] = _publish_asset(btitr_fp[0], static)
         btitr_css = f"""
         @font-face {{
           font-family: 'BTitr';
-          src: url(data:font/ttf;base64,{b64}) format('truetype');
+          src: url({urls["btitr"]}) format('truetype');
           font-weight: 700;
           font-style: normal;
+          font-display: swap;
         }}
         """
 
-    if bnazanin_path:
-        with open(bnazanin_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
+    if bnazanin_fp:
+        urls["bnazanin"] = _publish_asset(bnazanin_fp[0], static)
         bnazanin_css = f"""
         @font-face {{
           font-family: 'BNazaninBold';
-          src: url(data:font/ttf;base64,{b64}) format('truetype');
+          src: url({urls["bnazanin"]}) format('truetype');
           font-weight: 700;
           font-style: normal;
+          font-display: swap;
         }}
         """
 
-    title_font = "BTitr" if btitr_path else "Tahoma"
-    body_font = "BNazaninBold" if bnazanin_path else "Tahoma"
+    logo_html = ""
+    if logo_fp:
+        urls["logo"] = _publish_asset(logo_fp[0], static)
+        logo_html = f'<img src="{urls["logo"]}" style="width:58px;height:58px;object-fit:contain;" />'
 
-    st.markdown(
-        f"""
+    if static:
+        _prune_static_assets(urls.values())
+
+    title_font = "BTitr" if btitr_fp else "Tahoma"
+    body_font = "BNazaninBold" if bnazanin_fp else "Tahoma"
+
+    css = f"""
         <style>
         {btitr_css}
         {bnazanin_css}
@@ -729,9 +3395,20 @@ def inject_theme():
 
         header[data-testid="stHeader"] {{ background: transparent; }}
         </style>
-        """,
-        unsafe_allow_html=True,
+        """
+    return ThemeAssets(css, logo_html)
+
+def theme_assets() -> ThemeAssets:
+    paths = (
+        pick_existing(["assets/fonts/BTir.ttf", "BTir.ttf"]),
+        pick_existing(["assets/fonts/BNazanin.ttf", "BNazanin.ttf"]),
+        pick_existing(["logo.png", "official_logo.png"]),
     )
+    fingerprints = tuple(_asset_fingerprint(p) if p else None for p in paths)
+    return _build_theme_assets(fingerprints, _static_serving_enabled())
+
+def inject_theme():
+    st.markdown(theme_assets().css, unsafe_allow_html=True)
 
 # =========================================================
 # App State / Navigation
@@ -765,7 +3442,7 @@ CONTENT_TYPES = [
 ]
 
 def ensure_state():
-    st.session_state.setdefault("_id_counter", 5000)
+    st.session_state.setdefault("_view_session", uuid.uuid4().hex)
     st.session_state.setdefault("logged_in", False)
     st.session_state.setdefault("role", "guest")   # user/referee/manager
     st.session_state.setdefault("phone", "")
@@ -805,29 +3482,191 @@ def load_page_from_query():
             p = qp["page"]
             if isinstance(p, list):
                 p = p[0]
-            if p in ["صفحه اصلی", "تالار گفتگو", "پروفایل", "اسناد", "مشاهده محتوا"]:
+            if p in ["صفحه اصلی", "جستجو", "تالار گفتگو", "پروفایل", "اسناد", "مشاهده محتوا"]:
                 st.session_state.page = p
     except Exception:
         pass
 
+# =========================================================
+# Showcase pagination (keyset)
+# =========================================================
+SHOWCASE_PAGE_SIZES = [5, 10, 20, 50]
+
+def showcase_page(key: str):
+    """صفحه فعلی ویترین برای این بخش؛ (ردیف‌ها، صفحه بعد دارد؟)"""
+    cursors_key = f"_{key}_cursors"
+    st.session_state.setdefault(cursors_key, [])
+    size = st.selectbox(
+        "تعداد در هر صفحه",
+        SHOWCASE_PAGE_SIZES,
+        index=1,
+        key=f"{key}_page_size",
+        on_change=lambda: st.session_state.__setitem__(cursors_key, []),
+    )
+    cursors = st.session_state[cursors_key]
+    rows = db_submissions_published_page(size + 1, cursors[-1] if cursors else None)
+    page = rows[:size]
+    # likes/views صفحه cache‌شده ممکن است قدیمی باشد (ستون‌های ۱۳ و ۱۴)
+    counters = db_submission_counters([r[0] for r in page])
+    page = [r[:13] + counters.get(r[0], r[13:15]) + r[15:] for r in page]
+    return page, len(rows) > size
+
+def showcase_pager_nav(key: str, rows, has_more: bool, cursor: Callable = lambda r: (r[16], r[0])):
+    """cursor: کلید keyset یک ردیف، به صورت (created_ts, id)"""
+    cursors = st.session_state[f"_{key}_cursors"]
+    c1, c2 = st.columns(2)
+    if has_more and c1.button("نمایش موارد بیشتر ⬅️", key=f"{key}_next", use_container_width=True):
+        cursors.append(cursor(rows[-1]))
+        rerun_section()
+    if cursors and c2.button("➡️ صفحه قبل", key=f"{key}_prev", use_container_width=True):
+        cursors.pop()
+        rerun_section()
+
+REFEREE_DECISIONS = {
+    "waiting_referee": "در حال بررسی",
+    "correction_needed": "نیاز به اصلاح",
+    "rejected": "عدم تایید",
+    "recommend_publish": "تایید و پیشنهاد انتشار",
+}
+
+def referee_tasks_page(key: str, ref_phone: str):
+    """صفحه فعلی فهرست ارجاعات داور با فیلتر وضعیت؛ (ردیف‌ها، صفحه بعد دارد؟)"""
+    cursors_key = f"_{key}_cursors"
+    st.session_state.setdefault(cursors_key, [])
+    reset = lambda: st.session_state.__setitem__(cursors_key, [])
+    decision = st.selectbox("وضعیت", [None, *REFEREE_DECISIONS], key=f"{key}_decision", on_change=reset,
+                            format_func=lambda x: "همه" if x is None else REFEREE_DECISIONS[x])
+    size = st.selectbox("تعداد در هر صفحه", SHOWCASE_PAGE_SIZES, index=1, key=f"{key}_page_size", on_change=reset)
+    cursors = st.session_state[cursors_key]
+    rows = db_referee_tasks_page(ref_phone, size + 1, cursors[-1] if cursors else None, decision)
+    return rows[:size], len(rows) > size
+
+# =========================================================
+# Panel sections (فقط بخش فعال، داخل st.fragment)
+# =========================================================
+class SectionTiming(NamedTuple):
+    name: str
+    runs: int
+    fragment_runs: int
+    mean_ms: float
+    last_ms: float
+    max_ms: float
+
+class SectionTimer:
+    """آمار زمان اجرای بخش‌های پنل‌ها (مشترک بین sessionها)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict = {}  # name -> [runs, fragment_runs, total_s, last_s, max_s]
+
+    def record(self, name: str, seconds: float, fragment_run: bool):
+        with self._lock:
+            s = self._stats.setdefault(name, [0, 0, 0.0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += fragment_run
+            s[2] += seconds
+            s[3] = seconds
+            s[4] = max(s[4], seconds)
+
+    def snapshot(self) -> List[SectionTiming]:
+        with self._lock:
+            return [SectionTiming(name, runs, frag, total / runs * 1000, last * 1000, mx * 1000)
+                    for name, (runs, frag, total, last, mx) in sorted(self._stats.items())]
+
+@st.cache_resource
+def section_timer() -> SectionTimer:
+    return SectionTimer()
+
+def _fragment_rerun() -> bool:
+    """آیا این اجرا فقط یک fragment است (نه کل صفحه)؟"""
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+def rerun_section():
+    """rerun فقط همین بخش؛ خارج از fragment (یا در اجرای کامل صفحه) کل صفحه rerun می‌شود"""
+    st.rerun(scope="fragment" if _fragment_rerun() else "app")
+
+def profile_page_key() -> str:
+    """کلید صفحه در query profiler"""
+    if not st.session_state.get("logged_in"):
+        return "ورود"
+    return f"{st.session_state.role}/{st.session_state.page}"
+
+def _section_fragment(key: str, label: str, fn: Callable[[], None]):
+    name = f"{key}/{label}"
+
+    def section():
+        t0 = time.perf_counter()
+        fragment_run = _fragment_rerun()
+        # اجرای جزئی از بالای اسکریپت نمی‌گذرد؛ rerun خودش را در profiler ثبت می‌کند
+        rerun = query_profiler().begin(profile_page_key(), label, fragment=True) if fragment_run else None
+        try:
+            fn()
+        finally:
+            section_timer().record(name, time.perf_counter() - t0, fragment_run)
+            query_profiler().finish(rerun)
+    # شناسه fragment از qualname ساخته می‌شود؛ برای هر بخش یکتا باشد
+    section.__qualname__ = section.__name__ = f"section[{name}]"
+    return st.fragment(section)
+
+def render_sections(key: str, sections: dict):
+    """جایگزین st.tabs: st.tabs همه تب‌ها را در هر rerun اجرا می‌کند، این‌جا فقط بخش انتخاب‌شده اجرا می‌شود.
+
+    بخش داخل st.fragment اجرا می‌شود تا تعامل با ویجت‌های آن فقط همان بخش را rerun کند.
+    """
+    labels = list(sections)
+    active = labels[0]
+    if len(labels) > 1:
+        active = st.radio("بخش", labels, horizontal=True, key=f"{key}_section", label_visibility="collapsed")
+    query_profiler().annotate(active)
+    _section_fragment(key, active, sections[active])()
+
+# =========================================================
+# Bootstrap (یک بار در هر پروسه)
+# =========================================================
+class BootstrapReport(NamedTuple):
+    schema_from: int
+    schema_to: int
+    pool_warmed: int
+    seconds: float
+
+@st.cache_resource
+def app_bootstrap() -> BootstrapReport:
+    """schema، migrationها، pool و cacheها؛ یک بار در هر پروسه، نه در هر rerun.
+
+    cache_resource محاسبه را با قفل هر کلید انجام می‌دهد؛ sessionهای هم‌زمان منتظر اولین اجرا می‌مانند.
+    """
+    t0 = time.perf_counter()
+    schema_from = db_schema_version()
+    db_init()
+    warmed = db_pool().warm(DB_POOL_WARM)
+    db_writer()
+    likes_reconciler()
+    view_counter()
+    image_derivatives()
+    media_server()
+    # پرخواننده‌ترین نتایج catalog (صفحه اول ویترین با اندازه پیش‌فرض، موضوعات، تحقیقات)
+    db_submissions_published_page(SHOWCASE_PAGE_SIZES[1] + 1, None)
+    db_topics_all()
+    db_research_all()
+    report = BootstrapReport(schema_from, db_schema_version(), warmed, time.perf_counter() - t0)
+    log.info("bootstrap: %s", report)
+    return report
+
 # =========================================================
 # Streamlit config
 # =========================================================
 st.set_page_config(page_title="NEXA", layout="wide")
-db_init()
+app_bootstrap()
 ensure_state()
 load_page_from_query()
+_rerun_profile = query_profiler().begin(profile_page_key())
 inject_theme()
 
 st.markdown('<div class="nexa-shell">', unsafe_allow_html=True)
 
 # Header
-logo_path = pick_existing(["logo.png", "official_logo.png"])
-logo_html = ""
-if logo_path:
-    with open(logo_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-    logo_html = f'<img src="data:image/png;base64,{b64}" style="width:58px;height:58px;object-fit:contain;" />'
+logo_html = theme_assets().logo_html
 
 h1, h2, h3 = st.columns([1.1, 3.6, 2.0], vertical_alignment="center")
 
@@ -958,19 +3797,21 @@ if not st.session_state.logged_in:
 # =========================================================
 # Bottom Navigation
 # =========================================================
-nav_labels = ["صفحه اصلی", "تالار گفتگو", "پروفایل", "اسناد"]
-nav_icons = {"صفحه اصلی": "🏠", "تالار گفتگو": "💬", "پروفایل": "👤", "اسناد": "📄"}
+nav_labels = ["صفحه اصلی", "جستجو", "تالار گفتگو", "پروفایل", "اسناد"]
+nav_icons = {"صفحه اصلی": "🏠", "جستجو": "🔎", "تالار گفتگو": "💬", "پروفایل": "👤", "اسناد": "📄"}
 nav_display = [f"{nav_icons[x]} {x}" for x in nav_labels]
-current = f"{nav_icons[st.session_state.page]} {st.session_state.page}"
+# صفحه «مشاهده محتوا» در نوار پایین نیست؛ در آن حالت گزینه‌ای انتخاب نشده است
+nav_index = nav_labels.index(st.session_state.page) if st.session_state.page in nav_labels else None
 
 st.markdown('<div class="bottom-nav">', unsafe_allow_html=True)
-choice = st.radio("", nav_display, index=nav_display.index(current), horizontal=True, label_visibility="collapsed")
+choice = st.radio("", nav_display, index=nav_index, horizontal=True, label_visibility="collapsed")
 st.markdown("</div>", unsafe_allow_html=True)
 
-chosen_page = choice.split(" ", 1)[1]
-if chosen_page != st.session_state.page:
-    set_page(chosen_page)
-    st.rerun()
+if choice is not None:
+    chosen_page = choice.split(" ", 1)[1]
+    if chosen_page != st.session_state.page:
+        set_page(chosen_page)
+        st.rerun()
 
 # =========================================================
 # Page: Home
@@ -981,26 +3822,25 @@ if st.session_state.page == "صفحه اصلی":
 
     # ===================== USER =====================
     if role == "user":
-        tabs = st.tabs(["ویترین دانش", "ارسال محتوا", "وضعیت پیگیری", "پیشنهاد موضوعات", "تحقیقات صورت گرفته"])
-
         # ویترین دانش
-        with tabs[0]:
+        def user_showcase():
             st.header("ویترین دانش")
-            published = db_submissions_published()
+            published, has_more = showcase_page("showcase")
             if not published:
                 st.info("فعلاً محتوایی منتشر نشده.")
             else:
+                comments_by_sub = db_comments_for_many([r[0] for r in published])
                 for row in published:
                     (sid,title,desc,s_phone,s_name,s_nid,topic_id,field_,ctype,
-                     fname,fmime,fbytes,status,likes,views,kcode,created_ts) = row
+                     fname,fmime,fsha,status,likes,views,kcode,created_ts) = row
 
                     with st.container(border=True):
-                        db_submission_inc_view(sid)
-                        views += 1
+                        record_view(sid)
+                        views += view_counter().pending(sid)
 
                         # نمایش پیوست بر اساس نوع فایل (عکس/ویدیو/صوت/...)
-                        if fbytes and fmime:
-                            render_media(fbytes, fmime, fname or "")
+                        if fsha and fmime:
+                            render_media(fsha, fmime, fname or "")
 
                         st.subheader(title)
 
@@ -1014,10 +3854,10 @@ if st.session_state.page == "صفحه اصلی":
                         if st.button(f"❤️ لایک ({likes})", key=f"like_{sid}"):
                             _, new_cnt = db_like_toggle(sid, st.session_state.phone)
                             st.success(f"ثبت شد ✅ (لایک‌ها: {new_cnt})")
-                            st.rerun()
+                            rerun_section()
 
                         st.subheader("نظرات")
-                        comments = db_comments_for(sid)
+                        comments = comments_by_sub[sid]
                         if comments:
                             for (cid, uname, ctext, cts) in comments:
                                 st.write(f"- **{uname}**: {ctext}")
@@ -1030,10 +3870,11 @@ if st.session_state.page == "صفحه اصلی":
                             if new_comment.strip():
                                 db_comment_add(make_id("c"), sid, st.session_state.name, new_comment.strip())
                                 st.success("نظر ثبت شد ✅")
-                                st.rerun()
+                                rerun_section()
+            showcase_pager_nav("showcase", published, has_more)
 
         # ارسال محتوا
-        with tabs[1]:
+        def user_submit():
             st.header("ارسال محتوا")
 
             topics = db_topics_all()
@@ -1065,7 +3906,6 @@ if st.session_state.page == "صفحه اصلی":
                     st.error("عنوان الزامی است.")
                 else:
                     fname = uploaded.name if uploaded else "N/A"
-                    fbytes = uploaded.getvalue() if uploaded else None
                     fmime = uploaded.type if uploaded else ""
 
                     db_submission_insert(
@@ -1080,23 +3920,24 @@ if st.session_state.page == "صفحه اصلی":
                         content_type=content_type,
                         file_name=fname,
                         file_mime=fmime,
-                        file_bytes=fbytes
+                        file_data=uploaded
                     )
                     st.success("ارسال شد ✅")
-                    st.rerun()
+                    rerun_section()
 
         # وضعیت پیگیری + ویرایش
-        with tabs[2]:
+        def user_tracking():
             st.header("وضعیت پیگیری")
             my = db_submissions_by_sender(st.session_state.phone)
             if not my:
                 st.info("هنوز محتوایی ارسال نکردی.")
             else:
+                assigns_by_sub = db_assignments_for_submissions([r[0] for r in my])
                 for row in my:
                     (sid,title,desc,s_phone,s_name,s_nid,topic_id,field_,ctype,
-                     fname,fmime,fbytes,status,likes,views,kcode,created_ts) = row
+                     fname,fmime,fsha,status,likes,views,kcode,created_ts) = row
 
-                    assigns = db_assignments_for_submission(sid)
+                    assigns = assigns_by_sub[sid]
 
                     with st.container(border=True):
                         st.write(f"**{title}**")
@@ -1127,69 +3968,77 @@ if st.session_state.page == "صفحه اصلی":
 
                                 if st.button("ارسال مجدد برای مدیر", key=f"resend_{sid}", type="primary"):
                                     nf = new_up.name if new_up else fname
-                                    nfb = new_up.getvalue() if new_up else fbytes
                                     nfm = new_up.type if new_up else (fmime or "")
-                                    db_submission_update_content(sid, new_title.strip(), new_desc.strip(), new_field, new_type, nf, nfm, nfb)
+                                    db_submission_update_content(sid, new_title.strip(), new_desc.strip(), new_field, new_type, nf, nfm, new_up)
                                     st.success("ارسال مجدد انجام شد ✅")
-                                    st.rerun()
+                                    rerun_section()
 
         # پیشنهاد موضوعات
-        with tabs[3]:
+        def user_topics():
             st.header("پیشنهاد موضوعات")
             topics = db_topics_all()
             if not topics:
                 st.info("موضوعی ثبت نشده.")
             else:
                 for t in topics:
-                    (tid, ttitle, tfield, tdesc, tfname, tfbytes, tts) = t
+                    (tid, ttitle, tfield, tdesc, tfname, tfsha, tts) = t
                     with st.container(border=True):
                         st.write(f"**{ttitle}**")
                         st.caption(f"حوزه: {tfield} | تاریخ: {ts_str(tts)}")
                         st.write(tdesc)
-                        if tfbytes:
-                            st.download_button("دانلود پیوست", data=tfbytes, file_name=tfname or "file", key=f"dl_topic_{tid}")
+                        if tfsha:
+                            blob_download_button("دانلود پیوست", tfsha, tfname or "file", key=f"dl_topic_{tid}")
 
         # تحقیقات
-        with tabs[4]:
+        def user_research():
             st.header("تحقیقات صورت گرفته")
             res = db_research_all()
             if not res:
                 st.info("تحقیقی ثبت نشده.")
             else:
                 for r in res:
-                    (rid, rtitle, rfield, rsum, rfname, rfbytes, rts) = r
+                    (rid, rtitle, rfield, rsum, rfname, rfsha, rts) = r
                     with st.container(border=True):
                         st.write(f"**{rtitle}**")
                         st.caption(f"حوزه: {rfield} | تاریخ: {ts_str(rts)}")
                         st.write(rsum)
-                        if rfbytes:
-                            st.download_button("دانلود فایل", data=rfbytes, file_name=rfname or "file", key=f"dl_res_{rid}")
+                        if rfsha:
+                            blob_download_button("دانلود فایل", rfsha, rfname or "file", key=f"dl_res_{rid}")
+
+        render_sections("user", {
+            "ویترین دانش": user_showcase,
+            "ارسال محتوا": user_submit,
+            "وضعیت پیگیری": user_tracking,
+            "پیشنهاد موضوعات": user_topics,
+            "تحقیقات صورت گرفته": user_research,
+        })
 
     # ===================== MANAGER =====================
     elif role == "manager":
         st.header("پنل مدیر سامانه")
-        tabs = st.tabs([
-            "میز ارجاع",
-            "نتایج داوری و تایید نهایی",
-            "ثبت داور تخصصی",
-            "مدیریت ویترین (حذف کامنت)",
-            "ویترین دانش (مدیر)",
-            "کاربران و داوران",
-            "پیشنهاد موضوعات",
-            "تحقیقات صورت گرفته",
-            "اسناد",
-            "تالار گفتگو (تایید پیام‌ها)",
-        ])
-
-        with tabs[0]:
+
+        def mgr_referral():
             st.subheader("میز ارجاع مدیر سامانه")
             items = db_submissions_pending_or_waiting_manager()
             if not items:
                 st.info("موردی وجود ندارد.")
             else:
+                a_col1, a_col2 = st.columns([1, 2])
+                auto_n = a_col1.number_input("تعداد داور برای هر محتوا", min_value=1, max_value=5,
+                                             value=SCHED_REFEREES_PER_ITEM, key="auto_n")
+                a_col2.caption("ارجاع خودکار: داوران فعال همان حوزه با کمترین کار باز و سریع‌ترین پاسخ انتخاب می‌شوند.")
+                if a_col2.button("⚡ ارجاع خودکار همه موارد در انتظار", key="auto_all", type="primary"):
+                    n_assigned, no_refs = auto_assign_pending(int(auto_n))
+                    st.success(f"{n_assigned} ارجاع انجام شد ✅")
+                    if no_refs:
+                        st.warning(f"{len(no_refs)} محتوا داور فعال در حوزه خود نداشت.")
+                    rerun_section()
+
+                loads_by_field = referee_loads(sorted({r[7] for r in items}))
+                assigns_by_sub = db_assignments_for_submissions([r[0] for r in items])
                 for row in items:
                     (sid,title,desc,s_phone,s_name,s_nid,topic_id,field_,ctype,
-                     fname,fmime,fbytes,status,likes,views,kcode,created_ts) = row
+                     fname,fmime,fsha,status,likes,views,kcode,created_ts) = row
 
                     if status not in ("pending", "waiting_referee"):
                         continue
@@ -1197,18 +4046,23 @@ if st.session_state.page == "صفحه اصلی":
                     with st.expander(f"📌 {title} | {status_fa(status)} | {field_}"):
                         st.caption(f"فرستنده: {s_name} ({s_phone}) | نوع: {ctype}")
                         st.write(desc)
-                        if fbytes:
-                            st.download_button("دانلود فایل پیوست", data=fbytes, file_name=fname or "file", key=f"dl_sub_{sid}")
+                        if fsha:
+                            blob_download_button("دانلود فایل پیوست", fsha, fname or "file", key=f"dl_sub_{sid}")
 
-                        refs = db_referees_by_field(field_)
+                        refs = loads_by_field[field_]
                         if not refs:
                             st.warning("برای این حوزه داور فعالی ثبت نشده.")
                         else:
-                            options = [(f"{r[0]} {r[1]} ({r[4]})", r[2], f"{r[0]} {r[1]}", r[4]) for r in refs]
+                            already = [a[2] for a in assigns_by_sub[sid]]
+                            if already:
+                                st.caption("ارجاع شده به: " + "، ".join(a[3] for a in assigns_by_sub[sid]))
+                            refs = sorted(refs, key=lambda r: (r.score, r.last_assigned_ts, r.phone))
+                            proposed = propose_referees(refs, int(auto_n), already)
                             chosen = st.multiselect(
-                                "انتخاب داور/داوران",
-                                options,
-                                format_func=lambda x: x[0],
+                                "انتخاب داور/داوران (پیشنهاد سیستم از قبل انتخاب شده)",
+                                refs,
+                                default=proposed,
+                                format_func=RefereeLoad.label,
                                 key=f"ms_{sid}",
                             )
 
@@ -1216,23 +4070,25 @@ if st.session_state.page == "صفحه اصلی":
                                 if not chosen:
                                     st.error("حداقل یک داور انتخاب کن.")
                                 else:
-                                    for item in chosen:
-                                        _, rphone, rname, rfield = item
-                                        db_assignment_create(make_id("a"), sid, normalize_phone(rphone), rname, rfield)
-                                    db_submission_set_status(sid, "waiting_referee")
-                                    st.success("ارجاع انجام شد ✅")
-                                    st.rerun()
-
-        with tabs[1]:
+                                    n_new = db_assign_many([(sid, normalize_phone(r.phone), r.name, r.field) for r in chosen],
+                                                           (status,))
+                                    if n_new:
+                                        st.success(f"{n_new} ارجاع انجام شد ✅")
+                                    else:
+                                        st.warning("این محتوا در این فاصله تغییر کرده یا به همین داورها ارجاع شده است.")
+                                    rerun_section()
+
+        def mgr_results():
             st.subheader("نتایج داوری و تایید نهایی")
             items = db_submissions_pending_or_waiting_manager()
             found = False
+            assigns_by_sub = db_assignments_for_submissions([r[0] for r in items])
 
             for row in items:
                 (sid,title,desc,s_phone,s_name,s_nid,topic_id,field_,ctype,
-                 fname,fmime,fbytes,status,likes,views,kcode,created_ts) = row
+                 fname,fmime,fsha,status,likes,views,kcode,created_ts) = row
 
-                assigns = db_assignments_for_submission(sid)
+                assigns = assigns_by_sub[sid]
                 if not assigns:
                     continue
 
@@ -1277,16 +4133,16 @@ if st.session_state.page == "صفحه اصلی":
                             else:
                                 db_submission_publish(sid, mgr_code.strip())
                                 st.success("منتشر شد ✅")
-                                st.rerun()
+                                rerun_section()
                         else:
                             db_submission_set_status(sid, manager_choice)
                             st.success("ثبت شد ✅")
-                            st.rerun()
+                            rerun_section()
 
             if not found:
                 st.info("فعلاً نتیجه داوری قابل تصمیم‌گیری وجود ندارد.")
 
-        with tabs[2]:
+        def mgr_referee_add():
             st.subheader("ثبت داور تخصصی / نخبگان (با رمز عبور)")
             c1, c2 = st.columns(2)
             with c1:
@@ -1308,17 +4164,18 @@ if st.session_state.page == "صفحه اصلی":
                 else:
                     db_referee_upsert(p, first.strip(), last.strip(), n, field_sel, ref_pass, active)
                     st.success("داور ثبت شد ✅ (می‌تواند وارد شود)")
-                    st.rerun()
+                    rerun_section()
 
-        with tabs[3]:
+        def mgr_comments():
             st.subheader("مدیریت ویترین دانش (حذف کامنت)")
-            published = db_submissions_published()
+            published, has_more = showcase_page("mgr_comments")
             if not published:
                 st.info("محتوایی جهت مدیریت نظرات یافت نشد.")
             else:
+                comments_by_sub = db_comments_for_many([r[0] for r in published])
                 for row in published:
                     sid, title = row[0], row[1]
-                    comments = db_comments_for(sid)
+                    comments = comments_by_sub[sid]
                     with st.expander(f"نظرات محتوای: {title}"):
                         if not comments:
                             st.caption("نظری برای این محتوا ثبت نشده است.")
@@ -1329,59 +4186,48 @@ if st.session_state.page == "صفحه اصلی":
                                 if col_c2.button("🗑 حذف", key=f"del_c_{cid}"):
                                     db_comment_delete(cid)
                                     st.success("نظر حذف شد ✅")
-                                    st.rerun()
+                                    rerun_section()
+            showcase_pager_nav("mgr_comments", published, has_more)
 
         
         # ویترین دانش (مدیر) - مشاهده/حذف محتوا
-        with tabs[4]:
+        def mgr_showcase():
             st.subheader("ویترین دانش (مدیر)")
-            published = db_submissions_published()
+            published, has_more = showcase_page("mgr_showcase")
             if not published:
                 st.info("فعلاً محتوایی منتشر نشده.")
             else:
                 for row in published:
                     (sid,title,desc,s_phone,s_name,s_nid,topic_id,field_,ctype,
-                     fname,fmime,fbytes,status,likes,views,kcode,created_ts) = row
+                     fname,fmime,fsha,status,likes,views,kcode,created_ts) = row
 
                     with st.expander(f"📌 {title} | {field_} | کد: {kcode or '-'}"):
                         st.caption(f"فرستنده: {s_name} ({s_phone}) | نوع: {ctype} | تاریخ: {ts_str(created_ts)}")
                         st.write(desc)
 
-                        if fbytes and fmime:
-                            render_media(fbytes, fmime, fname or "")
+                        if fsha and fmime:
+                            render_media(fsha, fmime, fname or "")
 
                         c1, c2 = st.columns([1, 1])
                         if c1.button("🗑 حذف محتوا از ویترین", key=f"del_sub_{sid}", type="primary", use_container_width=True):
                             db_submission_delete(sid)
                             st.success("محتوا حذف شد ✅")
-                            st.rerun()
+                            rerun_section()
 
                         if c2.button("↩️ برگرداندن به وضعیت نیاز به اصلاح", key=f"to_corr_{sid}", use_container_width=True):
                             db_submission_set_status(sid, "correction_needed")
                             st.success("وضعیت تغییر کرد ✅")
-                            st.rerun()
+                            rerun_section()
+            showcase_pager_nav("mgr_showcase", published, has_more)
 
         # مدیریت کاربران و داوران + خروجی اکسل
-        with tabs[5]:
+        def mgr_people():
             st.subheader("کاربران و داوران")
 
             st.markdown("### کاربران سامانه")
             users = db_users_all()
             if users:
-                # خروجی اکسل ساده
-                import io
-                from openpyxl import Workbook
-
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "users"
-                ws.append(["phone", "name", "nid", "password", "created_ts"])
-                for (ph, nm, nid, pw, cts) in users:
-                    ws.append([ph, nm, nid, pw, ts_str(cts)])
-                bio_buf = io.BytesIO()
-                wb.save(bio_buf)
-                bio_buf.seek(0)
-                st.download_button("⬇️ دانلود اکسل کاربران", data=bio_buf.getvalue(), file_name="users.xlsx")
+                export_button("⬇️ دانلود اکسل کاربران", "users")
 
                 st.caption("ویرایش اطلاعات کاربر")
                 u_phone = st.selectbox("انتخاب کاربر", [u[0] for u in users], key="sel_user_phone")
@@ -1392,7 +4238,7 @@ if st.session_state.page == "صفحه اصلی":
                 if st.button("💾 ذخیره تغییرات کاربر", type="primary"):
                     db_user_update(u_phone, u_name.strip(), u_nid.strip(), u_pass)
                     st.success("ذخیره شد ✅")
-                    st.rerun()
+                    rerun_section()
             else:
                 st.info("کاربری ثبت نشده است.")
 
@@ -1401,32 +4247,47 @@ if st.session_state.page == "صفحه اصلی":
             st.markdown("### داوران")
             refs = db_referees_all()
             if refs:
-                import io
-                from openpyxl import Workbook
-
-                wb = Workbook()
-                ws = wb.active
-                ws.title = "referees"
-                ws.append(["first_name","last_name","phone","nid","field","password","is_active","created_ts"])
-                for (fn, ln, ph, nid, fld, pw, active, cts) in refs:
-                    ws.append([fn, ln, ph, nid, fld, pw, active, ts_str(cts)])
-                bio_buf = io.BytesIO()
-                wb.save(bio_buf)
-                bio_buf.seek(0)
-                st.download_button("⬇️ دانلود اکسل داوران", data=bio_buf.getvalue(), file_name="referees.xlsx")
+                export_button("⬇️ دانلود اکسل داوران", "referees")
 
                 st.caption("حذف داور")
                 r_phone = st.selectbox("انتخاب داور", [r[2] for r in refs], key="sel_ref_phone")
                 if st.button("🗑 حذف داور", key="btn_del_ref", type="primary"):
                     db_referee_delete(r_phone)
                     st.success("حذف شد ✅")
-                    st.rerun()
+                    rerun_section()
             else:
                 st.info("داوری ثبت نشده است.")
 
+            st.divider()
+
+            st.markdown("### خروجی‌های اکسل")
+            st.caption("فایل هنگام کلیک ساخته می‌شود.")
+            ex_cols = st.columns(3)
+            for col, name in zip(ex_cols, ("submissions", "assignments", "review_scores")):
+                with col:
+                    export_button(f"⬇️ {EXPORTS[name].label}", name)
+
+            st.divider()
 
-# پیشنهاد موضوعات (مدیر)
-        with tabs[6]:
+            st.markdown("### ورود گروهی از اکسل")
+            st.caption("سطر اول عنوان ستون‌هاست؛ فایل خروجی اکسل کاربران/داوران به عنوان الگو قابل استفاده است.")
+            im_kind = st.selectbox("نوع", list(IMPORTS), format_func=lambda k: IMPORTS[k].label, key="im_kind")
+            st.caption("ستون‌ها: " + ", ".join(IMPORTS[im_kind].columns))
+            im_file = st.file_uploader("فایل اکسل (.xlsx)", type=["xlsx"], key="im_file")
+            if im_file and st.button("📥 ورود اطلاعات", key="im_run", type="primary"):
+                try:
+                    report = import_xlsx(im_kind, im_file)
+                except Exception as e:
+                    st.error(f"فایل قابل خواندن نیست: {e}")
+                else:
+                    st.success(f"{report.imported} ردیف از {report.rows_read} ثبت شد ✅ "
+                               f"({report.seconds:.2f} ثانیه، {report.rows_per_s:,.0f} ردیف در ثانیه)")
+                    if report.errors:
+                        st.warning(f"{len(report.errors)} ردیف خطا داشت:")
+                        st.dataframe([{"سطر": n, "خطا": msg} for (n, msg) in report.errors], use_container_width=True)
+
+        # پیشنهاد موضوعات (مدیر)
+        def mgr_topics():
             st.subheader("مدیریت موضوعات پیشنهادی")
             with st.form("mgr_topic_form"):
                 mt_title = st.text_input("عنوان موضوع")
@@ -1444,13 +4305,14 @@ if st.session_state.page == "صفحه اصلی":
                             mt_field,
                             mt_desc.strip(),
                             mt_file.name if mt_file else "",
-                            mt_file.getvalue() if mt_file else None
+                            mt_file,
+                            mt_file.type if mt_file else ""
                         )
                         st.success("موضوع با موفقیت منتشر شد ✅")
-                        st.rerun()
+                        rerun_section()
 
         # تحقیقات (مدیر)
-        with tabs[7]:
+        def mgr_research():
             st.subheader("مدیریت تحقیقات صورت گرفته")
             with st.form("mgr_res_form"):
                 mr_title = st.text_input("عنوان تحقیق")
@@ -1468,13 +4330,14 @@ if st.session_state.page == "صفحه اصلی":
                             mr_field,
                             mr_summary.strip(),
                             mr_file.name if mr_file else "",
-                            mr_file.getvalue() if mr_file else None
+                            mr_file,
+                            mr_file.type if mr_file else ""
                         )
                         st.success("تحقیق ثبت شد ✅")
-                        st.rerun()
+                        rerun_section()
 
         # اسناد (مدیر)
-        with tabs[8]:
+        def mgr_docs():
             st.subheader("بارگذاری اسناد و نشریات تخصصی")
             with st.form("mgr_doc_form"):
                 md_title = st.text_input("عنوان سند/آیین‌نامه")
@@ -1484,12 +4347,12 @@ if st.session_state.page == "صفحه اصلی":
                     if not md_title.strip() or not md_file:
                         st.error("عنوان و فایل الزامی است")
                     else:
-                        db_doc_insert(make_id("doc"), md_title.strip(), md_file.name, md_file.getvalue())
+                        db_doc_insert(make_id("doc"), md_title.strip(), md_file.name, md_file, md_file.type or "")
                         st.success("سند با موفقیت بارگذاری شد ✅")
-                        st.rerun()
+                        rerun_section()
 
         # تایید پیام‌های تالار (مدیر)
-        with tabs[9]:
+        def mgr_forum():
             st.subheader("مدیریت و تایید پیام‌های تالار گفتگو")
             pend_posts = db_forum_posts("pending")
             if not pend_posts:
@@ -1502,46 +4365,191 @@ if st.session_state.page == "صفحه اصلی":
                         f_col1, f_col2 = st.columns(2)
                         if f_col1.button("✅ تایید انتشار عمومی", key=f"fok_{p[0]}", type="primary", use_container_width=True):
                             db_forum_set_status(p[0], "approved")
-                            st.rerun()
+                            rerun_section()
                         if f_col2.button("❌ رد پیام", key=f"fno_{p[0]}", use_container_width=True):
                             db_forum_set_status(p[0], "rejected")
-                            st.rerun()
+                            rerun_section()
+
+        # داشبورد (فقط از جدول submission_stats)
+        def mgr_dashboard():
+            st.subheader("داشبورد وضعیت محتواها")
+            stats = db_submission_stats()
+            if not stats:
+                st.info("هنوز محتوایی ثبت نشده است.")
+            else:
+                by_status, by_field, by_type = {}, {}, {}
+                for (fld, stt, ctype, n) in stats:
+                    by_status[stt] = by_status.get(stt, 0) + n
+                    by_field.setdefault(fld, {})
+                    by_field[fld][stt] = by_field[fld].get(stt, 0) + n
+                    by_type[ctype] = by_type.get(ctype, 0) + n
+
+                dash_statuses = ["pending", "waiting_referee", "waiting_manager", "correction_needed", "published", "rejected"]
+                dash_statuses += sorted(x for x in by_status if x not in dash_statuses)
+                m_cols = st.columns(len(dash_statuses))
+                for col, stt in zip(m_cols, dash_statuses):
+                    col.metric(status_fa(stt), by_status.get(stt, 0))
+
+                st.markdown("### به تفکیک حوزه")
+                st.dataframe(
+                    [{"حوزه": fld, **{status_fa(stt): by_field[fld].get(stt, 0) for stt in dash_statuses},
+                      "جمع": sum(by_field[fld].values())}
+                     for fld in sorted(by_field, key=lambda f: FIELDS.index(f) if f in FIELDS else len(FIELDS))],
+                    use_container_width=True, hide_index=True,
+                )
+
+                st.markdown("### به تفکیک نوع محتوا")
+                st.dataframe(
+                    [{"نوع محتوا": ctype, "تعداد": n} for ctype, n in sorted(by_type.items(), key=lambda x: -x[1])],
+                    use_container_width=True, hide_index=True,
+                )
+
+            st.markdown("### زمان اجرای بخش‌ها")
+            st.caption("در هر تعامل فقط بخش فعال اجرا می‌شود؛ «جزئی» یعنی اجرای همان بخش (fragment) بدون اجرای کل صفحه.")
+            boot = app_bootstrap()
+            st.caption(f"راه‌اندازی پروسه: {boot.seconds * 1000:.0f} ms | نسخه schema: {boot.schema_to}")
+            timings = section_timer().snapshot()
+            if timings:
+                st.dataframe(
+                    [{"بخش": t.name, "اجرا": t.runs, "جزئی": t.fragment_runs, "میانگین (ms)": round(t.mean_ms, 1),
+                      "آخرین (ms)": round(t.last_ms, 1), "بیشینه (ms)": round(t.max_ms, 1)} for t in timings],
+                    use_container_width=True, hide_index=True,
+                )
+
+        def mgr_diagnostics():
+            st.subheader("عیب‌یابی کارایی (کوئری‌ها)")
+            prof = query_profiler()
+            on = st.toggle("ثبت کوئری‌ها", value=prof.enabled,
+                           help="برای همه sessionها؛ در حالت خاموش اتصال‌ها بدون هیچ لایه اضافه‌ای استفاده می‌شوند.")
+            if on != prof.enabled:
+                prof.enabled = on
+            if st.button("پاک کردن آمار", key="profiler_reset"):
+                prof.reset()
+                rerun_section()
+
+            writer = db_writer()
+            if writer is not None:
+                st.markdown("### صف نوشتن")
+                ws = writer.stats()
+                w1, w2, w3, w4 = st.columns(4)
+                w1.metric("در صف", ws.depth, help=f"بیشینه: {ws.max_depth}")
+                w2.metric("میانگین دسته", f"{ws.mean_batch:.1f}", help=f"{ws.batches} commit، بیشینه {ws.max_batch}")
+                w3.metric("commit p50 / p95 (ms)", f"{ws.commit_p50_ms:.1f} / {ws.commit_p95_ms:.1f}")
+                w4.metric("تا ماندگاری p50 / p95 (ms)", f"{ws.wait_p50_ms:.1f} / {ws.wait_p95_ms:.1f}")
+                st.caption(f"{ws.ops} نوشتن موفق، {ws.failed} ناموفق؛ "
+                           f"کوئری‌های نوشتن روی thread نوشتن اجرا می‌شوند و در اجرای صفحه ثبت نمی‌شوند.")
+
+            slow = slow_query_log()
+            if slow is not None:
+                st.markdown("### کوئری‌های کند")
+                st.caption(f"کندتر از {SLOW_QUERY_MS:.0f} ms، هر {SLOW_QUERY_FLUSH_S:.0f} ثانیه در "
+                           f"{SLOW_QUERY_LOG_PATH} نوشته می‌شوند (تکرارها یک سطر).")
+                slow_rows = slow.recent()
+                if slow_rows:
+                    st.dataframe(
+                        [{"آخرین": time.strftime("%H:%M:%S", time.localtime(e["last_ts"])), "SQL": e["sql"],
+                          "تعداد": e["count"], "بیشینه (ms)": round(e["max_ms"], 1), "محل": " | ".join(e["sites"]),
+                          "plan": " / ".join(e["plan"]), "نوشته نشده": e.get("pending", False)} for e in slow_rows],
+                        use_container_width=True, hide_index=True,
+                    )
+
+            recent = prof.recent()
+            if not recent:
+                st.info("هنوز اجرایی ثبت نشده است؛ ثبت را روشن کنید و در صفحات جابه‌جا شوید.")
+                return
+
+            m1, m2, m3 = st.columns(3)
+            m1.metric("اجراهای اخیر", len(recent))
+            m2.metric("میانگین زمان اجرا (ms)", f"{sum(r.seconds for r in recent) / len(recent) * 1000:.0f}")
+            m3.metric("میانگین کوئری در هر اجرا", f"{sum(r.queries for r in recent) / len(recent):.1f}")
+
+            st.markdown("### به تفکیک صفحه")
+            st.dataframe(
+                [{"صفحه": p.page, "بخش": p.section, "جزئی": p.fragment, "اجرا": p.reruns,
+                  "میانگین (ms)": round(p.mean_ms, 1), "بیشینه (ms)": round(p.max_ms, 1),
+                  "کوئری در هر اجرا": round(p.mean_queries, 1), "زمان DB (ms)": round(p.mean_db_ms, 1)}
+                 for p in prof.pages()],
+                use_container_width=True, hide_index=True,
+            )
+
+            st.markdown("### پرهزینه‌ترین کوئری‌ها")
+            st.caption("زمان هر کوئری شامل اجرا و خواندن همه ردیف‌هاست؛ کوئری‌های هم‌ساختار با هم جمع شده‌اند.")
+            st.dataframe(
+                [{"تابع": q.caller, "SQL": q.sql, "پارامترها": q.shape, "تعداد": q.calls,
+                  "مجموع (ms)": round(q.total_ms, 1), "میانگین (ms)": round(q.mean_ms, 2),
+                  "بیشینه (ms)": round(q.max_ms, 1), "ردیف": q.rows, "KB": round(q.bytes / 1024, 1)}
+                 for q in prof.top_queries()],
+                use_container_width=True, hide_index=True,
+            )
+
+            st.markdown("### آخرین اجراها")
+            st.dataframe(
+                [{"زمان": time.strftime("%H:%M:%S", time.localtime(r.wall)), "صفحه": r.page, "بخش": r.section,
+                  "جزئی": r.fragment, "کل (ms)": round(r.seconds * 1000, 1), "کوئری": r.queries,
+                  "DB (ms)": round(r.db_seconds * 1000, 1), "کامل": r.complete} for r in recent],
+                use_container_width=True, hide_index=True,
+            )
+            pick = st.selectbox(
+                "کوئری‌های یک اجرا", range(len(recent)), key="profiler_rerun",
+                format_func=lambda i: f"{time.strftime('%H:%M:%S', time.localtime(recent[i].wall))} | "
+                                      f"{recent[i].page} {recent[i].section} | {recent[i].queries} کوئری",
+            )
+            st.dataframe(
+                [{"محل": ev.site, "SQL": " ".join(ev.sql.split()), "پارامترها": ev.shape,
+                  "ms": round(ev.seconds * 1000, 2), "ردیف": ev.rows, "بایت": ev.bytes} for ev in recent[pick].events],
+                use_container_width=True, hide_index=True,
+            )
+
+        render_sections("manager", {
+            "میز ارجاع": mgr_referral,
+            "نتایج داوری و تایید نهایی": mgr_results,
+            "ثبت داور تخصصی": mgr_referee_add,
+            "مدیریت ویترین (حذف کامنت)": mgr_comments,
+            "ویترین دانش (مدیر)": mgr_showcase,
+            "کاربران و داوران": mgr_people,
+            "پیشنهاد موضوعات": mgr_topics,
+            "تحقیقات صورت گرفته": mgr_research,
+            "اسناد": mgr_docs,
+            "تالار گفتگو (تایید پیام‌ها)": mgr_forum,
+            "داشبورد": mgr_dashboard,
+            "عیب‌یابی کارایی": mgr_diagnostics,
+        })
 
     # ===================== REFEREE (پنل داوری) =====================
     elif st.session_state.role == "referee":
         st.header("پنل داوری تخصصی نخبگان دانشی")
-        tasks = db_assignments_for_referee(st.session_state.phone)
 
-        if not tasks:
-            st.info("محتوایی جهت ارزیابی به شما ارجاع نشده است.")
-        else:
+        def referee_tasks():
             ref_l, ref_r = st.columns([1.5, 2.5])
             with ref_l:
                 st.subheader("لیست ارجاعات شما")
-                for t in tasks:
-                    assign_id, sid = t[0], t[1]
-                    decision = t[5]
-                    title = t[11]
+                tasks, tasks_more = referee_tasks_page("ref_tasks", st.session_state.phone)
+                if not tasks:
+                    st.info("محتوایی جهت ارزیابی به شما ارجاع نشده است.")
+                for (assign_id, sid, decision, a_created, title, a_field) in tasks:
                     if st.button(f"📄 {title}\n({status_fa(decision)})", key=f"open_{assign_id}", use_container_width=True):
                         st.session_state.selected_submission_id = assign_id
-                        st.rerun()
+                        rerun_section()
+                showcase_pager_nav("ref_tasks", tasks, tasks_more, cursor=lambda r: (r[3], r[0]))
 
             with ref_r:
-                if not st.session_state.selected_submission_id:
+                target = None
+                if st.session_state.selected_submission_id:
+                    target = db_referee_task(st.session_state.selected_submission_id, st.session_state.phone)
+                if target is None:
                     st.info("یک مورد را برای ارزیابی انتخاب کنید.")
                 else:
-                    target = [x for x in tasks if x[0] == st.session_state.selected_submission_id][0]
-                    # (a.id[0], a.submission_id[1], ..., s.title[11], s.desc[12], s.name[13], ph[14], field[15], type[16], fname[17], fmime[18], fbytes[19])
+                    # (a.id[0], a.submission_id[1], ..., s.title[11], s.desc[12], s.name[13], ph[14], field[15], type[16], fname[17], fmime[18], fsha[19])
                     st.subheader(f"ارزیابی: {target[11]}")
                     st.caption(f"فرستنده: {target[13]} | حوزه: {target[15]} | نوع: {target[16]}")
                     st.write(f"**شرح محتوا:**\n{target[12]}")
-                    if target[19]: # file_bytes
-                        st.download_button("📩 دریافت فایل ارسالی کاربر", data=target[19], file_name=target[17] or "content", key=f"dl_ref_{target[0]}")
-                    
+                    if target[19]: # file_sha256
+                        blob_download_button("📩 دریافت فایل ارسالی کاربر", target[19], target[17] or "content", key=f"dl_ref_{target[0]}")
+                
                     st.divider()
                     st.subheader("ثبت نتیجه ارزیابی")
-                    rev_status = st.selectbox("نظر شما:", ["waiting_referee", "correction_needed", "rejected", "recommend_publish"], 
-                                             index=0, format_func=lambda x: {"waiting_referee":"در حال بررسی", "correction_needed":"نیاز به اصلاح", "rejected":"عدم تایید", "recommend_publish":"تایید و پیشنهاد انتشار"}[x])
+                    rev_status = st.selectbox("نظر شما:", list(REFEREE_DECISIONS),
+                                             index=0, format_func=REFEREE_DECISIONS.get)
                     rev_feedback = st.text_area("نکات اصلاحی / دلایل داوری (برای کاربر نمایش داده می‌شود)", value=target[6] or "")
                     rev_score = st.number_input("امتیاز تخصصی (۰ تا ۱۰۰)", 0, 100, int(target[7] or 0))
                     rev_code = st.text_input("کد دانشی پیشنهادی (الزامی برای انتشار)", value=target[8] or "")
@@ -1555,7 +4563,9 @@ if st.session_state.page == "صفحه اصلی":
                             m_status = "waiting_manager" if rev_status == "recommend_publish" else rev_status
                             db_submission_set_status(target[1], m_status)
                             st.success("ارزیابی شما با موفقیت ثبت شد و به مدیر سامانه ارجاع یافت ✅")
-                            st.rerun()
+                            rerun_section()
+
+        render_sections("referee", {"ارجاعات من": referee_tasks})
 
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -1589,6 +4599,7 @@ elif st.session_state.page == "تالار گفتگو":
     if not approved_posts:
         st.info("هنوز پیامی تایید نشده.")
     else:
+        replies_by_post = db_forum_replies_for_posts([ap[0] for ap in approved_posts])
         for ap in approved_posts:
             post_id = ap[0]
             sender_name = ap[2]
@@ -1601,7 +4612,7 @@ elif st.session_state.page == "تالار گفتگو":
                 st.write(text)
                 st.caption(f"زمان: {ts_str(created_ts)}")
                 # Replies
-                replies = db_forum_replies(post_id)
+                replies = replies_by_post[post_id]
                 if replies:
                     st.subheader("پاسخ‌ها")
                     for rep in replies:
@@ -1650,22 +4661,20 @@ elif st.session_state.page == "مشاهده محتوا":
         st.info("محتوایی انتخاب نشده است.")
     else:
         # fetch from DB
-        conn = db_conn()
-        row = conn.execute(
-            "SELECT id,title,description,field,content_type,file_name,file_mime,file_bytes,likes,views,knowledge_code,created_ts "
-            "FROM submissions WHERE id=?",
-            (sid,),
-        ).fetchone()
-        conn.close()
+        with db_conn() as conn:
+            row = conn.execute(
+                "SELECT id,title,description,field,content_type,file_name,file_mime,file_sha256,likes,views,knowledge_code,created_ts "
+                "FROM submissions WHERE id=?",
+                (sid,),
+            ).fetchone()
 
         if not row:
             st.error("محتوا پیدا نشد.")
         else:
-            (_sid, title, desc, field_, ctype, fname, fmime, fbytes, likes, views, kcode, created_ts) = row
+            (_sid, title, desc, field_, ctype, fname, fmime, fsha, likes, views, kcode, created_ts) = row
 
-            # افزایش بازدید فقط در صفحه مشاهده
-            db_submission_inc_view(_sid)
-            views += 1
+            record_view(_sid)
+            views += view_counter().pending(_sid)
 
             if st.button("⬅️ بازگشت", use_container_width=True):
                 set_page("صفحه اصلی")
@@ -1675,8 +4684,8 @@ elif st.session_state.page == "مشاهده محتوا":
             st.caption(f"{field_} | نوع محتوا: {ctype} | کد دانشی: {kcode or '-'} | بازدید: {views} | تاریخ: {ts_str(created_ts)}")
             st.write(desc)
 
-            if fbytes and fmime:
-                render_media(fbytes, fmime, fname or "")
+            if fsha and fmime:
+                render_media(fsha, fmime, fname or "", variant="medium")
 
             st.divider()
 
@@ -1706,6 +4715,55 @@ elif st.session_state.page == "مشاهده محتوا":
     st.markdown("</div>", unsafe_allow_html=True)
 
 
+# =========================================================
+# Page: Search
+# =========================================================
+elif st.session_state.page == "جستجو":
+    st.markdown('<div class="panel">', unsafe_allow_html=True)
+    st.header("جستجو")
+
+    sq = st.text_input("عبارت جستجو", key="search_q", placeholder="مثلاً: بتن، ایمنی کارگاه، BIM ...")
+    c1, c2 = st.columns([3, 1])
+    s_kinds = c1.multiselect("جستجو در", list(SEARCH_KINDS), default=list(SEARCH_KINDS),
+                             format_func=SEARCH_KINDS.get, key="search_kinds")
+    s_size = c2.selectbox("تعداد در هر صفحه", [10, 20, 50], key="search_size")
+
+    # با تغییر عبارت یا فیلترها به صفحه اول برمی‌گردیم
+    s_sig = (sq, tuple(s_kinds), s_size)
+    if st.session_state.get("_search_sig") != s_sig:
+        st.session_state._search_sig = s_sig
+        st.session_state._search_offset = 0
+    s_offset = st.session_state.get("_search_offset", 0)
+
+    if sq.strip():
+        results, s_more = db_search(sq, s_kinds, limit=s_size, offset=s_offset)
+        if not results:
+            st.info("نتیجه‌ای پیدا نشد.")
+
+        def _hl(snippet: str) -> str:
+            safe = html.escape(snippet or "")
+            return safe.replace(SEARCH_MARK[0], "<mark>").replace(SEARCH_MARK[1], "</mark>")
+
+        for (kind, ref_id, rank, t_snip, b_snip) in results:
+            with st.container(border=True):
+                st.caption(SEARCH_KINDS.get(kind, kind))
+                st.markdown(f"**{_hl(t_snip)}**", unsafe_allow_html=True)
+                st.markdown(_hl(b_snip), unsafe_allow_html=True)
+                if kind == "submission" and st.button("🔎 مشاهده محتوا", key=f"search_open_{ref_id}"):
+                    st.session_state.selected_submission_id = ref_id
+                    set_page("مشاهده محتوا")
+                    st.rerun()
+
+        n1, n2 = st.columns(2)
+        if s_offset > 0 and n1.button("➡️ صفحه قبل", key="search_prev", use_container_width=True):
+            st.session_state._search_offset = max(0, s_offset - s_size)
+            st.rerun()
+        if s_more and n2.button("نتایج بیشتر ⬅️", key="search_next", use_container_width=True):
+            st.session_state._search_offset = s_offset + s_size
+            st.rerun()
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
 # =========================================================
 # PAGE: PROFILE (پروفایل)
 # =========================================================
@@ -1724,3 +4782,4 @@ elif st.session_state.page == "پروفایل":
     st.markdown("</div>", unsafe_allow_html=True)
 
 st.markdown('</div>', unsafe_allow_html=True) # End Shell
+query_profiler().finish(_rerun_profile)